@@ -1,7 +1,6 @@
 import os
 from flask import Flask
 from dotenv import load_dotenv
-from pymongo import MongoClient
 
 load_dotenv()
 
@@ -19,14 +18,56 @@ def create_app():
     app.config['LLM_PROVIDER'] = os.getenv('LLM_PROVIDER', 'hf')
     app.config['HF_TOKEN'] = os.getenv('HF_TOKEN')
 
-    # MongoDB
-    mongo_uri = os.getenv("MONGO_URI", "mongodb://localhost:27017")
-    mongo_dbname = os.getenv("MONGO_DB", "llm_terraform")
-    mongo_client = MongoClient(mongo_uri)
-    app.mongo = mongo_client[mongo_dbname]
+    # MongoDB (connected on first use, see app.db)
+    app.config['MONGO_URI'] = os.getenv("MONGO_URI", "mongodb://localhost:27017")
+    app.config['MONGO_DB'] = os.getenv("MONGO_DB", "llm_terraform")
+    app.config['MONGO_APPNAME'] = os.getenv("MONGO_APPNAME", "llm-terraform")
+    for key, default in (
+        ("MONGO_MAX_POOL_SIZE", "50"),
+        ("MONGO_MIN_POOL_SIZE", "0"),
+        ("MONGO_MAX_IDLE_TIME_MS", "300000"),
+        ("MONGO_CONNECT_TIMEOUT_MS", "5000"),
+        ("MONGO_SOCKET_TIMEOUT_MS", None),
+        ("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"),
+        ("MONGO_WAIT_QUEUE_TIMEOUT_MS", None),
+    ):
+        value = os.getenv(key, default)
+        app.config[key] = int(value) if value is not None else None
+    from app import db
+    db.init_app(app)
+
+    # Background threads below start on the first request each serving
+    # process handles, never here (CLI commands, pre-fork masters)
+    from app import background
+    background.init_app(app)
 
     # Register Flask blueprint (contains auth, dashboard, prompt routes)
     from app.main import main_bp
     app.register_blueprint(main_bp)
 
+    # Page templates, compiled once and bytecode-cached
+    from app import templating
+    templating.init_app(app)
+
+    # Background worker pool for /generate jobs
+    from app import jobs
+    jobs.init_app(app)
+
+    # Background poller for Terraform Cloud run status
+    from app import run_tracker
+    run_tracker.init_app(app)
+
+    # Periodic Mongo <-> Terraform Cloud workspace reconciliation
+    # (and CLI: flask reconcile-workspaces)
+    from app import reconcile
+    reconcile.init_app(app)
+
+    # Generation history retention/compaction (and CLI: flask compact-history)
+    from app import history
+    history.init_app(app)
+
+    # CLI: flask migrate-workspaces
+    from app import migrations
+    migrations.init_app(app)
+
     return app
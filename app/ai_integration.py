@@ -1,8 +1,145 @@
 import os
-import requests
 import json
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from app import llm_cache
+from app.http_client import PooledClient
+from app.metrics import span, timed
+from app.model_router import ModelRouter
+from app.rate_limit import RateLimiter, store_from_env
+from app.utils.validator import simple_hcl_sanity_check
+
+API_URL = os.getenv("HF_API_URL", "https://router.huggingface.co/v1/chat/completions")
+# Candidate HF router models, comma separated; the first also names the cache entries.
+MODELS = [
+    m.strip() for m in os.getenv("LLM_MODELS", "openai/gpt-oss-120b:groq").split(",") if m.strip()
+]
+MODEL = MODELS[0]
+SYSTEM_PROMPT = (
+    "You are a Terraform expert. "
+    "Respond ONLY with valid Terraform HCL. "
+    "No comments, no markdown, no explanations. "
+    "If not Terraform-related, respond with empty string."
+)
+
+client = PooledClient(
+    pool_size=int(os.getenv("HF_POOL_SIZE", "4")),
+    max_retries=int(os.getenv("HF_MAX_RETRIES", "2")),
+    default_timeout=(5, 60),
+    name="huggingface",
+    rate_limiter=RateLimiter(
+        "huggingface",
+        rate=float(os.getenv("HF_RATE_LIMIT", "5")),
+        store=store_from_env(),
+    ),
+)
+
+# Per-process cap on concurrent LLM calls; further callers queue for a slot.
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "120"))
+_slots = threading.BoundedSemaphore(LLM_MAX_CONCURRENCY)
+
+# cache key -> _Flight for generations in progress, shared by identical requests.
+_flights = {}
+_flights_lock = threading.Lock()
+
+router = ModelRouter(MODELS)
+_attempt_pool = ThreadPoolExecutor(max_workers=LLM_MAX_CONCURRENCY * 2, thread_name_prefix="llm")
+
+_stats_lock = threading.Lock()
+_stats = {
+    "calls": 0, "coalesced": 0, "in_flight": 0, "queued": 0, "max_queued": 0,
+    "queue_timeouts": 0, "total_wait": 0.0, "max_wait": 0.0,
+}
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def _try_slot():
+    """Takes a free LLM slot without queueing; False if none is free. Pass it on with _llm_slot(taken=True)."""
+    return _slots.acquire(blocking=False)
+
+
+@contextmanager
+def _llm_slot(taken=False):
+    """
+    Holds one of the LLM_MAX_CONCURRENCY slots, waiting up to
+    LLM_QUEUE_TIMEOUT for it; `taken` if the caller already has one from
+    _try_slot().
+    """
+    if not taken:
+        with _stats_lock:
+            _stats["queued"] += 1
+            _stats["max_queued"] = max(_stats["max_queued"], _stats["queued"])
+        start = time.perf_counter()
+        try:
+            with span("llm.queue_wait"):
+                acquired = _slots.acquire(timeout=LLM_QUEUE_TIMEOUT)
+        finally:
+            waited = time.perf_counter() - start
+            with _stats_lock:
+                _stats["queued"] -= 1
+                _stats["total_wait"] += waited
+                _stats["max_wait"] = max(_stats["max_wait"], waited)
+        if not acquired:
+            with _stats_lock:
+                _stats["queue_timeouts"] += 1
+            raise RuntimeError("Too many LLM requests in progress, try again shortly.")
+    with _stats_lock:
+        _stats["calls"] += 1
+        _stats["in_flight"] += 1
+    try:
+        yield
+    finally:
+        with _stats_lock:
+            _stats["in_flight"] -= 1
+        _slots.release()
+
+
+def _single_flight(key, fn):
+    """Runs fn() once for every concurrent caller with the same key."""
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+    if not leader:
+        with _stats_lock:
+            _stats["coalesced"] += 1
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+    try:
+        flight.result = fn()
+        return flight.result
+    except BaseException as e:
+        flight.error = e
+        raise
+    finally:
+        with _flights_lock:
+            _flights.pop(key, None)
+        flight.done.set()
+
+
+def call_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["total_wait"] = round(stats["total_wait"], 3)
+    stats["max_wait"] = round(stats["max_wait"], 3)
+    stats["avg_wait"] = round(stats["total_wait"] / stats["calls"], 3) if stats["calls"] else 0.0
+    stats["max_concurrency"] = LLM_MAX_CONCURRENCY
+    return stats
 
-API_URL = "https://router.huggingface.co/v1/chat/completions"
 
 def _headers():
     token = os.getenv("HF_TOKEN")
@@ -10,42 +147,208 @@ def _headers():
         raise RuntimeError("HF_TOKEN not set in environment")
     return {"Authorization": f"Bearer {token}"}
 
-def _query(payload):
-    r = requests.post(API_URL, headers=_headers(), json=payload, timeout=60)
-    r.raise_for_status()
-    return r.json()
+def _payload(model, prompt):
+    return {
+        "model": model,
+        "stream": True,
+        "messages": [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": f"Write Terraform HCL for: {prompt}"}
+        ],
+    }
 
-def generate_tf_code(prompt: str) -> str:
+def stream_tf_code(prompt: str):
+    """
+    Yields HCL text chunks as the router streams them (server-sent events).
+
+    Closing the generator early closes the upstream connection, which stops
+    token generation for the rest of the response. The stream holds an LLM
+    slot until it ends and uses the currently fastest healthy model.
+    """
+    model = router.ranked()[0]
+    with _llm_slot():
+        try:
+            with span("hf.stream_open"):
+                r = client.post(API_URL, headers=_headers(), json=_payload(model, prompt), stream=True)
+                r.raise_for_status()
+        except Exception as e:
+            router.failed(model)
+            raise RuntimeError(f"Hugging Face API error: {e}")
+        try:
+            yield from _stream_deltas(r)
+        finally:
+            r.close()
+
+def _stream_deltas(r):
+    for line in r.iter_lines(decode_unicode=True):
+        if not line or not line.startswith("data:"):
+            continue
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            break
+        try:
+            event = json.loads(data)
+        except ValueError:
+            continue
+        delta = (event.get("choices") or [{}])[0].get("delta", {}).get("content")
+        if delta:
+            yield delta
+
+@timed("llm.generate")
+def generate_tf_code(prompt: str, bypass_cache: bool = False) -> str:
     """
     Generate ONLY Terraform HCL using a Hugging Face chat-completions compatible endpoint.
     Output contains NO explanations/markdown — only HCL.
+
+    Results that pass the sanity check are cached by normalized prompt, model
+    and system prompt; `bypass_cache=True` forces a fresh generation.
+    Identical requests already in progress share that one upstream call.
+    """
+    key = llm_cache.cache_key(prompt, MODEL, SYSTEM_PROMPT)
+    if bypass_cache:
+        llm_cache.note_bypass()
+    else:
+        cached = llm_cache.get(key)
+        if cached is not None:
+            return cached
+    return _single_flight(key, lambda: _generate(prompt, key))
+
+class _Cancelled(Exception):
+    pass
+
+class _Attempt:
+    """One model's try at a generation, as seen by both _generate and the thread running it."""
+
+    def __init__(self, model, hedge):
+        self.model = model
+        self.hedge = hedge
+        self.cancel = threading.Event()
+        self.sent_at = None  # perf_counter() when the request went out
+        self.response = None
+        self.finished = False  # set by _generate once it has this attempt's outcome
+        self.lock = threading.Lock()
+
+    def stop(self):
+        """
+        Cancels the attempt and closes its stream, which ends generation
+        upstream and frees its slot now rather than at the next token.
+        Returns the seconds since it was sent, or None if it never was.
+        """
+        with self.lock:
+            self.cancel.set()
+            response = self.response
+            sent_at = self.sent_at
+        if response is not None:
+            response.close()
+        return None if sent_at is None else time.perf_counter() - sent_at
+
+def _attempt(attempt, prompt, results, slot_taken=False):
+    """
+    Runs `attempt` and reports to `results` as (attempt, outcome, value):
+    "sent" once the request goes out, then "ok", "rejected", "failed" or
+    "cancelled". Latency is timed from the send, not from the slot queue.
     """
+    model = attempt.model
+    router.started(model, hedge=attempt.hedge)
     try:
-        response = _query({
-            "model": "openai/gpt-oss-120b:groq",  # change to another HF router model if desired
-            "messages": [
-                {
-                    "role": "system",
-                    "content": (
-                        "You are a Terraform expert. "
-                        "Respond ONLY with valid Terraform HCL. "
-                        "No comments, no markdown, no explanations. "
-                        "If not Terraform-related, respond with empty string."
-                    )
-                },
-                {"role": "user", "content": f"Write Terraform HCL for: {prompt}"}
-            ],
-        })
-
-        content = (
-            response.get("choices", [{}])[0]
-            .get("message", {})
-            .get("content", "")
-            .strip()
-        )
+        with _llm_slot(taken=slot_taken), span("llm.attempt"):
+            with attempt.lock:
+                if attempt.cancel.is_set():
+                    raise _Cancelled()
+                attempt.sent_at = time.perf_counter()
+            results.put((attempt, "sent", None))
+            r = client.post(API_URL, headers=_headers(), json=_payload(model, prompt), stream=True)
+            with attempt.lock:
+                attempt.response = r
+            try:
+                if attempt.cancel.is_set():
+                    raise _Cancelled()
+                r.raise_for_status()
+                parts = []
+                for delta in _stream_deltas(r):
+                    if attempt.cancel.is_set():
+                        raise _Cancelled()
+                    parts.append(delta)
+                if attempt.cancel.is_set():
+                    raise _Cancelled()  # stop() closed the stream: what arrived is partial
+            finally:
+                r.close()
+            latency = time.perf_counter() - attempt.sent_at
+        content = "".join(parts).strip()
         if not content:
-            raise RuntimeError(f"No HCL returned. Raw: {json.dumps(response, indent=2)}")
-        return content
-
+            raise RuntimeError("No HCL returned")
+        ok, msg = simple_hcl_sanity_check(content)
+        if not ok:
+            router.failed(model)
+            results.put((attempt, "rejected", (content, msg)))
+            return
     except Exception as e:
-        raise RuntimeError(f"Hugging Face API error: {e}")
+        if attempt.cancel.is_set():
+            # Includes errors from reading a stream stop() closed underneath us.
+            results.put((attempt, "cancelled", None))
+            return
+        router.failed(model)
+        results.put((attempt, "failed", e))
+        return
+    router.succeeded(model, latency)
+    results.put((attempt, "ok", content))
+
+def _generate(prompt, key):
+    """
+    Asks the fastest healthy model first. If it has not answered its p95
+    latency after being sent, the next model is asked as well, but only if
+    an LLM slot is free: a hedge never queues behind other callers. If it
+    fails, the next model is asked instead. The first answer passing the
+    sanity check wins and the other attempt is stopped.
+    """
+    candidates = router.ranked()
+    results = queue.Queue()
+    attempts = []
+    errors = []
+    rejected = None
+    hedge_at = None  # perf_counter() at which to hedge the first attempt
+
+    def launch(hedge=False, slot_taken=False):
+        attempt = _Attempt(candidates[len(attempts)], hedge)
+        attempts.append(attempt)
+        _attempt_pool.submit(_attempt, attempt, prompt, results, slot_taken)
+
+    launch()
+    outstanding = 1
+    while outstanding:
+        timeout = None if hedge_at is None else max(hedge_at - time.perf_counter(), 0)
+        try:
+            attempt, outcome, value = results.get(timeout=timeout)
+        except queue.Empty:
+            hedge_at = None
+            if _try_slot():
+                launch(hedge=True, slot_taken=True)
+                outstanding += 1
+            continue
+        if outcome == "sent":
+            if len(attempts) == 1 and len(candidates) > 1:
+                hedge_at = attempt.sent_at + router.hedge_delay(attempt.model)
+            continue
+        outstanding -= 1
+        attempt.finished = True
+        hedge_at = None
+        if outcome == "ok":
+            for other in attempts:
+                if not other.finished:
+                    router.cancelled(other.model, other.stop())
+            router.won(attempt.model)
+            llm_cache.put(key, value)
+            return value
+        if outcome == "rejected":
+            rejected = rejected or value
+            errors.append(f"{attempt.model}: {value[1]}")
+        elif outcome == "failed":
+            errors.append(f"{attempt.model}: {value}")
+        if not outstanding and len(attempts) < len(candidates):
+            launch()
+            outstanding += 1
+
+    if rejected is not None:
+        # Nothing passed; hand back the first answer so validation reports why.
+        return rejected[0]
+    raise RuntimeError(f"Hugging Face API error: {'; '.join(errors)}")
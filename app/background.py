@@ -0,0 +1,108 @@
+"""
+Background threads (job resume sweeper, run tracker, reconciler, history
+compactor) belong to the process that serves requests, not to whoever
+calls create_app().
+
+Subsystems register their start function here. They are called once per
+process, on the first request that process serves. So:
+
+* `flask <command>` never starts them (CLI commands serve no requests);
+* a pre-fork master (gunicorn --preload) builds the app without them, and
+  each forked worker starts its own on its first request. Threads do not
+  survive fork(), so anything started before a fork is started again in
+  the child.
+
+Also here: the `locks` leases that let one process in the deployment do
+a given job at a time, and now(), the one clock every stored timestamp
+uses.
+"""
+import os
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from pymongo.errors import DuplicateKeyError
+
+_lock = threading.Lock()
+
+
+def now():
+    """Current UTC time as a naive datetime, which is how pymongo returns stored ones."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def owner_id():
+    """Identifies this process (and object) as the holder of a lease or job."""
+    return f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+
+def ensure_thread(thread, target, name):
+    """
+    `thread` if it is running, else a newly started daemon thread running
+    `target`. Callers hold their own lock. A thread inherited over fork()
+    is not running, so a forked worker gets a fresh one.
+    """
+    if thread is not None and thread.is_alive():
+        return thread
+    thread = threading.Thread(target=target, name=name, daemon=True)
+    thread.start()
+    return thread
+
+
+# ---------- Leases ----------
+def take_lease(db, name, owner, seconds):
+    """Takes or renews the lease `name` for `owner`; False while another owner holds it."""
+    current = now()
+    try:
+        db.locks.find_one_and_update(
+            {"_id": name, "$or": [{"owner": owner}, {"expires_at": {"$lt": current}}]},
+            {"$set": {"owner": owner, "expires_at": current + timedelta(seconds=seconds)}},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        # No match and the upsert collided: another process holds a live lease.
+        return False
+    return True
+
+
+def release_lease(db, name, owner):
+    db.locks.delete_one({"_id": name, "owner": owner})
+
+
+def claim_due_run(db, name, owner, interval):
+    """True for exactly one caller per `interval` seconds across the deployment."""
+    current = now()
+    try:
+        db.locks.find_one_and_update(
+            {"_id": name, "next_run_at": {"$lte": current}},
+            {"$set": {"owner": owner, "next_run_at": current + timedelta(seconds=interval)}},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        return False
+    return True
+
+
+def register(app, start):
+    """Runs `start()` on the first request served by each process."""
+    app.extensions.setdefault("background_starters", []).append(start)
+
+
+def start_all(app):
+    pid = os.getpid()
+    if app.extensions.get("background_pid") == pid:
+        return
+    with _lock:
+        if app.extensions.get("background_pid") == pid:
+            return
+        for start in app.extensions.get("background_starters", []):
+            start()
+        app.extensions["background_pid"] = pid
+
+
+def init_app(app):
+    app.extensions.setdefault("background_starters", [])
+
+    @app.before_request
+    def _start_background_threads():
+        start_all(app)
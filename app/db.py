@@ -0,0 +1,160 @@
+"""
+Lazily connected MongoDB handle for `app.mongo`.
+
+LazyDatabase stands in for the pymongo Database: the MongoClient (and its
+monitor threads and pool) is only created on first use, with pool size,
+timeouts and appname taken from app.config. A client inherited over
+fork() is never reused; the child builds its own on first use, which is
+what pre-fork servers (gunicorn --preload, uWSGI) need.
+"""
+import os
+import threading
+import weakref
+
+from pymongo import MongoClient, monitoring
+
+from app.mongo_stats import query_counter
+
+# app.config key -> MongoClient option
+CLIENT_OPTIONS = {
+    "MONGO_MAX_POOL_SIZE": "maxPoolSize",
+    "MONGO_MIN_POOL_SIZE": "minPoolSize",
+    "MONGO_MAX_IDLE_TIME_MS": "maxIdleTimeMS",
+    "MONGO_CONNECT_TIMEOUT_MS": "connectTimeoutMS",
+    "MONGO_SOCKET_TIMEOUT_MS": "socketTimeoutMS",
+    "MONGO_SERVER_SELECTION_TIMEOUT_MS": "serverSelectionTimeoutMS",
+    "MONGO_WAIT_QUEUE_TIMEOUT_MS": "waitQueueTimeoutMS",
+    "MONGO_APPNAME": "appname",
+}
+
+_instances = weakref.WeakSet()
+
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    """Open, idle and in-use connection counts across this process's pools."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.created = self.closed = 0
+        self.checked_out = self.checked_in = 0
+        self.checkout_failures = 0
+        self.pools_cleared = 0
+
+    def _add(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def connection_created(self, event):
+        self._add("created")
+
+    def connection_closed(self, event):
+        self._add("closed")
+
+    def connection_checked_out(self, event):
+        self._add("checked_out")
+
+    def connection_checked_in(self, event):
+        self._add("checked_in")
+
+    def connection_check_out_failed(self, event):
+        self._add("checkout_failures")
+
+    def pool_cleared(self, event):
+        self._add("pools_cleared")
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def stats(self):
+        with self._lock:
+            open_conns = self.created - self.closed
+            in_use = self.checked_out - self.checked_in
+            return {
+                "open": open_conns,
+                "in_use": in_use,
+                "idle": max(open_conns - in_use, 0),
+                "created": self.created,
+                "checkout_failures": self.checkout_failures,
+                "pools_cleared": self.pools_cleared,
+            }
+
+
+pool_stats = PoolStats()
+
+
+class LazyDatabase:
+    def __init__(self, uri, dbname, **options):
+        self.uri = uri
+        self.dbname = dbname
+        self.options = options
+        self._client = None
+        self._db = None
+        self._pid = None
+        self._lock = threading.Lock()
+        _instances.add(self)
+
+    @property
+    def client(self):
+        # The pid check covers children forked without the at-fork hook running.
+        if self._client is None or self._pid != os.getpid():
+            with self._lock:
+                if self._client is None or self._pid != os.getpid():
+                    self._client = MongoClient(
+                        self.uri, event_listeners=[query_counter, pool_stats], **self.options
+                    )
+                    self._db = self._client[self.dbname]
+                    self._pid = os.getpid()
+        return self._client
+
+    @property
+    def connected(self):
+        return self._client is not None and self._pid == os.getpid()
+
+    def _after_fork(self):
+        # Drop the parent's client without closing it: its sockets belong to the parent.
+        self._client = None
+        self._db = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        self.client
+        return getattr(self._db, name)
+
+    def __getitem__(self, name):
+        self.client
+        return self._db[name]
+
+
+def _reset_after_fork():
+    for db in list(_instances):
+        db._after_fork()
+    pool_stats.reset()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def client_options(config):
+    return {option: config[key] for key, option in CLIENT_OPTIONS.items() if config.get(key) is not None}
+
+
+def init_app(app):
+    app.mongo = LazyDatabase(app.config["MONGO_URI"], app.config["MONGO_DB"], **client_options(app.config))
+    return app.mongo
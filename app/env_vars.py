@@ -0,0 +1,130 @@
+import hashlib
+import hmac
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+from app.terraform_service import add_env_variable, list_env_variables, update_env_variable
+
+BULK_VAR_WORKERS = int(os.getenv("BULK_VAR_WORKERS", "8"))
+
+_KEY_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+# An unquoted .env value ends at a "#" that starts a word.
+_INLINE_COMMENT = re.compile(r"\s+#.*$")
+
+
+def _json_value(value):
+    """A JSON value as Terraform would read it from the environment."""
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, str):
+        return value
+    return json.dumps(value)
+
+
+def _env_value(value, lineno):
+    value = value.strip()
+    if value[:1] in ("'", '"'):
+        end = value.find(value[0], 1)
+        if end == -1:
+            raise ValueError(f"Line {lineno}: unterminated quote")
+        rest = value[end + 1:].strip()
+        if rest and not rest.startswith("#"):
+            raise ValueError(f"Line {lineno}: unexpected text after closing quote")
+        return value[1:end]
+    return _INLINE_COMMENT.sub("", value)
+
+
+def parse_bulk_input(text):
+    """
+    Parses a JSON object or a .env file into an ordered {key: value} dict.
+    Raises ValueError on malformed input.
+    """
+    text = (text or "").strip()
+    if text.startswith("{"):
+        data = json.loads(text)
+        if not isinstance(data, dict):
+            raise ValueError("JSON input must be an object")
+        pairs = {str(k).strip(): _json_value(v) for k, v in data.items()}
+    else:
+        pairs = {}
+        for lineno, line in enumerate(text.splitlines(), 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith("export "):
+                line = line[len("export "):].lstrip()
+            if "=" not in line:
+                raise ValueError(f"Line {lineno}: expected KEY=VALUE")
+            key, value = line.split("=", 1)
+            pairs[key.strip()] = _env_value(value, lineno)
+    bad = [k for k in pairs if not _KEY_RE.match(k)]
+    if bad:
+        raise ValueError(f"Invalid variable name(s): {', '.join(bad)}")
+    return pairs
+
+
+def value_digest(value):
+    """Keyed digest of a value, so changes can be detected without storing secrets."""
+    secret = current_app.secret_key
+    if isinstance(secret, str):
+        secret = secret.encode("utf-8")
+    return hmac.new(secret, value.encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+def var_record(key, value, sensitive):
+    return {
+        "key": key,
+        "value": None if sensitive else value,
+        "sensitive": sensitive,
+        "value_hash": value_digest(value),
+    }
+
+
+def bulk_apply(workspace_id, pairs, stored_vars, sensitive=True):
+    """
+    Pushes `pairs` to Terraform Cloud concurrently.
+
+    Keys whose stored digest matches are skipped, existing keys are PATCHed
+    and new ones created. Returns (report, vars) where report maps each key to
+    {"status": created|updated|unchanged|failed, "error"} and vars is the
+    merged list to store back on the workspace.
+    """
+    stored = {v["key"]: v for v in stored_vars}
+    remote = {v["key"]: v for v in list_env_variables(workspace_id)}
+    digests = {key: value_digest(value) for key, value in pairs.items()}
+
+    report, tasks = {}, []
+    for key, value in pairs.items():
+        known = stored.get(key)
+        if (key in remote and known and known.get("value_hash") == digests[key]
+                and known.get("sensitive") == sensitive):
+            report[key] = {"status": "unchanged"}
+        elif key in remote:
+            tasks.append((key, "updated", lambda k=key, v=value: update_env_variable(
+                workspace_id, remote[k]["id"], k, v, sensitive=sensitive)))
+        else:
+            tasks.append((key, "created", lambda k=key, v=value: add_env_variable(
+                workspace_id, k, v, sensitive=sensitive)))
+
+    if tasks:
+        with ThreadPoolExecutor(max_workers=min(BULK_VAR_WORKERS, len(tasks))) as pool:
+            futures = [(key, status, pool.submit(call)) for key, status, call in tasks]
+            for key, status, future in futures:
+                try:
+                    future.result()
+                    report[key] = {"status": status}
+                except Exception as e:
+                    report[key] = {"status": "failed", "error": str(e)}
+
+    merged = dict(stored)
+    for key, outcome in report.items():
+        if outcome["status"] in ("created", "updated"):
+            merged[key] = var_record(key, pairs[key], sensitive)
+    ordered = {key: report[key] for key in pairs}
+    return ordered, list(merged.values())
@@ -0,0 +1,349 @@
+"""
+Generation history: which prompt produced which HCL, and which run it went to.
+
+Every generation is a small document in `generations` (prompt, workspace,
+run id, per-stage timings, validation result) that points at its HCL by
+hash. HCL bodies live once each in `hcl_blobs`, keyed by the sha256 of the
+text with trailing whitespace normalised, and zlib-compressed against a
+preset dictionary of common Terraform text, which is what makes small
+documents compress well. Identical outputs therefore cost one blob however
+often they recur.
+
+Old generations expire through a TTL index (HISTORY_RETENTION_DAYS); the
+compaction job caps each workspace at HISTORY_MAX_PER_WORKSPACE entries and
+removes blobs nothing refers to any more.
+"""
+import hashlib
+import os
+import threading
+import time
+import zlib
+from datetime import timedelta
+
+import click
+from bson.binary import Binary
+from bson.objectid import ObjectId
+from pymongo import ASCENDING, DESCENDING
+
+from app import background
+from app.cache import TTLCache
+
+RETENTION_DAYS = int(os.getenv("HISTORY_RETENTION_DAYS", "90"))
+MAX_PER_WORKSPACE = int(os.getenv("HISTORY_MAX_PER_WORKSPACE", "500"))
+PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "20"))
+COMPACT_INTERVAL = float(os.getenv("HISTORY_COMPACT_INTERVAL", "21600"))
+COMPACT_TICK = min(COMPACT_INTERVAL, 300)
+COMPRESSION_LEVEL = int(os.getenv("HISTORY_COMPRESSION_LEVEL", "9"))
+# Blobs touched this recently are never collected, so a generation being
+# recorded while compaction runs cannot lose its HCL.
+BLOB_GRACE_SECONDS = 3600
+DELETE_BATCH = 500
+# storage_stats() aggregates over every blob; /stats reuses it this long.
+STATS_TTL = float(os.getenv("HISTORY_STATS_TTL", "300"))
+
+# Preset dictionary for the "zlib-d1" codec. Never edit it: stored blobs
+# need exactly these bytes to decompress. Add a new codec instead.
+_ZDICT_V1 = (
+    'variable "location" {\n  type    = string\n  default = "eastus"\n}\n\n'
+    'output "id" {\n  value = \n}\n\n'
+    'resource "azurerm_storage_account" "sa" {\n  account_tier             = "Standard"\n'
+    '  account_replication_type = "LRS"\n}\n\n'
+    'resource "azurerm_subnet" "subnet" {\n  address_prefixes     = ["10.0.1.0/24"]\n'
+    '  virtual_network_name = azurerm_virtual_network.vnet.name\n}\n\n'
+    'resource "azurerm_virtual_network" "vnet" {\n  address_space       = ["10.0.0.0/16"]\n}\n\n'
+    'resource "aws_instance" "this" {\n  ami           = \n  instance_type = "t3.micro"\n'
+    '  tags = {\n    Name = \n  }\n}\n\n'
+    'resource "google_compute_instance" "vm" {\n  machine_type = "e2-medium"\n  zone         = \n}\n\n'
+    'terraform {\n  required_version = ">= 1.0"\n  required_providers {\n'
+    '    azurerm = {\n      source  = "hashicorp/azurerm"\n      version = "~> 3.0"\n    }\n'
+    '    aws = {\n      source  = "hashicorp/aws"\n      version = "~> 5.0"\n    }\n  }\n}\n\n'
+    'provider "azurerm" {\n  features {}\n}\n\n'
+    'resource "azurerm_resource_group" "rg" {\n  name     = \n  location = "eastus"\n}\n\n'
+    '  resource_group_name = azurerm_resource_group.rg.name\n'
+    '  location            = azurerm_resource_group.rg.location\n'
+).encode("utf-8")
+
+_CODECS = {
+    "zlib": {},
+    "zlib-d1": {"zdict": _ZDICT_V1},
+}
+CODEC = "zlib-d1"
+
+
+
+def ensure_indexes(db):
+    db.generations.create_index([("workspace_id", ASCENDING), ("_id", DESCENDING)])
+    db.generations.create_index("created_at", expireAfterSeconds=RETENTION_DAYS * 86400)
+    db.generations.create_index([("hcl_hash", ASCENDING)])
+    db.hcl_blobs.create_index([("last_used_at", ASCENDING)])
+
+
+# ---------- HCL blobs ----------
+def normalize_hcl(text):
+    """Drops trailing whitespace per line and at the end, so cosmetic variants share a blob."""
+    return "\n".join(line.rstrip() for line in text.strip().splitlines()) + "\n"
+
+
+def hcl_hash(text):
+    return hashlib.sha256(normalize_hcl(text).encode("utf-8")).hexdigest()
+
+
+def compress(data, codec=CODEC):
+    c = zlib.compressobj(COMPRESSION_LEVEL, **_CODECS[codec])
+    return c.compress(data) + c.flush()
+
+
+def decompress(data, codec):
+    d = zlib.decompressobj(**_CODECS[codec])
+    return d.decompress(data) + d.flush()
+
+
+def put_hcl(db, text):
+    """Stores the HCL once per distinct content and returns its hash."""
+    data = normalize_hcl(text).encode("utf-8")
+    digest = hashlib.sha256(data).hexdigest()
+    packed = compress(data)
+    now = background.now()
+    db.hcl_blobs.update_one(
+        {"_id": digest},
+        {
+            "$setOnInsert": {
+                "codec": CODEC,
+                "data": Binary(packed),
+                "size": len(data),
+                "stored_size": len(packed),
+                "created_at": now,
+            },
+            "$set": {"last_used_at": now},
+        },
+        upsert=True,
+    )
+    return digest
+
+
+def get_hcl(db, digest):
+    blob = db.hcl_blobs.find_one({"_id": digest})
+    if blob is None:
+        return None
+    return decompress(bytes(blob["data"]), blob["codec"]).decode("utf-8")
+
+
+def get_hcl_many(db, digests):
+    """{digest: HCL} for the blobs that exist, in one query."""
+    return {
+        blob["_id"]: decompress(bytes(blob["data"]), blob["codec"]).decode("utf-8")
+        for blob in db.hcl_blobs.find({"_id": {"$in": list(digests)}})
+    }
+
+
+# ---------- Generations ----------
+def record(db, owner, workspace_id, prompt, tf_code=None, run_id=None, job_id=None, source="job",
+           valid=None, validation_error=None, timings=None, workspace_name=None):
+    """Adds one generation to the history; returns its id."""
+    doc = {
+        "_id": ObjectId(),
+        "owner": owner,
+        "workspace_id": workspace_id,
+        "workspace_name": workspace_name,
+        "prompt": prompt,
+        "hcl_hash": put_hcl(db, tf_code) if tf_code else None,
+        "hcl_size": len(tf_code) if tf_code else 0,
+        "run_id": run_id,
+        "job_id": job_id,
+        "source": source,
+        "valid": valid,
+        "validation_error": validation_error,
+        "timings": {k: round(v, 3) for k, v in (timings or {}).items()},
+        "created_at": background.now(),
+    }
+    db.generations.insert_one(doc)
+    return doc["_id"]
+
+
+def record_job(db, job, result, timings, valid=None, validation_error=None):
+    """
+    Records a finished /generate job: one entry per workspace it deployed
+    to. `valid` is None when validation never ran.
+    """
+    common = {
+        "owner": job["owner"],
+        "prompt": job["prompt"],
+        "tf_code": result.get("tf_code"),
+        "job_id": job["_id"],
+        "source": "retrieval" if result.get("retrieved") else "fanout" if job.get("kind") == "fanout" else "job",
+        "valid": valid,
+        "validation_error": validation_error,
+        "timings": timings,
+    }
+    if job.get("kind") == "fanout":
+        fresh = db.jobs.find_one({"_id": job["_id"]}, {"targets": 1}) or job
+        for target in fresh.get("targets", []):
+            record(db, workspace_id=target["workspace_id"], workspace_name=target.get("name"),
+                   run_id=target.get("run_id"), **common)
+    elif job.get("workspace_id"):
+        record(db, workspace_id=job["workspace_id"], workspace_name=job.get("workspace_name"),
+               run_id=result.get("run_id"), **common)
+
+
+def page(db, workspace_id, owner, before=None, limit=PAGE_SIZE):
+    """
+    One page of a workspace's history, newest first. Returns (entries,
+    cursor for the next page or None); pages by _id, so deep pages cost
+    the same as the first.
+    """
+    query = {"workspace_id": workspace_id, "owner": owner}
+    if before:
+        try:
+            query["_id"] = {"$lt": ObjectId(before)}
+        except Exception:
+            return [], None
+    entries = list(db.generations.find(query).sort("_id", DESCENDING).limit(limit + 1))
+    more = len(entries) > limit
+    entries = entries[:limit]
+    return entries, (str(entries[-1]["_id"]) if more else None)
+
+
+def get(db, generation_id, owner):
+    try:
+        oid = ObjectId(generation_id)
+    except Exception:
+        return None
+    return db.generations.find_one({"_id": oid, "owner": owner})
+
+
+# ---------- Compaction ----------
+def trim_workspaces(db, keep=MAX_PER_WORKSPACE):
+    """Deletes all but the newest `keep` generations of every workspace; returns how many went."""
+    removed = 0
+    crowded = db.generations.aggregate([
+        {"$group": {"_id": "$workspace_id", "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": keep}}},
+    ])
+    for row in crowded:
+        oldest_kept = list(
+            db.generations.find({"workspace_id": row["_id"]}, {"_id": 1})
+            .sort("_id", DESCENDING).skip(keep - 1).limit(1)
+        )
+        if oldest_kept:
+            removed += db.generations.delete_many(
+                {"workspace_id": row["_id"], "_id": {"$lt": oldest_kept[0]["_id"]}}
+            ).deleted_count
+    return removed
+
+
+def collect_blobs(db):
+    """
+    Deletes HCL blobs no generation refers to; returns (blobs removed,
+    bytes freed). Idle blobs are checked DELETE_BATCH at a time against the
+    generations.hcl_hash index, so memory stays flat however many there are.
+    """
+    idle_since = background.now() - timedelta(seconds=BLOB_GRACE_SECONDS)
+    idle = db.hcl_blobs.find({"last_used_at": {"$lt": idle_since}}, {"stored_size": 1}).batch_size(DELETE_BATCH)
+    removed = freed = 0
+    batch = []
+
+    def flush():
+        nonlocal removed, freed
+        ids = [blob["_id"] for blob in batch]
+        referenced = set(db.generations.distinct("hcl_hash", {"hcl_hash": {"$in": ids}}))
+        orphans = [blob for blob in batch if blob["_id"] not in referenced]
+        if orphans:
+            # last_used_at again: a generation may have reused the blob since it was read.
+            removed += db.hcl_blobs.delete_many({
+                "_id": {"$in": [blob["_id"] for blob in orphans]},
+                "last_used_at": {"$lt": idle_since},
+            }).deleted_count
+            freed += sum(blob.get("stored_size", 0) for blob in orphans)
+        batch.clear()
+
+    for blob in idle:
+        batch.append(blob)
+        if len(batch) >= DELETE_BATCH:
+            flush()
+    if batch:
+        flush()
+    return removed, freed
+
+
+def compact(db):
+    trimmed = trim_workspaces(db)
+    blobs, freed = collect_blobs(db)
+    return {"generations_trimmed": trimmed, "blobs_removed": blobs, "bytes_freed": freed}
+
+
+def storage_stats(db):
+    """Raw vs stored HCL bytes, for /stats."""
+    totals = list(db.hcl_blobs.aggregate([
+        {"$group": {"_id": None, "blobs": {"$sum": 1}, "size": {"$sum": "$size"},
+                    "stored_size": {"$sum": "$stored_size"}}},
+    ]))
+    totals = totals[0] if totals else {"blobs": 0, "size": 0, "stored_size": 0}
+    return {
+        "generations": db.generations.estimated_document_count(),
+        "blobs": totals["blobs"],
+        "hcl_bytes": totals["size"],
+        "stored_bytes": totals["stored_size"],
+    }
+
+
+_stats_cache = TTLCache(maxsize=1, ttl=STATS_TTL)
+_stats_lock = threading.Lock()
+
+
+def cached_storage_stats(db):
+    """storage_stats(), computed at most once per STATS_TTL by one request at a time."""
+    stats = _stats_cache.get("storage")
+    if stats is None:
+        with _stats_lock:
+            stats = _stats_cache.get("storage")
+            if stats is None:
+                stats = storage_stats(db)
+                _stats_cache.set("storage", stats)
+    return stats
+
+
+class Compactor:
+    def __init__(self, app):
+        self.app = app
+        self.owner = background.owner_id()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.runs = 0
+        self.last = None
+
+    def start(self):
+        with self._lock:
+            self._thread = background.ensure_thread(self._thread, self._loop, "history-compactor")
+
+    def _loop(self):
+        while True:
+            time.sleep(COMPACT_TICK)
+            try:
+                db = self.app.mongo
+                if background.claim_due_run(db, "history-compactor", self.owner, COMPACT_INTERVAL):
+                    self.last = compact(db)
+                    self.runs += 1
+            except Exception:
+                self.app.logger.exception("History compaction failed")
+
+    def stats(self):
+        return {"runs": self.runs, "last": self.last}
+
+
+def init_app(app):
+    compactor = Compactor(app)
+    app.extensions["history_compactor"] = compactor
+    if os.getenv("HISTORY_COMPACT_ENABLED", "1") == "1":
+        background.register(app, compactor.start)
+
+    @app.cli.command("compact-history")
+    def compact_command():
+        """Trim per-workspace generation history and drop unreferenced HCL blobs now."""
+        ensure_indexes(app.mongo)
+        summary = compact(app.mongo)
+        click.echo(
+            f"Trimmed {summary['generations_trimmed']} generations; removed "
+            f"{summary['blobs_removed']} blobs ({summary['bytes_freed']} bytes)."
+        )
+
+    return compactor
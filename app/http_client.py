@@ -0,0 +1,196 @@
+import random
+import threading
+import time
+
+from app.metrics import HTTP_SECONDS
+
+# Methods that may be replayed safely after a failure.
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+class PooledClient:
+    """
+    Thread-safe HTTP client sharing one pooled requests.Session.
+
+    Keeps connections alive between calls, applies per-endpoint timeouts and
+    retries idempotent requests with exponential backoff and full jitter.
+    Non-idempotent requests (POST) are only retried when the server could not
+    have processed them: connect failures and 429 responses.
+
+    With a `rate_limiter`, every attempt waits for a slot first and every
+    response is fed back to it, so 429s pause all callers sharing the limiter.
+
+    Each attempt is timed into app_http_request_seconds under `name`.
+
+    `requests` is imported on first use, so importing this module (and every
+    module holding a client) stays cheap for processes that never call out.
+    """
+
+    def __init__(self, pool_size=10, timeouts=None, default_timeout=(5, 30),
+                 max_retries=3, backoff_base=0.5, backoff_max=8.0, rate_limiter=None, name="http"):
+        self.name = name
+        self.pool_size = pool_size
+        self.rate_limiter = rate_limiter
+        self.timeouts = dict(timeouts or {})
+        self.default_timeout = default_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._session = None
+        self._adapter = None
+        self._lock = threading.Lock()
+        self._retries = 0
+
+    def _get_session(self):
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+
+                    adapter = HTTPAdapter(
+                        pool_connections=self.pool_size,
+                        pool_maxsize=self.pool_size,
+                        max_retries=0,
+                    )
+                    session = requests.Session()
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    self._adapter = adapter
+                    self._session = session
+        return self._session
+
+    def _timeout_for(self, endpoint):
+        return self.timeouts.get(endpoint, self.default_timeout)
+
+    def _backoff(self, attempt, retry_after=None):
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+        cap = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return random.uniform(0, cap)
+
+    def request(self, method, url, endpoint=None, idempotent=None, timeout=None, **kwargs):
+        """
+        Send a request through the shared session.
+
+        `endpoint` selects the timeout from `self.timeouts`; `idempotent`
+        overrides the method-based retry policy (e.g. for POSTs that are
+        safe to replay).
+        """
+        import requests
+
+        method = method.upper()
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        if timeout is None:
+            timeout = self._timeout_for(endpoint)
+        session = self._get_session()
+
+        attempt = 0
+        limiter = self.rate_limiter
+        while True:
+            if limiter is not None:
+                limiter.acquire()
+            try:
+                r = self._send(session, method, url, timeout, kwargs)
+            except (requests.exceptions.ConnectTimeout, requests.exceptions.ConnectionError) as e:
+                # A plain ConnectionError may have happened after the body was sent.
+                sent = not isinstance(e, requests.exceptions.ConnectTimeout) and _maybe_sent(e)
+                if attempt >= self.max_retries or (sent and not idempotent):
+                    raise
+            except requests.exceptions.Timeout:
+                if attempt >= self.max_retries or not idempotent:
+                    raise
+            else:
+                paused = limiter.observe(r) if limiter is not None else None
+                retryable = r.status_code in RETRY_STATUSES and (idempotent or r.status_code == 429)
+                if not retryable or attempt >= self.max_retries:
+                    return r
+                # The limiter already holds the next attempt back until the window resets.
+                delay = 0 if paused is not None else self._backoff(attempt, _retry_after(r))
+                r.close()
+                self._count_retry()
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self._count_retry()
+            time.sleep(self._backoff(attempt))
+            attempt += 1
+
+    def _send(self, session, method, url, timeout, kwargs):
+        import requests
+
+        start = time.perf_counter()
+        code = "error"
+        try:
+            r = session.request(method, url, timeout=timeout, **kwargs)
+            code = str(r.status_code)
+            return r
+        except requests.exceptions.RequestException as e:
+            code = type(e).__name__
+            raise
+        finally:
+            HTTP_SECONDS.observe(time.perf_counter() - start, self.name, method, code)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request("PUT", url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self.request("PATCH", url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request("DELETE", url, **kwargs)
+
+    def _count_retry(self):
+        with self._lock:
+            self._retries += 1
+
+    def stats(self):
+        """Connection counters summed over every host pool opened so far."""
+        new_conns = requests_sent = 0
+        if self._adapter is not None:
+            pools = self._adapter.poolmanager.pools
+            with pools.lock:
+                host_pools = list(pools._container.values())
+            for pool in host_pools:
+                new_conns += pool.num_connections
+                requests_sent += pool.num_requests
+        return {
+            "requests": requests_sent,
+            "new_connections": new_conns,
+            "reused_connections": max(requests_sent - new_conns, 0),
+            "retries": self._retries,
+        }
+
+    def close(self):
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+            self._session = None
+            self._adapter = None
+
+
+def _maybe_sent(exc):
+    """True unless the error clearly happened while opening the connection."""
+    from urllib3.exceptions import NewConnectionError
+
+    reason = exc.args[0] if exc.args else None
+    reason = getattr(reason, "reason", reason)
+    return not isinstance(reason, NewConnectionError)
+
+
+def _retry_after(r):
+    value = r.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        return None
@@ -0,0 +1,509 @@
+"""
+Background pipeline for /generate.
+
+A job is a Mongo document in `jobs` whose STAGES form a small dependency
+graph: each stage starts as soon as the stages it depends on are done, so
+independent Terraform Cloud calls overlap (the configuration version is
+created while the LLM is still generating; permissions are checked alongside
+upload and trigger). Each finished stage is persisted together with its
+outputs, so a job whose worker died is picked up again by any live worker
+once its lease expires and continues from the finished stages.
+"""
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+
+from bson.objectid import ObjectId
+from flask import current_app
+from pymongo import ASCENDING, ReturnDocument
+
+from app import background, history, retrieval
+from app.ai_integration import generate_tf_code
+from app.metrics import span
+from app.run_tracker import track_run
+from app.terraform_service import (
+    content_hash,
+    create_configuration_version,
+    upload_tf_to_url,
+    trigger_plan_run,
+    check_user_permissions,
+)
+from app.utils.validator import simple_hcl_sanity_check
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_QUEUE_LIMIT = int(os.getenv("JOB_QUEUE_LIMIT", "32"))
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "300"))
+JOB_RESUME_INTERVAL = int(os.getenv("JOB_RESUME_INTERVAL", "30"))
+# A running job renews its lease at least this often, however long a stage takes.
+JOB_HEARTBEAT_SECONDS = JOB_LEASE_SECONDS / 3
+FANOUT_MAX_CONCURRENCY = int(os.getenv("FANOUT_MAX_CONCURRENCY", "8"))
+STAGE_WORKERS = int(os.getenv("JOB_STAGE_WORKERS", str(JOB_WORKERS * 3)))
+# Unused speculative configuration versions are kept this long for reuse;
+# their upload URLs stop working eventually.
+SPARE_CONFIG_TTL = int(os.getenv("SPARE_CONFIG_VERSION_TTL", "600"))
+
+FINAL_STATUSES = ("succeeded", "failed")
+
+
+class QueueFullError(RuntimeError):
+    pass
+
+
+class StageError(RuntimeError):
+    """A stage failed in a way that retrying will not fix."""
+
+
+# ---------- Stages ----------
+# Each stage receives the job's accumulated `result` and returns new fields for it.
+def _stage_generate(job, result):
+    """
+    The LLM's answer. Known-good HCL from app.retrieval is never picked here:
+    it arrives as `tf_code` once the user has seen and confirmed it.
+    """
+    return {"tf_code": generate_tf_code(job["prompt"], bypass_cache=job.get("bypass_cache", False))}
+
+def _stage_validate(job, result):
+    ok, msg = simple_hcl_sanity_check(result["tf_code"])
+    if not ok:
+        raise StageError(f"Validation failed: {msg}")
+    return {}
+
+def _uploaded_configs():
+    # workspace_id -> hash of the HCL last uploaded there and its configuration version
+    return current_app.mongo.workspace_configs
+
+def _spare_configs():
+    # Configuration versions created ahead of time but never uploaded to.
+    return current_app.mongo.spare_config_versions
+
+def ensure_indexes(db):
+    db.spare_config_versions.create_index([("workspace_id", ASCENDING), ("created_at", ASCENDING)])
+    db.spare_config_versions.create_index("created_at", expireAfterSeconds=SPARE_CONFIG_TTL)
+
+def _take_spare_config(workspace_id):
+    fresh_after = background.now() - timedelta(seconds=SPARE_CONFIG_TTL)
+    return _spare_configs().find_one_and_delete(
+        {"workspace_id": workspace_id, "created_at": {"$gt": fresh_after}},
+        sort=[("created_at", ASCENDING)],
+    )
+
+def _keep_spare_config(workspace_id, config_id, upload_url, created_at=None):
+    # created_at is when the configuration version was created, so the TTL
+    # expires it with its upload URL however often it changes hands.
+    _spare_configs().update_one(
+        {"_id": config_id},
+        {"$setOnInsert": {
+            "workspace_id": workspace_id,
+            "upload_url": upload_url,
+            "created_at": created_at or background.now(),
+        }},
+        upsert=True,
+    )
+
+def _new_config_version(workspace_id, tf_code, tf_hash):
+    conf = create_configuration_version(workspace_id, auto_queue_runs=True)
+    upload_tf_to_url(conf["attributes"]["upload-url"], tf_code)
+    _record_upload(workspace_id, tf_hash, conf["id"])
+    return conf["id"]
+
+def _record_upload(workspace_id, tf_hash, config_id):
+    _uploaded_configs().replace_one(
+        {"_id": workspace_id},
+        {"_id": workspace_id, "hash": tf_hash, "config_version_id": config_id, "updated_at": background.now()},
+        upsert=True,
+    )
+
+def _stage_create_config_version(job, result):
+    """
+    Needs only the workspace id, so it runs while the LLM is generating.
+    Takes a spare left over by an earlier job when there is one.
+    """
+    spare = _take_spare_config(job["workspace_id"])
+    if spare:
+        return {
+            "config_id": spare["_id"],
+            "upload_url": spare["upload_url"],
+            "config_created_at": spare["created_at"],
+        }
+    conf = create_configuration_version(job["workspace_id"], auto_queue_runs=True)
+    return {
+        "config_id": conf["id"],
+        "upload_url": conf["attributes"]["upload-url"],
+        "config_created_at": background.now(),
+    }
+
+def _stage_upload(job, result):
+    tf_hash = content_hash(result["tf_code"])
+    existing = _uploaded_configs().find_one({"_id": job["workspace_id"]})
+    if existing and existing.get("hash") == tf_hash:
+        # Same HCL as the workspace already has: skip the upload and keep the
+        # new configuration version for the next job.
+        _keep_spare_config(job["workspace_id"], result["config_id"], result["upload_url"],
+                           result.get("config_created_at"))
+        return {"config_id": existing["config_version_id"], "config_hash": tf_hash, "reused": True}
+    try:
+        upload_tf_to_url(result["upload_url"], result["tf_code"])
+    except Exception:
+        # Possibly half uploaded: never hand this configuration version out again.
+        _spare_configs().delete_one({"_id": result["config_id"]})
+        raise
+    _record_upload(job["workspace_id"], tf_hash, result["config_id"])
+    return {"config_hash": tf_hash, "reused": False}
+
+def _recycle_unused_config(job, result, launched):
+    """
+    After a failed job: keeps a created configuration version for the next
+    job, but only if no upload to it was ever started (by this worker, or
+    by one that died before the job was resumed).
+    """
+    if job.get("kind") == "fanout" or not result.get("upload_url"):
+        return
+    if "upload" in launched or job["stages"].get("upload", {}).get("status") != "pending":
+        return
+    _keep_spare_config(job["workspace_id"], result["config_id"], result["upload_url"],
+                       result.get("config_created_at"))
+
+def _stage_trigger_run(job, result):
+    try:
+        updates = {"run_id": trigger_plan_run(job["workspace_id"], result["config_id"])}
+    except Exception:
+        if not result.get("reused"):
+            raise
+        # The remembered configuration version is no longer usable; upload afresh.
+        _uploaded_configs().delete_one({"_id": job["workspace_id"]})
+        config_id = _new_config_version(job["workspace_id"], result["tf_code"], result["config_hash"])
+        updates = {
+            "config_id": config_id,
+            "reused": False,
+            "run_id": trigger_plan_run(job["workspace_id"], config_id),
+        }
+    track_run(current_app.mongo, updates["run_id"], job["workspace_id"])
+    return updates
+
+def _stage_check_permissions(job, result):
+    return {"can_apply": bool(check_user_permissions(job["workspace_id"]))}
+
+# (name, fn, stages it depends on)
+STAGES = [
+    ("generate", _stage_generate, ()),
+    ("create_config_version", _stage_create_config_version, ()),
+    ("validate", _stage_validate, ("generate",)),
+    ("upload", _stage_upload, ("validate", "create_config_version")),
+    ("trigger_run", _stage_trigger_run, ("upload",)),
+    ("check_permissions", _stage_check_permissions, ("validate",)),
+]
+
+
+# ---------- Fan-out ----------
+def _deploy_target(job, result, index, target):
+    """create_config_version -> upload -> trigger_run for one target workspace."""
+    target_job = {"workspace_id": target["workspace_id"]}
+    state = {"tf_code": result["tf_code"]}
+    for fn in (_stage_create_config_version, _stage_upload, _stage_trigger_run):
+        state.update(fn(target_job, state))
+    current_app.mongo.jobs.update_one({"_id": job["_id"]}, {"$set": {
+        f"targets.{index}.status": "done",
+        f"targets.{index}.run_id": state["run_id"],
+        f"targets.{index}.reused": state.get("reused", False),
+        "lease_until": background.now() + timedelta(seconds=JOB_LEASE_SECONDS),
+    }})
+    return state["run_id"]
+
+def _stage_fan_out(job, result):
+    """Deploys the generated HCL to every target, `concurrency` at a time."""
+    app = current_app._get_current_object()
+    pending = [(i, t) for i, t in enumerate(job["targets"]) if t.get("status") != "done"]
+
+    def deploy(item):
+        index, target = item
+        with app.app_context():
+            try:
+                return _deploy_target(job, result, index, target)
+            except Exception as e:
+                app.mongo.jobs.update_one({"_id": job["_id"]}, {"$set": {
+                    f"targets.{index}.status": "failed",
+                    f"targets.{index}.error": str(e),
+                }})
+                return None
+
+    if pending:
+        workers = max(1, min(job.get("concurrency") or 1, FANOUT_MAX_CONCURRENCY, len(pending)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fanout") as pool:
+            list(pool.map(deploy, pending))
+
+    targets = current_app.mongo.jobs.find_one({"_id": job["_id"]}, {"targets": 1})["targets"]
+    done = sum(1 for t in targets if t.get("status") == "done")
+    if not done:
+        raise StageError(f"Deployment failed on all {len(targets)} workspaces")
+    return {"deployed": done, "failed": len(targets) - done}
+
+FANOUT_STAGES = [
+    ("generate", _stage_generate, ()),
+    ("validate", _stage_validate, ("generate",)),
+    ("deploy", _stage_fan_out, ("validate",)),
+]
+
+def _stages_for(job):
+    return FANOUT_STAGES if job.get("kind") == "fanout" else STAGES
+
+
+# ---------- Runner ----------
+class JobRunner:
+    def __init__(self, app, workers=JOB_WORKERS, queue_limit=JOB_QUEUE_LIMIT):
+        self.app = app
+        self.worker_id = background.owner_id()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self._stage_pool = ThreadPoolExecutor(max_workers=STAGE_WORKERS, thread_name_prefix="stage")
+        self._slots = threading.BoundedSemaphore(queue_limit)
+        self._sweeper = None
+        self._lock = threading.Lock()
+
+    @property
+    def collection(self):
+        return self.app.mongo.jobs
+
+    def start(self):
+        with self._lock:
+            self._sweeper = background.ensure_thread(self._sweeper, self._sweep_loop, "job-resume")
+
+    def submit(self, owner, workspace_id, workspace_name, prompt, bypass_cache=False, tf_code=None,
+               targets=None, concurrency=None, retrieved=None):
+        """
+        Queues a job and returns its id. Passing `tf_code` (e.g. from a
+        streamed generation) skips the generate stage; `retrieved` says it
+        came from the retrieval index rather than the LLM.
+
+        With `targets` (a list of {"workspace_id", "name"}) the job generates
+        once and deploys to every target, `concurrency` at a time.
+        """
+        if not self._slots.acquire(blocking=False):
+            raise QueueFullError("Too many generate jobs in progress, try again shortly.")
+        now = background.now()
+        kind = "fanout" if targets else "single"
+        stage_list = FANOUT_STAGES if targets else STAGES
+        stages = {name: {"status": "pending"} for name, _, _ in stage_list}
+        result = {}
+        if tf_code is not None:
+            stages["generate"] = {"status": "done", "started_at": now, "finished_at": now}
+            result["tf_code"] = tf_code
+            if retrieved:
+                result["retrieved"] = retrieved
+        doc = {
+            "_id": ObjectId(),
+            "owner": owner,
+            "workspace_id": workspace_id,
+            "workspace_name": workspace_name,
+            "prompt": prompt,
+            "bypass_cache": bypass_cache,
+            "status": "queued",
+            "stages": stages,
+            "result": result,
+            "error": None,
+            "worker": self.worker_id,
+            "lease_until": now + timedelta(seconds=JOB_LEASE_SECONDS),
+            "created_at": now,
+            "updated_at": now,
+            "kind": kind,
+        }
+        if targets:
+            doc["targets"] = [
+                {"workspace_id": t["workspace_id"], "name": t["name"], "status": "pending"}
+                for t in targets
+            ]
+            doc["concurrency"] = concurrency or 1
+        try:
+            self.collection.insert_one(doc)
+            self._pool.submit(self._run, doc["_id"])
+        except Exception:
+            self._slots.release()
+            raise
+        return str(doc["_id"])
+
+    def get(self, job_id, owner=None):
+        try:
+            query = {"_id": ObjectId(job_id)}
+        except Exception:
+            return None
+        if owner is not None:
+            query["owner"] = owner
+        return self.collection.find_one(query)
+
+    def _claim(self, job_id=None):
+        """Takes the lease on one job (a specific one, or any abandoned one)."""
+        now = background.now()
+        query = {"status": {"$nin": list(FINAL_STATUSES)}}
+        if job_id is not None:
+            query["_id"] = job_id
+            query["$or"] = [{"worker": self.worker_id}, {"lease_until": {"$lt": now}}]
+        else:
+            query["lease_until"] = {"$lt": now}
+        return self.collection.find_one_and_update(
+            query,
+            {"$set": {
+                "worker": self.worker_id,
+                "lease_until": now + timedelta(seconds=JOB_LEASE_SECONDS),
+                "updated_at": now,
+            }},
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def _sweep_loop(self):
+        while True:
+            time.sleep(JOB_RESUME_INTERVAL)
+            try:
+                with self.app.app_context():
+                    while self._slots.acquire(blocking=False):
+                        job = self._claim()
+                        if job is None:
+                            self._slots.release()
+                            break
+                        self._pool.submit(self._run, job["_id"], job)
+            except Exception:
+                self.app.logger.exception("Job resume sweep failed")
+
+    def _run(self, job_id, job=None):
+        try:
+            with self.app.app_context():
+                job = job or self._claim(job_id)
+                if job is not None:
+                    self._execute(job)
+        except Exception:
+            self.app.logger.exception("Job %s crashed", job_id)
+        finally:
+            self._slots.release()
+
+    def _execute(self, job):
+        """
+        Runs every stage whose dependencies are done, several at a time.
+
+        Every write is conditional on this worker still holding the job and
+        renews its lease, as does a heartbeat while stages run. If another
+        worker has taken the job over (this one stalled past the lease), no
+        further stage is started here and the job is left to that worker.
+        """
+        result = dict(job.get("result") or {})
+        if not self._update_owned(job, {"status": "running"}):
+            return
+
+        done = {name for name, info in job["stages"].items() if info.get("status") == "done"}
+        waiting = [stage for stage in _stages_for(job) if stage[0] not in done]
+        running = {}
+        launched = set()
+        began = time.monotonic()
+        started, timings = {}, {}
+        error = None
+        lost = False
+
+        while waiting or running:
+            if error is None and not lost:
+                for stage in [st for st in waiting if set(st[2]) <= done]:
+                    name, fn = stage[0], stage[1]
+                    stage_state = {"status": "running", "started_at": background.now()}
+                    if not self._update_owned(job, {f"stages.{name}": stage_state}):
+                        lost = True
+                        break
+                    waiting.remove(stage)
+                    launched.add(name)
+                    started[name] = time.monotonic()
+                    running[self._stage_pool.submit(self._call_stage, name, fn, job, dict(result))] = name
+            if not running:
+                break
+            finished, _ = wait(running, timeout=JOB_HEARTBEAT_SECONDS, return_when=FIRST_COMPLETED)
+            if not finished and not lost:
+                lost = not self._update_owned(job, {})
+            for future in finished:
+                name = running.pop(future)
+                timings[name] = time.monotonic() - started.pop(name)
+                try:
+                    updates = future.result()
+                except Exception as e:
+                    # Let stages already in flight finish, but start no new ones.
+                    error = error or (name, e)
+                    lost = not self._update_owned(job, {
+                        f"stages.{name}.status": "failed",
+                        f"stages.{name}.finished_at": background.now(),
+                        f"stages.{name}.error": str(e),
+                    }) or lost
+                    continue
+                result.update(updates)
+                done.add(name)
+                fields = {f"result.{k}": v for k, v in updates.items()}
+                fields.update({
+                    f"stages.{name}.status": "done",
+                    f"stages.{name}.finished_at": background.now(),
+                })
+                lost = not self._update_owned(job, fields) or lost
+
+        if lost:
+            self.app.logger.warning("Job %s was taken over by another worker; leaving it to that one", job["_id"])
+            return
+        if error is not None:
+            name, e = error
+            message = str(e) if isinstance(e, StageError) else f"{name} failed: {e}"
+            try:
+                _recycle_unused_config(job, result, launched)
+            except Exception:
+                self.app.logger.exception("Could not keep spare configuration version")
+            self._update_owned(job, {"status": "failed", "error": message})
+        else:
+            self._update_owned(job, {"status": "succeeded"})
+        timings["total"] = time.monotonic() - began
+        self._record_history(job, result, timings, done, error)
+
+    def _update_owned(self, job, fields):
+        """Sets `fields` and renews the lease if this worker still holds the job; False if it does not."""
+        now = background.now()
+        fields = dict(fields, lease_until=now + timedelta(seconds=JOB_LEASE_SECONDS), updated_at=now)
+        owned = {"_id": job["_id"], "worker": self.worker_id}
+        return self.collection.update_one(owned, {"$set": fields}).matched_count == 1
+
+    def _record_history(self, job, result, timings, done, error):
+        if "validate" in done:
+            valid, validation_error = True, None
+        elif error is not None and error[0] == "validate":
+            valid, validation_error = False, str(error[1])
+        else:
+            valid, validation_error = None, None
+        try:
+            history.record_job(self.app.mongo, job, result, timings, valid, validation_error)
+        except Exception:
+            self.app.logger.exception("Could not record generation history for job %s", job["_id"])
+        if valid and not result.get("retrieved"):
+            retrieval.add(job["prompt"], result["tf_code"])
+
+    def _call_stage(self, name, fn, job, result):
+        with self.app.app_context(), span(f"job.{name}"):
+            return fn(job, result)
+
+
+
+def init_app(app):
+    runner = JobRunner(app)
+    app.extensions["jobs"] = runner
+    background.register(app, runner.start)
+    return runner
+
+
+def to_public(job):
+    """JSON-friendly view of a job document."""
+    result = job.get("result") or {}
+    return {
+        "id": str(job["_id"]),
+        "status": job["status"],
+        "workspace": job.get("workspace_name"),
+        "stages": [
+            {"name": name, **{k: (v.isoformat() if isinstance(v, datetime) else v)
+                              for k, v in job["stages"].get(name, {}).items()}}
+            for name, _, _ in _stages_for(job)
+        ],
+        "targets": [
+            {k: t.get(k) for k in ("name", "workspace_id", "status", "run_id", "error")}
+            for t in job.get("targets", [])
+        ],
+        "run_id": result.get("run_id"),
+        "retrieved": result.get("retrieved"),
+        "can_apply": result.get("can_apply", False),
+        "error": job.get("error"),
+    }
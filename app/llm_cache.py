@@ -0,0 +1,102 @@
+import hashlib
+import json
+import os
+import re
+import threading
+
+from flask import current_app, has_app_context
+from pymongo.errors import PyMongoError
+
+from app import background
+from app.cache import TTLCache
+from app.utils.validator import simple_hcl_sanity_check
+
+CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", "86400"))
+COLLECTION = "llm_cache"
+
+# Tier 1: per-process LRU. Tier 2: Mongo collection shared by every worker.
+_local = TTLCache(maxsize=int(os.getenv("LLM_CACHE_SIZE", "512")), ttl=CACHE_TTL)
+_index_lock = threading.Lock()
+_indexed = False
+_stats_lock = threading.Lock()
+_stats = {"shared_hits": 0, "shared_misses": 0, "stores": 0, "rejected": 0, "bypassed": 0}
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def normalize_prompt(prompt: str) -> str:
+    return re.sub(r"\s+", " ", prompt or "").strip().lower()
+
+
+def cache_key(prompt, model, system_prompt):
+    raw = json.dumps([normalize_prompt(prompt), model, system_prompt])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _collection():
+    """Mongo collection for the shared tier, or None outside an app context."""
+    global _indexed
+    if not has_app_context():
+        return None
+    coll = current_app.mongo[COLLECTION]
+    if not _indexed:
+        with _index_lock:
+            if not _indexed:
+                coll.create_index("created_at", expireAfterSeconds=CACHE_TTL)
+                _indexed = True
+    return coll
+
+
+def get(key):
+    hcl = _local.get(key)
+    if hcl is not None:
+        return hcl
+    try:
+        coll = _collection()
+        doc = coll.find_one({"_id": key}, {"hcl": 1}) if coll is not None else None
+    except PyMongoError:
+        doc = None
+    if not doc:
+        _count("shared_misses")
+        return None
+    _count("shared_hits")
+    _local.set(key, doc["hcl"])
+    return doc["hcl"]
+
+
+def put(key, hcl):
+    """Stores `hcl` in both tiers if it passes the sanity check."""
+    ok, _ = simple_hcl_sanity_check(hcl)
+    if not ok:
+        _count("rejected")
+        return False
+    _local.set(key, hcl)
+    try:
+        coll = _collection()
+        if coll is not None:
+            coll.replace_one(
+                {"_id": key},
+                {"_id": key, "hcl": hcl, "created_at": background.now()},
+                upsert=True,
+            )
+    except PyMongoError:
+        pass
+    _count("stores")
+    return True
+
+
+def note_bypass():
+    _count("bypassed")
+
+
+def stats():
+    with _stats_lock:
+        shared = dict(_stats)
+    return {"local": _local.stats(), **shared}
+
+
+def clear_local():
+    _local.invalidate()
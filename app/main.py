@@ -1,20 +1,35 @@
-from flask import Blueprint, render_template_string, request, redirect, url_for, session, current_app
+import os
+import time
+
+from flask import (
+    Blueprint, render_template, request, redirect, url_for, session, current_app, jsonify,
+    Response, stream_with_context, g,
+)
 from werkzeug.security import generate_password_hash, check_password_hash
 from bson.objectid import ObjectId
-
-from app.ai_integration import generate_tf_code
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from app import history, jobs, llm_cache, metrics, retrieval, run_logs
+from app import ai_integration, terraform_service
+from app.cache import TTLCache
+from app.ai_integration import MODEL, SYSTEM_PROMPT, stream_tf_code
+from app.env_vars import bulk_apply, parse_bulk_input, var_record
+from app.jobs import QueueFullError, to_public as job_to_public
+from app.db import pool_stats
+from app.migrations import ensure_indexes
+from app.mongo_stats import query_counter
+from app.reconcile import record_failed_deletion
+from app.run_tracker import latest_statuses, wake_run
+from app.utils.validator import IncrementalHclValidator
 from app.terraform_service import (
     create_workspace,
     delete_workspace,
     list_workspaces_in_org,
     add_env_variable,
     create_configuration_version,
-    upload_tf_to_url,
-    trigger_plan_run,
-    check_user_permissions,
     apply_run,
 )
-from app.utils.validator import simple_hcl_sanity_check
 
 main_bp = Blueprint("main", __name__)
 
@@ -22,14 +37,81 @@ main_bp = Blueprint("main", __name__)
 def _require_login():
     return "user" in session
 
+# email -> user record (no password). Set USER_CACHE_TTL=0 to disable.
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "5"))
+_user_cache = TTLCache(maxsize=1024, ttl=USER_CACHE_TTL)
+
 def _get_current_user():
-    """Fetch current logged-in user safely."""
+    """
+    Fetch current logged-in user safely (without the password hash).
+
+    Memoized on `g` for the rest of the request and, for USER_CACHE_TTL
+    seconds, per process.
+    """
     user_email = session.get("user")
     if not user_email:
         return None
-    user = current_app.mongo.users.find_one({"email": user_email})
+    if g.get("current_user_email") == user_email:
+        return g.current_user
+    user = _user_cache.get(user_email) if USER_CACHE_TTL > 0 else None
+    if user is None:
+        user = current_app.mongo.users.find_one({"email": user_email}, {"password": 0})
+        if user is not None and USER_CACHE_TTL > 0:
+            _user_cache.set(user_email, user)
+    g.current_user_email = user_email
+    g.current_user = user
     return user
 
+def _invalidate_user(email):
+    """Call after any write to the user's document."""
+    _user_cache.pop(email)
+    if g.get("current_user_email") == email:
+        g.pop("current_user_email")
+        g.pop("current_user", None)
+
+def _get_workspace(wid, fields=None):
+    """Fetch one of the current user's workspaces, projected to `fields`."""
+    try:
+        oid = ObjectId(wid)
+    except Exception:
+        return None
+    projection = {f: 1 for f in fields} if fields else None
+    return current_app.mongo.workspaces.find_one({"_id": oid, "owner": session.get("user")}, projection)
+
+_indexes_ready = False
+
+@main_bp.before_app_request
+def _start_request_timer():
+    g.request_started = time.perf_counter()
+
+@main_bp.before_app_request
+def _ensure_indexes_once():
+    global _indexes_ready
+    if not _indexes_ready:
+        duplicates = ensure_indexes(current_app.mongo)
+        if duplicates:
+            current_app.logger.warning(
+                "%d workspace_ids have duplicate records; workspace_id stays non-unique "
+                "until `flask dedupe-workspaces` resolves them", len(duplicates),
+            )
+        jobs.ensure_indexes(current_app.mongo)
+        history.ensure_indexes(current_app.mongo)
+        _indexes_ready = True
+
+@main_bp.after_app_request
+def _report_query_count(response):
+    response.headers["X-Mongo-Queries"] = str(g.get("mongo_queries", 0))
+    query_counter.request_finished()
+    started = g.get("request_started")
+    if started is not None:
+        elapsed = time.perf_counter() - started
+        metrics.REQUEST_SECONDS.observe(
+            elapsed, request.endpoint or "unknown", request.method, str(response.status_code)
+        )
+        metrics.add_server_timing("total", elapsed)
+        response.headers["Server-Timing"] = metrics.server_timing_header()
+    return response
+
 # ------------------ Templates ------------------
 LOGIN_HTML = """
 <h2>Login</h2>
@@ -60,8 +142,12 @@ DASHBOARD_HTML = """
 {% for ws in workspaces %}
   <li>
     {{ ws.name }} (id: {{ ws.workspace_id }})
+    {% set run = runs.get(ws.workspace_id) %}
+    {% if run %}— last run {{ run.run_id }}: <b>{{ run.status }}</b>
+      (<a href="{{ url_for('main.run_logs_route', run_id=run.run_id) }}">logs</a>){% endif %}
     — <a href="{{ url_for('main.open_workspace', wid=ws._id) }}">Open</a>
     — <a href="{{ url_for('main.manage_vars', wid=ws._id) }}">Env Vars</a>
+    — <a href="{{ url_for('main.workspace_history', wid=ws._id) }}">History</a>
     — <a href="{{ url_for('main.delete_workspace_route', wid=ws._id) }}">Delete</a>
   </li>
 {% endfor %}
@@ -73,6 +159,16 @@ DASHBOARD_HTML = """
   <button type="submit">Create</button>
 </form>
 
+<h3>Deploy to Many Workspaces</h3>
+<form method="post" action="{{ url_for('main.deploy_multi') }}">
+  {% for ws in workspaces %}
+    <label><input type="checkbox" name="wid" value="{{ ws._id }}"> {{ ws.name }}</label><br/>
+  {% endfor %}
+  <textarea name="prompt" rows="3" cols="80" placeholder="e.g. Create a resource group and a virtual network" required></textarea><br/>
+  Parallel deployments: <input name="concurrency" type="number" min="1" value="4" style="width:4em">
+  <button type="submit">Deploy</button>
+</form>
+
 <h3>Import My Workspaces</h3>
 <form method="post" action="{{ url_for('main.import_workspaces') }}">
   <button type="submit">Import</button>
@@ -81,12 +177,25 @@ DASHBOARD_HTML = """
 
 VARS_HTML = """
 <h2>Manage Env Vars — {{ ws.name }}</h2>
-<form method="post">
+<form method="post" action="{{ url_for('main.manage_vars', wid=wid) }}">
   Key: <input name="key" required> &nbsp;
   Value: <input name="value" required> &nbsp;
   Sensitive: <input type="checkbox" name="sensitive" checked>
   <button type="submit">Add</button>
 </form>
+<h3>Bulk import</h3>
+<form method="post" action="{{ url_for('main.bulk_vars', wid=wid) }}">
+  <textarea name="payload" rows="8" cols="60" placeholder="KEY=value lines (.env) or a JSON object"></textarea><br/>
+  Sensitive: <input type="checkbox" name="sensitive" checked>
+  <button type="submit">Import</button>
+</form>
+{% if report %}
+<ul>
+{% for key, outcome in report.items() %}
+  <li>{{ key }}: {{ outcome.status }}{% if outcome.error %} — {{ outcome.error }}{% endif %}</li>
+{% endfor %}
+</ul>
+{% endif %}
 <p><a href="{{ url_for('main.dashboard') }}">Back</a></p>
 <ul>
 {% for v in vars %}
@@ -105,17 +214,37 @@ PROMPT_HTML = """
 
   <form method="post" action="{{ url_for('main.generate') }}">
     <label><b>Deployment prompt</b></label><br/>
-    <textarea name="prompt" rows="5" cols="80" placeholder="e.g. Create an Azure resource group in East US"></textarea><br/><br/>
+    <textarea name="prompt" rows="5" cols="80" placeholder="e.g. Create an Azure resource group in East US"></textarea><br/>
+    <label><input type="checkbox" name="regenerate"> Regenerate (skip cached and known-good results)</label><br/><br/>
     <button type="submit">Generate Terraform Plan</button>
+    <button type="submit" formaction="{{ url_for('main.generate_stream') }}">Generate (streaming)</button>
   </form>
 
+  {% if offer %}
+    <hr/>
+    <h3>Known-good HCL for a similar prompt</h3>
+    <p><i>Written for "{{ offer.prompt }}" (similarity {{ "%.2f"|format(offer.score) }}). Nothing has been
+    deployed: check it does what you asked for.</i></p>
+    <pre style="background:#f3f3f3;padding:12px;border-radius:6px;max-height:400px;overflow:auto;">{{ offer.hcl }}</pre>
+    <form method="post" action="{{ url_for('main.generate') }}">
+      <input type="hidden" name="prompt" value="{{ prompt_text }}" />
+      <input type="hidden" name="use_known" value="{{ offer.hcl_hash }}" />
+      <button type="submit">Use this HCL and plan</button>
+      <button type="submit" name="skip_known" value="1">Ask the model instead</button>
+    </form>
+  {% endif %}
+
   {% if tf_code %}
     <hr/>
     <h3>Generated Terraform HCL</h3>
+    {% if retrieved %}
+      <p><i>Known-good HCL you confirmed for a similar prompt ("{{ retrieved.prompt }}", similarity {{ "%.2f"|format(retrieved.score) }}).</i></p>
+    {% endif %}
     <pre style="background:#f3f3f3;padding:12px;border-radius:6px;max-height:400px;overflow:auto;">{{ tf_code }}</pre>
 
     <h3>Plan</h3>
     <p>{{ plan_msg }}</p>
+    {% if run_id %}<p><a href="{{ url_for('main.run_logs_route', run_id=run_id) }}">Follow plan/apply logs</a></p>{% endif %}
 
     {% if can_apply %}
       <form method="post" action="{{ url_for('main.apply') }}">
@@ -130,6 +259,79 @@ PROMPT_HTML = """
 </html>
 """
 
+JOB_HTML = """
+<!doctype html>
+<html>
+<head>
+  <meta charset="utf-8"><title>AI Terraform Cloud Deployer</title>
+  {% if job.status not in ("succeeded", "failed") %}<meta http-equiv="refresh" content="2">{% endif %}
+</head>
+<body style="font-family: Arial, sans-serif; margin:40px;">
+  <h2>Workspace: {{ job.workspace }}</h2>
+  <p><a href="{{ url_for('main.prompt') }}">Back to prompt</a></p>
+  <p>Job {{ job.id }} — <b>{{ job.status }}</b></p>
+  <ol>
+  {% for st in job.stages %}
+    <li>{{ st.name }}: {{ st.status }}{% if st.error %} — {{ st.error }}{% endif %}</li>
+  {% endfor %}
+  </ol>
+  {% if job.error %}<p style="color:crimson;">{{ job.error }}</p>{% endif %}
+  {% if job.targets %}
+  <table border="1" cellpadding="4" style="border-collapse:collapse;">
+    <tr><th>Workspace</th><th>Status</th><th>Run</th><th>Error</th></tr>
+    {% for t in job.targets %}
+    <tr><td>{{ t.name }}</td><td>{{ t.status }}</td><td>{{ t.run_id or "" }}</td><td>{{ t.error or "" }}</td></tr>
+    {% endfor %}
+  </table>
+  {% endif %}
+</body>
+</html>
+"""
+
+HISTORY_HTML = """
+<h2>History — {{ ws.name }}</h2>
+<p><a href="{{ url_for('main.dashboard') }}">Back to Dashboard</a></p>
+{% if entries %}
+<table border="1" cellpadding="4" style="border-collapse:collapse;">
+  <tr><th>When (UTC)</th><th>Prompt</th><th>HCL</th><th>Valid</th><th>Run</th><th>Time</th></tr>
+  {% for e in entries %}
+  <tr>
+    <td>{{ e.created_at.strftime("%Y-%m-%d %H:%M:%S") }}</td>
+    <td>{{ e.prompt|truncate(80) }}</td>
+    <td>{% if e.hcl_hash %}<a href="{{ url_for('main.generation_view', gid=e._id) }}">{{ e.hcl_hash[:12] }}</a>{% endif %}</td>
+    <td>{% if e.valid is none %}—{% elif e.valid %}yes{% else %}no: {{ e.validation_error }}{% endif %}</td>
+    <td>{% if e.run_id %}<a href="{{ url_for('main.run_logs_route', run_id=e.run_id) }}">{{ e.run_id }}</a>{% endif %}</td>
+    <td>{{ "%.1f s"|format(e.timings.total) if e.timings.total is defined else "" }}</td>
+  </tr>
+  {% endfor %}
+</table>
+{% else %}
+<p>No generations recorded yet.</p>
+{% endif %}
+{% if next_cursor %}<p><a href="{{ url_for('main.workspace_history', wid=wid, before=next_cursor) }}">Older</a></p>{% endif %}
+"""
+
+GENERATION_HTML = """
+<h2>Generation {{ entry._id }}</h2>
+<p><a href="{{ url_for('main.dashboard') }}">Back to Dashboard</a></p>
+<p>Workspace: {{ entry.workspace_name or entry.workspace_id }} — {{ entry.created_at.strftime("%Y-%m-%d %H:%M:%S") }} UTC</p>
+<p>Prompt: {{ entry.prompt }}</p>
+{% if entry.timings %}<p>{% for stage, seconds in entry.timings.items() %}{{ stage }} {{ seconds }} s{% if not loop.last %}, {% endif %}{% endfor %}</p>{% endif %}
+<pre style="background:#f3f3f3;padding:12px;border-radius:6px;">{{ tf_code }}</pre>
+"""
+
+# Registered with the app's Jinja loader by app.templating at startup.
+TEMPLATES = {
+    "login.html": LOGIN_HTML,
+    "register.html": REGISTER_HTML,
+    "dashboard.html": DASHBOARD_HTML,
+    "vars.html": VARS_HTML,
+    "prompt.html": PROMPT_HTML,
+    "job.html": JOB_HTML,
+    "history.html": HISTORY_HTML,
+    "generation.html": GENERATION_HTML,
+}
+
 # ------------------ Auth routes ------------------
 @main_bp.route("/", methods=["GET"])
 def root():
@@ -140,25 +342,29 @@ def login():
     if request.method == "POST":
         email = request.form["email"].strip().lower()
         password = request.form["password"]
-        user = current_app.mongo.users.find_one({"email": email})
+        user = current_app.mongo.users.find_one({"email": email}, {"password": 1})
         if not user or not check_password_hash(user["password"], password):
             return "Invalid credentials", 401
         session["user"] = email
         return redirect(url_for("main.dashboard"))
-    return render_template_string(LOGIN_HTML)
+    return render_template("login.html")
 
 @main_bp.route("/register", methods=["GET", "POST"])
 def register():
     if request.method == "POST":
         email = request.form["email"].strip().lower()
         password = request.form["password"]
-        if current_app.mongo.users.find_one({"email": email}):
+        if current_app.mongo.users.find_one({"email": email}, {"_id": 1}):
             return "User already exists. Please login.", 400
         hashed = generate_password_hash(password)
-        current_app.mongo.users.insert_one({"email": email, "password": hashed, "workspaces": []})
+        try:
+            current_app.mongo.users.insert_one({"email": email, "password": hashed})
+        except DuplicateKeyError:
+            return "User already exists. Please login.", 400
+        _invalidate_user(email)
         session["user"] = email
         return redirect(url_for("main.dashboard"))
-    return render_template_string(REGISTER_HTML)
+    return render_template("register.html")
 
 @main_bp.route("/logout")
 def logout():
@@ -175,10 +381,14 @@ def dashboard():
         session.clear()
         return redirect(url_for("main.login"))
 
-    workspaces = user.get("workspaces", [])
+    workspaces = list(current_app.mongo.workspaces.find(
+        {"owner": session["user"]}, {"name": 1, "workspace_id": 1}
+    ).sort("name", 1))
     for ws in workspaces:
         ws["_id"] = str(ws["_id"])
-    return render_template_string(DASHBOARD_HTML, user=session["user"], workspaces=workspaces)
+    # Kept current by the background run tracker; no Terraform Cloud calls here.
+    runs = latest_statuses(current_app.mongo, [ws["workspace_id"] for ws in workspaces])
+    return render_template("dashboard.html", user=session["user"], workspaces=workspaces, runs=runs)
 
 @main_bp.route("/workspace/create", methods=["POST"])
 def create_workspace_route():
@@ -203,14 +413,12 @@ def create_workspace_route():
     except Exception as e:
         return f"Terraform Cloud error: {e}", 500
 
-    ws_doc = {
-        "_id": ObjectId(),
-        "name": ws_name,
-        "workspace_id": ws_id,
-        "vars": [],
-        "owner": user_email,
-    }
-    current_app.mongo.users.update_one({"email": user_email}, {"$push": {"workspaces": ws_doc}})
+    # Upserted: the reconciler may already have recorded the new workspace.
+    current_app.mongo.workspaces.update_one(
+        {"workspace_id": ws_id},
+        {"$set": {"name": ws_name, "owner": user_email}, "$setOnInsert": {"vars": []}},
+        upsert=True,
+    )
     return redirect(url_for("main.dashboard"))
 
 @main_bp.route("/workspaces/import", methods=["POST"])
@@ -225,32 +433,32 @@ def import_workspaces():
     org = current_app.config.get("TERRAFORM_ORG_NAME")
     user_email = session["user"]
 
+    user_prefix = user_email.split("@")[0].lower()
     try:
-        remote_ws = list_workspaces_in_org(org)
+        # search[name] is a substring match, so the prefix check below still applies.
+        remote_ws = list_workspaces_in_org(org, search=user_prefix)
     except Exception as e:
         return f"Error listing remote workspaces: {e}", 500
 
-    existing_ids = {ws["workspace_id"] for ws in user.get("workspaces", [])}
-    user_prefix = user_email.split("@")[0].lower()
+    existing_ids = {
+        ws["workspace_id"]
+        for ws in current_app.mongo.workspaces.find({"owner": user_email}, {"workspace_id": 1, "_id": 0})
+    }
     owned_remote = [r for r in remote_ws if r["name"].startswith(user_prefix)]
 
-    to_add = []
-    for r in owned_remote:
-        if r["id"] not in existing_ids:
-            ws_doc = {
-                "_id": ObjectId(),
-                "name": r["name"],
-                "workspace_id": r["id"],
-                "vars": [],
-                "owner": user_email,
-            }
-            to_add.append(ws_doc)
+    # workspace_id is unique; one recorded meanwhile (e.g. by the reconciler) is left as it is.
+    to_add = [
+        UpdateOne(
+            {"workspace_id": r["id"]},
+            {"$setOnInsert": {"name": r["name"], "vars": [], "owner": user_email}},
+            upsert=True,
+        )
+        for r in owned_remote
+        if r["id"] not in existing_ids
+    ]
 
     if to_add:
-        current_app.mongo.users.update_one(
-            {"email": user_email},
-            {"$push": {"workspaces": {"$each": to_add}}},
-        )
+        current_app.mongo.workspaces.bulk_write(to_add, ordered=False)
 
     return redirect(url_for("main.dashboard"))
 
@@ -263,14 +471,15 @@ def delete_workspace_route(wid):
         session.clear()
         return redirect(url_for("main.login"))
 
-    ws = next((w for w in user.get("workspaces", []) if str(w["_id"]) == wid), None)
+    ws = _get_workspace(wid, ["workspace_id"])
     if not ws:
         return "Workspace not found", 404
     try:
         delete_workspace(ws["workspace_id"])
-    except Exception:
-        pass
-    current_app.mongo.users.update_one({"email": user["email"]}, {"$pull": {"workspaces": {"_id": ObjectId(wid)}}})
+    except Exception as e:
+        # Hidden from the user right away; the reconciler keeps retrying the remote delete.
+        record_failed_deletion(current_app.mongo, ws["workspace_id"], session["user"], e)
+    current_app.mongo.workspaces.delete_one({"_id": ws["_id"]})
     return redirect(url_for("main.dashboard"))
 
 @main_bp.route("/workspace/<wid>/vars", methods=["GET", "POST"])
@@ -282,7 +491,7 @@ def manage_vars(wid):
         session.clear()
         return redirect(url_for("main.login"))
 
-    ws = next((w for w in user.get("workspaces", []) if str(w["_id"]) == wid), None)
+    ws = _get_workspace(wid, ["name", "workspace_id", "vars"])
     if not ws:
         return "Workspace not found", 404
 
@@ -296,13 +505,43 @@ def manage_vars(wid):
             add_env_variable(ws["workspace_id"], key, value, sensitive=sensitive)
         except Exception as e:
             return f"Error adding variable: {e}", 500
-        current_app.mongo.users.update_one(
-            {"email": user["email"], "workspaces._id": ObjectId(wid)},
-            {"$push": {"workspaces.$.vars": {"key": key, "value": (None if sensitive else value), "sensitive": sensitive}}},
+        current_app.mongo.workspaces.update_one(
+            {"_id": ws["_id"]},
+            {"$push": {"vars": var_record(key, value, sensitive)}},
         )
         return redirect(url_for("main.manage_vars", wid=wid))
 
-    return render_template_string(VARS_HTML, ws=ws, vars=ws.get("vars", []))
+    return render_template("vars.html", ws=ws, wid=wid, vars=ws.get("vars", []))
+
+@main_bp.route("/workspace/<wid>/vars/bulk", methods=["POST"])
+def bulk_vars(wid):
+    if not _require_login():
+        return redirect(url_for("main.login"))
+    user = _get_current_user()
+    if not user:
+        session.clear()
+        return redirect(url_for("main.login"))
+
+    ws = _get_workspace(wid, ["name", "workspace_id", "vars"])
+    if not ws:
+        return "Workspace not found", 404
+
+    try:
+        pairs = parse_bulk_input(request.form.get("payload", ""))
+    except ValueError as e:
+        return f"Invalid input: {e}", 400
+    if not pairs:
+        return "No variables provided", 400
+
+    sensitive = True if request.form.get("sensitive") else False
+    try:
+        report, merged = bulk_apply(ws["workspace_id"], pairs, ws.get("vars", []), sensitive=sensitive)
+    except Exception as e:
+        return f"Error importing variables: {e}", 500
+
+    if any(o["status"] in ("created", "updated") for o in report.values()):
+        current_app.mongo.workspaces.update_one({"_id": ws["_id"]}, {"$set": {"vars": merged}})
+    return render_template("vars.html", ws=ws, wid=wid, vars=merged, report=report)
 
 @main_bp.route("/workspace/<wid>/open", methods=["GET"])
 def open_workspace(wid):
@@ -313,20 +552,42 @@ def open_workspace(wid):
         session.clear()
         return redirect(url_for("main.login"))
 
-    ws = next((w for w in user.get("workspaces", []) if str(w["_id"]) == wid), None)
+    ws = _get_workspace(wid, ["name", "workspace_id"])
     if not ws:
         return "Workspace not found", 404
     session["selected_workspace_id"] = ws["workspace_id"]
     session["selected_workspace_name"] = ws["name"]
     return redirect(url_for("main.prompt"))
 
+@main_bp.route("/workspace/<wid>/history", methods=["GET"])
+def workspace_history(wid):
+    if not _require_login():
+        return redirect(url_for("main.login"))
+    ws = _get_workspace(wid, ["name", "workspace_id"])
+    if not ws:
+        return "Workspace not found", 404
+    entries, next_cursor = history.page(
+        current_app.mongo, ws["workspace_id"], session["user"], before=request.args.get("before")
+    )
+    return render_template("history.html", ws=ws, wid=wid, entries=entries, next_cursor=next_cursor)
+
+@main_bp.route("/history/<gid>", methods=["GET"])
+def generation_view(gid):
+    if not _require_login():
+        return redirect(url_for("main.login"))
+    entry = history.get(current_app.mongo, gid, session["user"])
+    if not entry:
+        return "Generation not found", 404
+    tf_code = history.get_hcl(current_app.mongo, entry["hcl_hash"]) if entry.get("hcl_hash") else None
+    return render_template("generation.html", entry=entry, tf_code=tf_code or "")
+
 # ------------------ Prompt / Plan / Apply ------------------
 @main_bp.route("/prompt", methods=["GET"])
 def prompt():
     if not _require_login():
         return redirect(url_for("main.login"))
     ws_name = session.get("selected_workspace_name", "(none selected)")
-    return render_template_string(PROMPT_HTML, ws_name=ws_name)
+    return render_template("prompt.html", ws_name=ws_name)
 
 @main_bp.route("/generate", methods=["POST"])
 def generate():
@@ -341,37 +602,221 @@ def generate():
     if not prompt_text:
         return "Provide a deployment prompt.", 400
 
-    try:
-        tf_code = generate_tf_code(prompt_text)
-    except Exception as e:
-        return f"Error generating code: {e}", 500
-
-    ok, msg = simple_hcl_sanity_check(tf_code)
-    if not ok:
-        return f"Validation failed: {msg}", 400
-
     workspace_id = session.get("selected_workspace_id")
     if not workspace_id:
         return "No workspace selected. Go back and open a workspace first.", 400
 
+    bypass_cache = bool(request.form.get("regenerate"))
+    tf_code = match = None
+    if not bypass_cache and not request.form.get("skip_known"):
+        match = retrieval.lookup(prompt_text)
+        if match is not None and request.form.get("use_known") != match["hcl_hash"]:
+            # Offer it; it is only deployed once the user confirms this exact HCL.
+            if request.accept_mimetypes.best == "application/json":
+                return jsonify({"offer": match})
+            return render_template("prompt.html", ws_name=session.get("selected_workspace_name"),
+                                   prompt_text=prompt_text, offer=match)
+        if match is not None:
+            tf_code = match.pop("hcl")
+
     try:
-        conf = create_configuration_version(workspace_id, auto_queue_runs=True)
-        upload_tf_to_url(conf["attributes"]["upload-url"], tf_code)
-        run_id = trigger_plan_run(workspace_id, conf["id"])
-        plan_msg = f"Plan queued successfully. Run ID: {run_id}"
-    except Exception as e:
-        return f"Terraform Cloud error: {e}", 500
+        job_id = current_app.extensions["jobs"].submit(
+            owner=session["user"],
+            workspace_id=workspace_id,
+            workspace_name=session.get("selected_workspace_name"),
+            prompt=prompt_text,
+            bypass_cache=bypass_cache,
+            tf_code=tf_code,
+            retrieved=match,
+        )
+    except QueueFullError as e:
+        return str(e), 503
+
+    if request.accept_mimetypes.best == "application/json":
+        return jsonify({"job_id": job_id}), 202
+    return redirect(url_for("main.job_view", job_id=job_id))
+
+@main_bp.route("/deploy/multi", methods=["POST"])
+def deploy_multi():
+    """Generates once and deploys the same HCL to every selected workspace."""
+    if not _require_login():
+        return redirect(url_for("main.login"))
+    user = _get_current_user()
+    if not user:
+        session.clear()
+        return redirect(url_for("main.login"))
+
+    prompt_text = request.form.get("prompt", "").strip()
+    if not prompt_text:
+        return "Provide a deployment prompt.", 400
+    try:
+        oids = [ObjectId(w) for w in request.form.getlist("wid")]
+    except Exception:
+        return "Invalid workspace selection", 400
+    if not oids:
+        return "Select at least one workspace.", 400
+    targets = list(current_app.mongo.workspaces.find(
+        {"_id": {"$in": oids}, "owner": session["user"]}, {"name": 1, "workspace_id": 1}
+    ))
+    if len(targets) != len(set(oids)):
+        return "Workspace not found", 404
+    try:
+        concurrency = max(1, int(request.form.get("concurrency", "4")))
+    except ValueError:
+        return "Concurrency must be a number", 400
+
+    try:
+        job_id = current_app.extensions["jobs"].submit(
+            owner=session["user"],
+            workspace_id=None,
+            workspace_name=f"{len(targets)} workspaces",
+            prompt=prompt_text,
+            targets=targets,
+            concurrency=concurrency,
+        )
+    except QueueFullError as e:
+        return str(e), 503
+
+    if request.accept_mimetypes.best == "application/json":
+        return jsonify({"job_id": job_id}), 202
+    return redirect(url_for("main.job_view", job_id=job_id))
+
+@main_bp.route("/generate/stream", methods=["POST"])
+def generate_stream():
+    """
+    Relays LLM tokens to the browser as they arrive and aborts the upstream
+    call as soon as the incremental validator rejects the output. A valid
+    result is handed to the job pipeline for the Terraform Cloud stages.
+    """
+    if not _require_login():
+        return redirect(url_for("main.login"))
+    user = _get_current_user()
+    if not user:
+        session.clear()
+        return redirect(url_for("main.login"))
 
-    can_apply = check_user_permissions(workspace_id)
-    return render_template_string(
-        PROMPT_HTML,
-        ws_name=session.get("selected_workspace_name"),
-        tf_code=tf_code,
-        plan_msg=plan_msg,
-        can_apply=can_apply,
-        run_id=run_id,
+    prompt_text = request.form.get("prompt", "").strip()
+    if not prompt_text:
+        return "Provide a deployment prompt.", 400
+    workspace_id = session.get("selected_workspace_id")
+    if not workspace_id:
+        return "No workspace selected. Go back and open a workspace first.", 400
+    owner = session["user"]
+    workspace_name = session.get("selected_workspace_name")
+
+    # Close enough to a known-good prompt: show that HCL, but deploy nothing
+    # until the user confirms it through /generate.
+    match = None if request.form.get("regenerate") else retrieval.lookup(prompt_text)
+
+    def events():
+        if match is not None:
+            yield (f"[known-good HCL for a similar prompt ({match['prompt']!r}, "
+                   f"similarity {match['score']:.2f}); not deployed]\n\n")
+            yield match["hcl"].strip() + "\n"
+            yield ("\n[use Generate Terraform Plan to review and deploy it, "
+                   "or tick Regenerate to ask the model]\n")
+            return
+
+        validator = IncrementalHclValidator()
+        chunks = stream_tf_code(prompt_text)
+        try:
+            for chunk in chunks:
+                yield chunk
+                ok, msg = validator.feed(chunk)
+                if not ok:
+                    yield f"\n\n[aborted: {msg}]\n"
+                    return
+        except Exception as e:
+            yield f"\n\n[error: {e}]\n"
+            return
+        finally:
+            chunks.close()
+
+        tf_code = validator.text.strip()
+        ok, msg = validator.finish()
+        if not ok:
+            try:
+                history.record(current_app.mongo, owner, workspace_id, prompt_text, tf_code=tf_code,
+                               source="stream", valid=False, validation_error=msg,
+                               workspace_name=workspace_name)
+            except Exception:
+                current_app.logger.exception("Could not record generation history")
+            yield f"\n\n[validation failed: {msg}]\n"
+            return
+        llm_cache.put(llm_cache.cache_key(prompt_text, MODEL, SYSTEM_PROMPT), tf_code)
+        try:
+            job_id = current_app.extensions["jobs"].submit(
+                owner=owner,
+                workspace_id=workspace_id,
+                workspace_name=workspace_name,
+                prompt=prompt_text,
+                tf_code=tf_code,
+            )
+        except QueueFullError as e:
+            yield f"\n\n[{e}]\n"
+            return
+        yield f"\n\n[queued plan job {job_id}: {url_for('main.job_view', job_id=job_id)}]\n"
+
+    return Response(stream_with_context(events()), mimetype="text/plain")
+
+@main_bp.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    if not _require_login():
+        return jsonify({"error": "login required"}), 401
+    job = current_app.extensions["jobs"].get(job_id, owner=session["user"])
+    if not job:
+        return jsonify({"error": "job not found"}), 404
+    return jsonify(job_to_public(job))
+
+@main_bp.route("/jobs/<job_id>/view", methods=["GET"])
+def job_view(job_id):
+    if not _require_login():
+        return redirect(url_for("main.login"))
+    job = current_app.extensions["jobs"].get(job_id, owner=session["user"])
+    if not job:
+        return "Job not found", 404
+    if job["status"] != "succeeded" or job.get("kind") == "fanout":
+        return render_template("job.html", job=job_to_public(job))
+
+    result = job["result"]
+    return render_template(
+        "prompt.html",
+        ws_name=job.get("workspace_name"),
+        tf_code=result["tf_code"],
+        plan_msg=f"Plan queued successfully. Run ID: {result['run_id']}",
+        can_apply=result.get("can_apply", False),
+        run_id=result["run_id"],
+        retrieved=result.get("retrieved"),
     )
 
+# ------------------ Stats ------------------
+@main_bp.route("/stats", methods=["GET"])
+def stats():
+    return jsonify({
+        "user_cache": _user_cache.stats(),
+        "mongo": query_counter.stats(),
+        "mongo_pool": pool_stats.stats(),
+        "llm_cache": llm_cache.stats(),
+        "terraform_http": terraform_service.client.stats(),
+        "terraform_rate_limit": terraform_service.client.rate_limiter.stats(),
+        "terraform_workspace_cache": terraform_service.workspace_cache_stats(),
+        "hf_http": ai_integration.client.stats(),
+        "hf_rate_limit": ai_integration.client.rate_limiter.stats(),
+        "llm_calls": ai_integration.call_stats(),
+        "llm_models": ai_integration.router.stats(),
+        "retrieval": retrieval.stats(),
+        "run_tracker": current_app.extensions["run_tracker"].stats(),
+        "reconciler": current_app.extensions["reconciler"].stats(),
+        "history": dict(history.cached_storage_stats(current_app.mongo),
+                        compactor=current_app.extensions["history_compactor"].stats()),
+        "run_logs": run_logs.stats(),
+    })
+
+@main_bp.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    limiters = (terraform_service.client.rate_limiter, ai_integration.client.rate_limiter)
+    return Response(metrics.render_prometheus(limiters), mimetype="text/plain; version=0.0.4")
+
 @main_bp.route("/apply", methods=["POST"])
 def apply():
     if not _require_login():
@@ -385,13 +830,23 @@ def apply():
     try:
         ok = apply_run(run_id)
         if ok:
+            wake_run(current_app.mongo, run_id)
             return f"Apply request submitted for run {run_id}."
         else:
             return "Failed to start apply.", 500
     except Exception as e:
         return f"Apply error: {e}", 500
 
-
-
-
-
+# ------------------ Run logs ------------------
+@main_bp.route("/runs/<run_id>/logs", methods=["GET"])
+def run_logs_route(run_id):
+    """Streams the run's plan and apply output as it is written, then the change summary."""
+    if not _require_login():
+        return redirect(url_for("main.login"))
+    db = current_app.mongo
+    run = db.runs.find_one({"_id": run_id}, {"workspace_id": 1})
+    if not run or not db.workspaces.find_one(
+        {"workspace_id": run["workspace_id"], "owner": session["user"]}, {"_id": 1}
+    ):
+        return "Run not found", 404
+    return Response(run_logs.stream(run_id), mimetype="text/plain")
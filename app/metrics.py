@@ -0,0 +1,153 @@
+"""
+In-process latency histograms and a Prometheus text exposition of them.
+
+`span(stage)` times a block into `app_stage_seconds{stage, status}` and, in a
+request context, adds it to that response's Server-Timing header.
+`timed(stage)` is the decorator form. Counters are per process.
+
+The client-side rate limiters (app.rate_limit) are exported alongside as
+`app_rate_limit_*` counters and gauges, one series per limiter.
+"""
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    def __init__(self, name, help_text, labelnames, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+
+    def observe(self, seconds, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series[i] += 1
+            series[-2] += seconds
+            series[-1] += 1
+
+    def collect(self):
+        with self._lock:
+            return {labels: list(series) for labels, series in self._series.items()}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self.collect().items()):
+            base = ",".join(f'{k}="{_escape(v)}"' for k, v in zip(self.labelnames, labels))
+            sep = "," if base else ""
+            for bound, count in zip(self.buckets, series):
+                lines.append(f'{self.name}_bucket{{{base}{sep}le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{base}{sep}le="+Inf"}} {series[-1]}')
+            lines.append(f"{self.name}_sum{{{base}}} {series[-2]:.6f}")
+            lines.append(f"{self.name}_count{{{base}}} {series[-1]}")
+        return "\n".join(lines)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+STAGE_SECONDS = Histogram(
+    "app_stage_seconds", "Time spent per instrumented stage.", ("stage", "status"),
+)
+HTTP_SECONDS = Histogram(
+    "app_http_request_seconds", "Outbound HTTP attempts by upstream, method and status code.",
+    ("client", "method", "code"),
+)
+MONGO_SECONDS = Histogram(
+    "app_mongo_command_seconds", "MongoDB commands by name and outcome.", ("command", "status"),
+)
+REQUEST_SECONDS = Histogram(
+    "app_request_seconds", "Inbound requests by endpoint, method and status code.",
+    ("endpoint", "method", "code"),
+)
+HISTOGRAMS = (REQUEST_SECONDS, STAGE_SECONDS, HTTP_SECONDS, MONGO_SECONDS)
+
+
+# ---------- Server-Timing ----------
+def add_server_timing(name, seconds):
+    """Accumulates `seconds` under `name` for the current response, if any."""
+    if not has_request_context():
+        return
+    timings = g.get("server_timing")
+    if timings is None:
+        timings = g.server_timing = {}
+    timings[name] = timings.get(name, 0.0) + seconds
+
+def server_timing_header():
+    timings = g.get("server_timing") or {}
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items())
+
+
+# ---------- Spans ----------
+@contextmanager
+def span(stage):
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage, status)
+        add_server_timing(stage, elapsed)
+
+def timed(stage):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# ---------- Rate limiters ----------
+# (metric, type, help, RateLimiter.stats() key)
+RATE_LIMIT_METRICS = (
+    ("app_rate_limit_acquired_total", "counter",
+     "Requests let through by the limiter.", "acquired"),
+    ("app_rate_limit_delayed_total", "counter",
+     "Requests that had to wait for a slot.", "delayed"),
+    ("app_rate_limit_wait_seconds_total", "counter",
+     "Time spent waiting for a slot.", "total_wait_seconds"),
+    ("app_rate_limit_throttle_events_total", "counter",
+     "429s and exhausted X-RateLimit-Remaining windows that paused the limiter.", "throttle_events"),
+    ("app_rate_limit_max_wait_seconds", "gauge",
+     "Longest single wait for a slot.", "max_wait_seconds"),
+    ("app_rate_limit_rate", "gauge",
+     "Configured requests per second.", "rate"),
+    ("app_rate_limit_burst", "gauge",
+     "Configured burst size.", "burst"),
+)
+
+
+def render_rate_limiters(limiters):
+    stats = [(limiter.name, limiter.stats()) for limiter in limiters]
+    lines = []
+    for name, kind, help_text, key in RATE_LIMIT_METRICS:
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+        for limiter, values in stats:
+            lines.append(f'{name}{{limiter="{_escape(limiter)}"}} {values[key]}')
+    return "\n".join(lines)
+
+
+def render_prometheus(limiters=()):
+    parts = [h.render() for h in HISTOGRAMS]
+    if limiters:
+        parts.append(render_rate_limiters(limiters))
+    return "\n".join(parts) + "\n"
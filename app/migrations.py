@@ -0,0 +1,162 @@
+import click
+from pymongo import ASCENDING, DeleteMany, ReplaceOne
+from pymongo.errors import BulkWriteError, OperationFailure
+
+DUPLICATE_KEY = 11000
+
+
+def ensure_indexes(db):
+    """Creates the indexes; returns the workspace_id duplicates that keep that index non-unique."""
+    db.users.create_index([("email", ASCENDING)], unique=True)
+    db.workspaces.create_index([("owner", ASCENDING), ("name", ASCENDING)])
+    return _ensure_unique_workspace_id(db)
+
+
+def _ensure_unique_workspace_id(db):
+    """
+    One record per Terraform Cloud workspace, so concurrent writers upsert
+    instead of duplicating. Never deletes anything: while duplicates exist
+    the index stays non-unique and they are returned, to be resolved with
+    `flask dedupe-workspaces`.
+    """
+    existing = db.workspaces.index_information().get("workspace_id_1")
+    if existing is not None and existing.get("unique"):
+        return []
+    duplicates = duplicate_workspaces(db)
+    if duplicates:
+        if existing is None:
+            db.workspaces.create_index([("workspace_id", ASCENDING)])
+        return duplicates
+    if existing is not None:
+        db.workspaces.drop_index("workspace_id_1")  # the earlier non-unique index
+    try:
+        db.workspaces.create_index([("workspace_id", ASCENDING)], unique=True)
+    except OperationFailure as e:
+        if e.code != DUPLICATE_KEY:
+            raise
+        # A duplicate was written since we looked; keep lookups indexed meanwhile.
+        db.workspaces.create_index([("workspace_id", ASCENDING)])
+        return duplicate_workspaces(db)
+    return []
+
+
+def duplicate_workspaces(db):
+    """[{"workspace_id", "records": [{_id, owner, name}, ...] oldest first}] for each workspace_id recorded twice."""
+    return [
+        {"workspace_id": group["_id"], "records": group["records"]}
+        for group in db.workspaces.aggregate([
+            {"$sort": {"_id": 1}},
+            {"$group": {
+                "_id": "$workspace_id",
+                "records": {"$push": {"_id": "$_id", "owner": "$owner", "name": "$name"}},
+                "n": {"$sum": 1},
+            }},
+            {"$match": {"n": {"$gt": 1}}},
+            {"$sort": {"_id": 1}},
+        ], allowDiskUse=True)
+    ]
+
+
+def remove_duplicate_workspaces(db, duplicates):
+    """Keeps the oldest record of each duplicated workspace_id and deletes the rest; returns how many went."""
+    ops = [
+        DeleteMany({"_id": {"$in": [r["_id"] for r in group["records"][1:]]}, "workspace_id": group["workspace_id"]})
+        for group in duplicates
+    ]
+    if not ops:
+        return 0
+    return db.workspaces.bulk_write(ops, ordered=False).deleted_count
+
+
+def migrate_embedded_workspaces(db, batch_size=500):
+    """
+    Moves each user's embedded `workspaces` array into the workspaces
+    collection, keeping the original _ids so existing links stay valid.
+
+    Safe to re-run: documents are upserted by _id and the array is only
+    removed from users whose workspaces have all been written. A workspace
+    whose workspace_id is already recorded (e.g. embedded by two users)
+    cannot be written; its user keeps the array and the clash is reported.
+    Returns (users_migrated, workspaces_written, conflicts), conflicts
+    being (email, workspace_id) pairs.
+    """
+    users_done = written = 0
+    conflicts = []
+    ops, op_sources, emails = [], [], []  # op_sources[i]: (email, workspace_id) behind ops[i]
+
+    def flush():
+        nonlocal users_done, written
+        failed = set()
+        if ops:
+            try:
+                result = db.workspaces.bulk_write(ops, ordered=False)
+                written += result.upserted_count + result.modified_count
+            except BulkWriteError as e:
+                written += e.details.get("nUpserted", 0) + e.details.get("nModified", 0)
+                for error in e.details.get("writeErrors", []):
+                    if error.get("code") != DUPLICATE_KEY:
+                        raise
+                    source = op_sources[error["index"]]
+                    failed.add(source[0])
+                    conflicts.append(source)
+        done = [email for email in emails if email not in failed]
+        if done:
+            db.users.update_many({"email": {"$in": done}}, {"$unset": {"workspaces": ""}})
+            users_done += len(done)
+        ops.clear()
+        op_sources.clear()
+        emails.clear()
+
+    cursor = db.users.find({"workspaces": {"$exists": True}}, {"email": 1, "workspaces": 1})
+    for user in cursor:
+        for ws in user.get("workspaces") or []:
+            doc = dict(ws)
+            doc["owner"] = user["email"]
+            doc.setdefault("vars", [])
+            ops.append(ReplaceOne({"_id": doc["_id"]}, doc, upsert=True))
+            op_sources.append((user["email"], doc.get("workspace_id")))
+        emails.append(user["email"])
+        if len(ops) >= batch_size:
+            flush()
+    flush()
+    return users_done, written, conflicts
+
+
+def init_app(app):
+    @app.cli.command("migrate-workspaces")
+    @click.option("--batch-size", default=500, show_default=True)
+    def migrate_workspaces_command(batch_size):
+        """Move embedded user workspaces into their own collection."""
+        if ensure_indexes(app.mongo):
+            # Without the unique index the upserts below could add more duplicates.
+            raise click.ClickException("Some workspace_ids have duplicate records; run `flask dedupe-workspaces` first.")
+        users, written, conflicts = migrate_embedded_workspaces(app.mongo, batch_size=batch_size)
+        click.echo(f"Migrated {users} users, wrote {written} workspaces.")
+        for email, workspace_id in conflicts:
+            click.echo(f"Not migrated: {email} embeds {workspace_id}, which is already recorded.")
+        if conflicts:
+            click.echo("Those users keep their embedded workspaces; resolve them and run this again.")
+
+    @app.cli.command("dedupe-workspaces")
+    @click.option("--yes", is_flag=True, help="Delete without asking.")
+    def dedupe_workspaces_command(yes):
+        """List workspace_ids recorded more than once; keep the oldest record of each."""
+        db = app.mongo
+        duplicates = duplicate_workspaces(db)
+        if not duplicates:
+            ensure_indexes(db)
+            click.echo("No duplicate workspace records.")
+            return
+        for group in duplicates:
+            kept, *extra = group["records"]
+            click.echo(f"{group['workspace_id']}:")
+            click.echo(f"  keep   {kept['_id']}  {kept.get('owner')}  {kept.get('name')}")
+            for record in extra:
+                click.echo(f"  delete {record['_id']}  {record.get('owner')}  {record.get('name')}")
+        count = sum(len(group["records"]) - 1 for group in duplicates)
+        if not yes:
+            click.confirm(f"Delete {count} duplicate records?", abort=True)
+        deleted = remove_duplicate_workspaces(db, duplicates)
+        click.echo(f"Deleted {deleted} duplicate records.")
+        if ensure_indexes(db):
+            raise click.ClickException("New duplicates were written meanwhile; run this again.")
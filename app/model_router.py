@@ -0,0 +1,121 @@
+"""
+Latency-aware choice between candidate LLM models.
+
+Each model keeps a rolling window of recent latencies and outcomes. ranked()
+puts healthy models first, fastest (median) first; hedge_delay() is how long
+to wait on the first choice before also asking the second, based on that
+model's p95.
+"""
+import os
+import threading
+from collections import deque
+
+LATENCY_WINDOW = 50
+OUTCOME_WINDOW = 20
+MIN_SUCCESS_RATE = 0.5
+HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "2"))
+HEDGE_MAX_DELAY = float(os.getenv("LLM_HEDGE_MAX_DELAY", "30"))
+HEDGE_DEFAULT_DELAY = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", "10"))
+
+
+def _percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class ModelStats:
+    def __init__(self, name):
+        self.name = name
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.outcomes = deque(maxlen=OUTCOME_WINDOW)
+        self.requests = 0
+        self.failures = 0
+        self.wins = 0
+        self.hedged = 0
+        self.cancelled = 0
+
+    @property
+    def healthy(self):
+        if len(self.outcomes) < 3:
+            return True
+        return sum(self.outcomes) / len(self.outcomes) >= MIN_SUCCESS_RATE
+
+    def percentile(self, q):
+        return _percentile(self.latencies, q) if self.latencies else None
+
+
+class ModelRouter:
+    def __init__(self, models):
+        if not models:
+            raise RuntimeError("At least one LLM model must be configured")
+        self.models = list(models)
+        self._stats = {m: ModelStats(m) for m in self.models}
+        self._lock = threading.Lock()
+
+    def ranked(self):
+        """Models in the order to try them: healthy before unhealthy, then by median latency."""
+        with self._lock:
+            def order(model):
+                st = self._stats[model]
+                p50 = st.percentile(0.5)
+                # Untried models sort first so they get measured.
+                return (not st.healthy, p50 is not None, p50 or 0.0, self.models.index(model))
+            return sorted(self.models, key=order)
+
+    def hedge_delay(self, model):
+        with self._lock:
+            p95 = self._stats[model].percentile(0.95)
+        if p95 is None:
+            return HEDGE_DEFAULT_DELAY
+        return min(max(p95, HEDGE_MIN_DELAY), HEDGE_MAX_DELAY)
+
+    def started(self, model, hedge=False):
+        with self._lock:
+            st = self._stats[model]
+            st.requests += 1
+            st.hedged += hedge
+
+    def succeeded(self, model, seconds):
+        with self._lock:
+            st = self._stats[model]
+            st.latencies.append(seconds)
+            st.outcomes.append(True)
+
+    def failed(self, model):
+        with self._lock:
+            st = self._stats[model]
+            st.outcomes.append(False)
+            st.failures += 1
+
+    def cancelled(self, model, seconds=None):
+        """
+        Lost to a hedge `seconds` after being sent: kept as a (lower-bound)
+        latency sample. None for an attempt stopped before it was sent.
+        """
+        with self._lock:
+            st = self._stats[model]
+            st.cancelled += 1
+            if seconds is not None:
+                st.latencies.append(seconds)
+
+    def won(self, model):
+        with self._lock:
+            self._stats[model].wins += 1
+
+    def stats(self):
+        with self._lock:
+            total_wins = sum(st.wins for st in self._stats.values())
+            return {
+                model: {
+                    "requests": st.requests,
+                    "failures": st.failures,
+                    "hedged": st.hedged,
+                    "cancelled": st.cancelled,
+                    "wins": st.wins,
+                    "win_rate": (st.wins / total_wins) if total_wins else 0.0,
+                    "healthy": st.healthy,
+                    "p50_seconds": st.percentile(0.5),
+                    "p95_seconds": st.percentile(0.95),
+                }
+                for model, st in self._stats.items()
+            }
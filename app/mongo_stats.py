@@ -0,0 +1,49 @@
+import threading
+
+from flask import g, has_request_context
+from pymongo import monitoring
+
+from app.metrics import MONGO_SECONDS, add_server_timing
+
+
+class QueryCounter(monitoring.CommandListener):
+    """
+    Counts Mongo commands, per process and per Flask request (on `g`), and
+    times them into app_mongo_command_seconds and Server-Timing ("mongo").
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.total = 0
+        self.requests = 0
+
+    def started(self, event):
+        with self._lock:
+            self.total += 1
+        if has_request_context():
+            g.mongo_queries = g.get("mongo_queries", 0) + 1
+
+    def succeeded(self, event):
+        self._observe(event, "ok")
+
+    def failed(self, event):
+        self._observe(event, "error")
+
+    def _observe(self, event, status):
+        seconds = event.duration_micros / 1e6
+        MONGO_SECONDS.observe(seconds, event.command_name, status)
+        add_server_timing("mongo", seconds)
+
+    def request_finished(self):
+        with self._lock:
+            self.requests += 1
+
+    def stats(self):
+        return {
+            "queries": self.total,
+            "requests": self.requests,
+            "queries_per_request": (self.total / self.requests) if self.requests else 0.0,
+        }
+
+
+query_counter = QueryCounter()
@@ -0,0 +1,151 @@
+"""
+Client-side rate limiting for upstream APIs.
+
+Each limiter is a token bucket implemented as GCRA (one "theoretical arrival
+time" per bucket), which lets callers reserve a slot and sleep until it
+comes up instead of failing. State lives in a store: MemoryStore is shared
+by the threads of one process, FileStore (fcntl-locked JSON) by every
+process on the host.
+"""
+import fcntl
+import json
+import os
+import threading
+import time
+
+
+class MemoryStore:
+    def __init__(self):
+        self._state = {}
+        self._lock = threading.Lock()
+
+    def update(self, name, fn):
+        """Atomically replaces the bucket state with fn(state) and returns fn's result."""
+        with self._lock:
+            state, result = fn(self._state.get(name) or {})
+            self._state[name] = state
+            return result
+
+
+class FileStore:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def update(self, name, fn):
+        with self._lock, open(self.path, "a+") as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                fh.seek(0)
+                raw = fh.read()
+                try:
+                    data = json.loads(raw) if raw else {}
+                except ValueError:
+                    data = {}
+                state, result = fn(data.get(name) or {})
+                data[name] = state
+                fh.seek(0)
+                fh.truncate()
+                fh.write(json.dumps(data))
+                fh.flush()
+                return result
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def store_from_env():
+    spec = os.getenv("RATE_LIMIT_STORE", "memory")
+    if spec.startswith("file:"):
+        return FileStore(spec[len("file:"):])
+    return MemoryStore()
+
+
+class RateLimiter:
+    """
+    `rate` requests per second with bursts of up to `burst`.
+
+    acquire() blocks until the caller may send; observe(response) feeds back
+    429 / Retry-After and X-RateLimit-* headers so every caller sharing the
+    store pauses until the upstream window resets.
+    """
+
+    def __init__(self, name, rate, burst=None, store=None):
+        self.name = name
+        self.rate = float(rate)
+        self.burst = float(burst or rate)
+        self.store = store or MemoryStore()
+        self._lock = threading.Lock()
+        self.acquired = 0
+        self.delayed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.throttle_events = 0
+
+    def _reserve(self, state):
+        now = time.time()
+        interval = 1.0 / self.rate
+        tat = max(state.get("tat", 0.0), now)
+        start = max(tat + interval - self.burst * interval, state.get("blocked_until", 0.0), now)
+        state = dict(state, tat=max(tat, start) + interval)
+        wait = start - now
+        # Float rounding in the last slot of a burst is not a delay.
+        return state, wait if wait > 1e-9 else 0.0
+
+    def acquire(self):
+        wait = self.store.update(self.name, self._reserve)
+        if wait > 0:
+            time.sleep(wait)
+        with self._lock:
+            self.acquired += 1
+            if wait > 0:
+                self.delayed += 1
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+        return wait
+
+    def block_for(self, seconds):
+        until = time.time() + seconds
+
+        def block(state):
+            return dict(state, blocked_until=max(state.get("blocked_until", 0.0), until)), None
+
+        self.store.update(self.name, block)
+
+    def observe(self, response):
+        """Returns the pause applied (seconds), or None if the response needed none."""
+        headers = response.headers
+        pause = None
+        if response.status_code == 429:
+            pause = _seconds(headers.get("Retry-After"))
+            if pause is None:
+                pause = _seconds(headers.get("X-RateLimit-Reset"))
+            if pause is None:
+                pause = 1.0
+        elif headers.get("X-RateLimit-Remaining") in ("0", "0.0"):
+            pause = _seconds(headers.get("X-RateLimit-Reset"))
+        if pause is None:
+            return None
+        self.block_for(pause)
+        with self._lock:
+            self.throttle_events += 1
+        return pause
+
+    def stats(self):
+        return {
+            "rate": self.rate,
+            "burst": self.burst,
+            "acquired": self.acquired,
+            "delayed": self.delayed,
+            "total_wait_seconds": round(self.total_wait, 3),
+            "max_wait_seconds": round(self.max_wait, 3),
+            "throttle_events": self.throttle_events,
+        }
+
+
+def _seconds(value):
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        return None
@@ -0,0 +1,295 @@
+"""
+Background reconciliation of the `workspaces` collection with Terraform Cloud.
+
+A sweep walks the org's workspace listing a few pages per tick, recording
+the ids it sees in `reconcile_seen`, so a large org never stalls a tick and
+a restarted process resumes where the last one stopped (state lives in
+`reconcile_state`). When the listing is exhausted the sweep diffs it
+against every user's workspace records:
+
+* records whose workspace no longer exists (confirmed by a direct lookup,
+  since the listing can shift while it is paged) are removed;
+* remote workspaces nobody has recorded are added only when this app made
+  them: an unfinished job, or a spare configuration version one left, ties
+  the workspace to exactly one user (upserted by workspace_id, which is
+  unique, so a concurrent import or create wins). Any other unrecorded
+  workspace is reported, never given to a user, since a name says nothing
+  reliable about who owns it;
+
+and applies all of it with one bulk_write. Deletions that failed in
+delete_workspace_route (`pending_deletions`) are retried every tick.
+"""
+import os
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+import click
+from pymongo import ASCENDING, DeleteOne, UpdateOne
+
+from app import background
+from app.terraform_service import (
+    WORKSPACE_PAGE_SIZE,
+    delete_workspace,
+    fetch_workspace_page,
+    invalidate_workspace_list,
+    workspace_exists,
+)
+
+TICK = float(os.getenv("RECONCILE_TICK", "10"))
+SWEEP_INTERVAL = float(os.getenv("RECONCILE_INTERVAL", "900"))
+PAGES_PER_TICK = int(os.getenv("RECONCILE_PAGES_PER_TICK", "5"))
+DELETE_RETRY_BASE = 30
+DELETE_RETRY_MAX = 3600
+LEASE_SECONDS = 60
+
+
+
+def ensure_indexes(db):
+    db.reconcile_seen.create_index([("sweep", ASCENDING)])
+    db.pending_deletions.create_index([("next_attempt_at", ASCENDING)])
+    db.jobs.create_index([("workspace_id", ASCENDING)])  # _app_owners
+
+
+# ---------- Pending deletions ----------
+def record_failed_deletion(db, workspace_id, owner, error):
+    """Called when deleting a workspace in Terraform Cloud failed; retried by the reconciler."""
+    now = background.now()
+    db.pending_deletions.update_one(
+        {"_id": workspace_id},
+        {
+            "$set": {"owner": owner, "last_error": str(error), "next_attempt_at": now},
+            "$setOnInsert": {"attempts": 0, "created_at": now},
+        },
+        upsert=True,
+    )
+
+
+def retry_deletions(db, limit=50):
+    """Retries due deletions; returns (deleted, still_failing)."""
+    now = background.now()
+    due = list(db.pending_deletions.find({"next_attempt_at": {"$lte": now}}).limit(limit))
+    ops, deleted = [], 0
+    for item in due:
+        try:
+            delete_workspace(item["_id"])
+        except Exception as e:
+            attempts = item.get("attempts", 0) + 1
+            delay = min(DELETE_RETRY_BASE * 2 ** attempts, DELETE_RETRY_MAX)
+            ops.append(UpdateOne({"_id": item["_id"]}, {"$set": {
+                "attempts": attempts,
+                "last_error": str(e),
+                "next_attempt_at": now + timedelta(seconds=delay),
+            }}))
+        else:
+            ops.append(DeleteOne({"_id": item["_id"]}))
+            deleted += 1
+    if ops:
+        db.pending_deletions.bulk_write(ops, ordered=False)
+    return deleted, len(due) - deleted
+
+
+# ---------- Sweep ----------
+def _app_owners(db, workspace_ids):
+    """
+    workspace_id -> owner for those of `workspace_ids` this app has work on
+    (an unfinished job, or a job's spare configuration version), when all
+    the jobs on it belong to one user.
+    """
+    ids = list(workspace_ids)
+    touched = set(db.spare_config_versions.distinct("workspace_id", {"workspace_id": {"$in": ids}}))
+    touched.update(db.jobs.distinct("workspace_id", {
+        "workspace_id": {"$in": ids}, "status": {"$in": ["queued", "running"]},
+    }))
+    owners = {}
+    for job in db.jobs.find({"workspace_id": {"$in": list(touched)}}, {"workspace_id": 1, "owner": 1}):
+        owners.setdefault(job["workspace_id"], set()).add(job["owner"])
+    return {wid: users.pop() for wid, users in owners.items() if len(users) == 1}
+
+
+def plan_fixes(db, sweep_id, started_at):
+    """
+    Diffs the finished sweep against the workspaces collection; returns
+    (bulk_write ops, [{"workspace_id", "name"}] of unrecorded workspaces left alone).
+    """
+    remote = {doc["_id"]: doc["name"] for doc in db.reconcile_seen.find({"sweep": sweep_id}, {"name": 1})}
+    pending = {doc["_id"] for doc in db.pending_deletions.find({}, {"_id": 1})}
+    recorded = set()
+    ops = []
+    for ws in db.workspaces.find({}, {"workspace_id": 1}):
+        recorded.add(ws["workspace_id"])
+        if ws["workspace_id"] in remote:
+            continue
+        # Created after the listing started: it may simply not have been listed yet.
+        if ws["_id"].generation_time.replace(tzinfo=None) >= started_at:
+            continue
+        try:
+            missing = not workspace_exists(ws["workspace_id"])
+        except Exception:
+            missing = False  # cannot tell now; the next sweep will look again
+        if missing:
+            ops.append(DeleteOne({"_id": ws["_id"]}))
+
+    unrecorded = {wid: name for wid, name in remote.items() if wid not in recorded and wid not in pending}
+    owners = _app_owners(db, unrecorded)
+    for workspace_id, owner in owners.items():
+        ops.append(UpdateOne(
+            {"workspace_id": workspace_id},
+            {"$setOnInsert": {"name": unrecorded[workspace_id], "vars": [], "owner": owner}},
+            upsert=True,
+        ))
+    left = [{"workspace_id": wid, "name": name} for wid, name in sorted(unrecorded.items()) if wid not in owners]
+    return ops, left
+
+
+def sweep_step(db, org_name, pages=PAGES_PER_TICK, interval=SWEEP_INTERVAL):
+    """
+    Advances the sweep for `org_name` by up to `pages` listing pages and
+    finishes it when the listing is exhausted. Returns a summary dict of
+    the finished sweep, or None while it is still in progress (or not due).
+    """
+    state = db.reconcile_state.find_one({"_id": org_name}) or {}
+    now = background.now()
+    if not state.get("sweep"):
+        last = state.get("finished_at")
+        if last and (now - last).total_seconds() < interval:
+            return None
+        state = {"_id": org_name, "sweep": uuid.uuid4().hex, "started_at": now, "next_page": 1}
+        db.reconcile_state.replace_one({"_id": org_name}, state, upsert=True)
+
+    page, total = state["next_page"], state.get("total_pages")
+    for _ in range(pages):
+        if total is not None and page > total:
+            break
+        data = fetch_workspace_page(org_name, page)
+        total = ((data.get("meta") or {}).get("pagination") or {}).get("total-pages") or 1
+        seen = [
+            UpdateOne({"_id": d["id"]}, {"$set": {"sweep": state["sweep"], "name": d["attributes"]["name"]}},
+                      upsert=True)
+            for d in data.get("data", [])
+        ]
+        if seen:
+            db.reconcile_seen.bulk_write(seen, ordered=False)
+        page += 1
+        if len(data.get("data", [])) < WORKSPACE_PAGE_SIZE:
+            total = min(total, page - 1)
+    db.reconcile_state.update_one(
+        {"_id": org_name}, {"$set": {"next_page": page, "total_pages": total}}
+    )
+    if page <= total:
+        return None
+
+    ops, unrecorded = plan_fixes(db, state["sweep"], state["started_at"])
+    result = db.workspaces.bulk_write(ops, ordered=False) if ops else None
+    if ops:
+        invalidate_workspace_list(org_name)
+    db.reconcile_seen.delete_many({"sweep": state["sweep"]})
+    summary = {
+        "pages": total,
+        "removed": result.deleted_count if result else 0,
+        "added": result.upserted_count if result else 0,
+        "unrecorded": len(unrecorded),
+    }
+    db.reconcile_state.replace_one(
+        {"_id": org_name},
+        {"_id": org_name, "finished_at": background.now(), "last": summary, "unrecorded": unrecorded},
+        upsert=True,
+    )
+    return summary
+
+
+class Reconciler:
+    def __init__(self, app):
+        self.app = app
+        self.owner = background.owner_id()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.sweeps = 0
+        self.removed = 0
+        self.added = 0
+        self.unrecorded = 0
+        self.deletions_retried = 0
+
+    def start(self):
+        with self._lock:
+            self._thread = background.ensure_thread(self._thread, self._loop, "reconciler")
+
+    def holds_lease(self, db):
+        """Takes or renews the lease that lets one process reconcile at a time."""
+        return background.take_lease(db, "reconciler", self.owner, LEASE_SECONDS)
+
+    def release_lease(self, db):
+        background.release_lease(db, "reconciler", self.owner)
+
+    def _loop(self):
+        indexed = False
+        while True:
+            time.sleep(TICK)
+            try:
+                db = self.app.mongo
+                if not indexed:
+                    ensure_indexes(db)
+                    indexed = True
+                if self.holds_lease(db):
+                    self.tick(db)
+            except Exception:
+                self.app.logger.exception("Workspace reconciliation failed")
+
+    def tick(self, db):
+        deleted, _ = retry_deletions(db)
+        self.deletions_retried += deleted
+        org = self.app.config.get("TERRAFORM_ORG_NAME")
+        if not org:
+            return None
+        summary = sweep_step(db, org)
+        if summary is not None:
+            self.sweeps += 1
+            self.removed += summary["removed"]
+            self.added += summary["added"]
+            self.unrecorded = summary["unrecorded"]
+        return summary
+
+    def stats(self):
+        return {
+            "sweeps": self.sweeps,
+            "removed": self.removed,
+            "added": self.added,
+            "unrecorded": self.unrecorded,
+            "deletions_retried": self.deletions_retried,
+        }
+
+
+def init_app(app):
+    reconciler = Reconciler(app)
+    app.extensions["reconciler"] = reconciler
+    if os.getenv("RECONCILE_ENABLED", "1") == "1":
+        background.register(app, reconciler.start)
+
+    @app.cli.command("reconcile-workspaces")
+    def reconcile_command():
+        """Run one full reconciliation sweep now."""
+        db = app.mongo
+        org = app.config.get("TERRAFORM_ORG_NAME")
+        if not org:
+            raise click.ClickException("TERRAFORM_ORG_NAME not set")
+        ensure_indexes(db)
+        # Same lease as the background reconciler, so the two never sweep at once.
+        if not reconciler.holds_lease(db):
+            raise click.ClickException("Another process is reconciling workspaces; try again shortly.")
+        try:
+            deleted, failing = retry_deletions(db)
+            click.echo(f"Retried deletions: {deleted} done, {failing} still failing.")
+            summary = None
+            while summary is None:
+                if not reconciler.holds_lease(db):
+                    raise click.ClickException("Lost the reconciler lease; stopping.")
+                summary = sweep_step(db, org, pages=50, interval=0)
+        finally:
+            reconciler.release_lease(db)
+        click.echo(f"Listed {summary['pages']} pages: removed {summary['removed']}, added {summary['added']}.")
+        state = db.reconcile_state.find_one({"_id": org}) or {}
+        for ws in state.get("unrecorded", []):
+            click.echo(f"Unrecorded: {ws['workspace_id']} {ws['name']} (left unassigned; its owner can import it)")
+
+    return reconciler
@@ -0,0 +1,298 @@
+"""
+Local similarity search over known-good prompt -> HCL pairs, consulted
+before the LLM.
+
+The index holds the curated phrasings in app.snippets plus prompts whose
+generations passed validation (loaded from the generation history, then
+added as they happen and synced from other workers every
+RETRIEVAL_SYNC_INTERVAL). Prompts become sparse TF-IDF vectors over
+stemmed words and word pairs; a lookup scores only the documents sharing a
+term with the query (inverted index) by cosine similarity.
+
+Similar wording is not the same request: "a resource group in east us 2"
+scores well against "a resource group in east us" but wants another
+region. So a document only matches if its phrasing has every specific
+the prompt names (numbers, regions, sizes, quoted or named names; see
+specifics()), and the best such document must score RETRIEVAL_THRESHOLD.
+A match is only ever offered: the caller shows it and deploys it once the
+user confirms.
+"""
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from flask import current_app, has_app_context
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import PyMongoError
+
+from app import history
+from app.llm_cache import normalize_prompt
+from app.snippets import SNIPPETS
+
+ENABLED = os.getenv("RETRIEVAL_ENABLED", "1") == "1"
+THRESHOLD = float(os.getenv("RETRIEVAL_THRESHOLD", "0.8"))
+MAX_DOCS = int(os.getenv("RETRIEVAL_MAX_DOCS", "5000"))
+SYNC_INTERVAL = float(os.getenv("RETRIEVAL_SYNC_INTERVAL", "60"))
+SYNC_BATCH = 500
+
+_WORD = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as be can create deploy for i in is it make me my need new of on "
+    "one please provision set setup some that the to up use using want we with".split()
+)
+# Words that pin down where or how big something is; with any token that
+# contains a digit (t3, 2, 10, eu-west-1) they make a prompt specific.
+REGION_WORDS = frozenset(
+    "east west north south central northeast northwest southeast southwest us usa eu europe uk "
+    "asia ap apac pacific africa america japan australia canada brazil india korea france germany "
+    "switzerland norway sweden uae virginia ohio oregon california ireland london frankfurt paris "
+    "tokyo singapore sydney mumbai seoul eastus eastus2 westus westus2 westus3 centralus "
+    "northcentralus southcentralus westeurope northeurope uksouth ukwest eastasia southeastasia".split()
+)
+SIZE_WORDS = frozenset(
+    "nano micro small medium large xlarge metal tiny huge basic standard premium".split()
+)
+_QUOTED = re.compile(r"""["'`]([^"'`]+)["'`]""")
+_NAMED = re.compile(r"\b(?:named|called)\s+([a-z0-9][a-z0-9_.\-]*)")
+
+ALIASES = {
+    "rg": "resource group",
+    "vnet": "virtual network",
+    "gcp": "google",
+    "gcs": "google storage",
+}
+
+
+def _stem(word):
+    for suffix in ("ing", "ed", "s"):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 4 and not word.endswith("ss"):
+            return word[:-len(suffix)]
+    return word
+
+
+def terms(text):
+    """Stemmed content words of `text` plus adjacent word pairs."""
+    words = []
+    for word in _WORD.findall(normalize_prompt(text)):
+        for part in ALIASES.get(word, word).split():
+            if part not in STOPWORDS:
+                words.append(_stem(part))
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+def specifics(text):
+    """
+    The parts of a prompt that change the resulting HCL rather than its
+    wording: tokens with digits, region and size words, quoted strings and
+    the word after "named"/"called".
+    """
+    text = normalize_prompt(text)
+    found = {word for word in _WORD.findall(text)
+             if word in REGION_WORDS or word in SIZE_WORDS or any(c.isdigit() for c in word)}
+    found.update(f"name:{name.strip()}" for name in _QUOTED.findall(text))
+    found.update(f"name:{name}" for name in _NAMED.findall(text))
+    return frozenset(found)
+
+
+class _Doc:
+    __slots__ = ("prompt", "hcl", "source", "weights", "specifics")
+
+    def __init__(self, prompt, hcl, source, weights):
+        self.prompt = prompt
+        self.hcl = hcl
+        self.source = source
+        self.weights = weights
+        self.specifics = specifics(prompt)
+
+
+class TfidfIndex:
+    """Inverted TF-IDF index; documents can be added at any time, idf is computed at query time."""
+
+    def __init__(self, max_docs=MAX_DOCS):
+        self.max_docs = max_docs
+        self._docs = OrderedDict()  # normalized prompt -> _Doc, oldest first
+        self._postings = {}  # term -> {doc key: sublinear tf}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._docs)
+
+    def add(self, prompt, hcl, source):
+        key = normalize_prompt(prompt)
+        counts = Counter(terms(prompt))
+        if not counts:
+            return False
+        with self._lock:
+            existing = self._docs.get(key)
+            if existing is not None:
+                if existing.source == "snippet" and source != "snippet":
+                    return False  # curated answers are not replaced by generated ones
+                self._remove(key)
+            weights = {term: 1.0 + math.log(n) for term, n in counts.items()}
+            self._docs[key] = _Doc(prompt, hcl, source, weights)
+            for term, weight in weights.items():
+                self._postings.setdefault(term, {})[key] = weight
+            if len(self._docs) > self.max_docs:
+                oldest = next((k for k, d in self._docs.items() if d.source != "snippet"), None)
+                if oldest is not None:
+                    self._remove(oldest)
+        return True
+
+    def _remove(self, key):
+        doc = self._docs.pop(key)
+        for term in doc.weights:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(key, None)
+                if not postings:
+                    del self._postings[term]
+
+    def search(self, text):
+        """
+        (cosine similarity, _Doc) of the closest document whose phrasing has
+        every specific of `text`, or (0.0, None).
+        """
+        wanted = specifics(text)
+        counts = Counter(terms(text))
+        if not counts:
+            return 0.0, None
+        with self._lock:
+            n = len(self._docs)
+            idf = {}
+
+            def weight(term):
+                if term not in idf:
+                    idf[term] = math.log((1 + n) / (1 + len(self._postings.get(term, ())))) + 1.0
+                return idf[term]
+
+            query = {term: (1.0 + math.log(c)) * weight(term) for term, c in counts.items()}
+            dots = {}
+            for term, q in query.items():
+                for key, tf in self._postings.get(term, {}).items():
+                    dots[key] = dots.get(key, 0.0) + q * tf * idf[term]
+            if not dots:
+                return 0.0, None
+            query_norm = math.sqrt(sum(q * q for q in query.values()))
+            best_score, best = 0.0, None
+            for key, dot in dots.items():
+                doc = self._docs[key]
+                if not wanted <= doc.specifics:
+                    continue
+                doc_norm = math.sqrt(sum((tf * weight(t)) ** 2 for t, tf in doc.weights.items()))
+                score = dot / (query_norm * doc_norm)
+                if score > best_score:
+                    best_score, best = score, doc
+            return best_score, best
+
+
+_index = TfidfIndex()
+_state_lock = threading.Lock()
+_loaded = False
+_synced_at = 0.0
+_last_synced_id = None
+_stats_lock = threading.Lock()
+_stats = {"lookups": 0, "hits": 0, "added": 0, "synced": 0, "lookup_seconds": 0.0}
+
+
+def _count(name, amount=1):
+    with _stats_lock:
+        _stats[name] += amount
+
+
+def _load_snippets():
+    for snippet in SNIPPETS:
+        for prompt in snippet["prompts"]:
+            _index.add(prompt, snippet["hcl"], "snippet")
+
+
+def _sync(db):
+    """Adds validated generations recorded since the last sync (by any worker)."""
+    global _last_synced_id
+    query = {"valid": True, "source": {"$in": ["job", "fanout"]}, "hcl_hash": {"$ne": None}}
+    projection = {"prompt": 1, "hcl_hash": 1}
+    if _last_synced_id is None:
+        # First load: the newest MAX_DOCS, added oldest first.
+        rows = list(db.generations.find(query, projection).sort("_id", DESCENDING).limit(_index.max_docs))
+        rows.reverse()
+    else:
+        query["_id"] = {"$gt": _last_synced_id}
+        rows = list(db.generations.find(query, projection).sort("_id", ASCENDING).limit(SYNC_BATCH))
+    if not rows:
+        return
+    bodies = history.get_hcl_many(db, {row["hcl_hash"] for row in rows})
+    for row in rows:
+        hcl = bodies.get(row["hcl_hash"])
+        if hcl and _index.add(row["prompt"], hcl, "history"):
+            _count("synced")
+    _last_synced_id = rows[-1]["_id"]
+
+
+def _refresh():
+    global _loaded, _synced_at
+    if not _loaded:
+        with _state_lock:
+            if not _loaded:
+                _load_snippets()
+                _loaded = True
+    if not has_app_context() or time.monotonic() - _synced_at < SYNC_INTERVAL:
+        return
+    if not _state_lock.acquire(blocking=False):
+        return  # another thread is syncing; use the index as it is
+    try:
+        _synced_at = time.monotonic()
+        _sync(current_app.mongo)
+    except PyMongoError:
+        current_app.logger.warning("Retrieval index sync failed", exc_info=True)
+    finally:
+        _state_lock.release()
+
+
+def lookup(prompt, threshold=None):
+    """
+    Known-good HCL for a prompt close enough to one seen before, as
+    {"hcl", "hcl_hash", "score", "prompt", "source"}, or None. Only ever
+    offer it: deploy it once the user has seen and confirmed it.
+    """
+    if not ENABLED:
+        return None
+    start = time.perf_counter()
+    _refresh()
+    score, doc = _index.search(prompt)
+    hit = doc is not None and score >= (THRESHOLD if threshold is None else threshold)
+    with _stats_lock:
+        _stats["lookups"] += 1
+        _stats["hits"] += hit
+        _stats["lookup_seconds"] += time.perf_counter() - start
+    if not hit:
+        return None
+    return {
+        "hcl": doc.hcl,
+        "hcl_hash": history.hcl_hash(doc.hcl),
+        "score": round(score, 3),
+        "prompt": doc.prompt,
+        "source": doc.source,
+    }
+
+
+def add(prompt, hcl):
+    """Indexes a generation that just passed validation."""
+    if ENABLED and _index.add(prompt, hcl, "history"):
+        _count("added")
+
+
+def stats():
+    with _stats_lock:
+        lookups = _stats["lookups"]
+        return {
+            "documents": len(_index),
+            "lookups": lookups,
+            "hits": _stats["hits"],
+            "hit_ratio": (_stats["hits"] / lookups) if lookups else 0.0,
+            "mean_lookup_ms": (_stats["lookup_seconds"] / lookups * 1000) if lookups else 0.0,
+            "added": _stats["added"],
+            "synced": _stats["synced"],
+            "threshold": THRESHOLD,
+        }
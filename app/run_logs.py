@@ -0,0 +1,239 @@
+"""
+Incremental tailing of Terraform Cloud plan and apply logs.
+
+Each run's logs live in one RunLog shared by everyone watching the run. At
+most one poll per RUN_LOG_POLL_INTERVAL reads the run (phase statuses and
+the archivist log URLs, which are re-issued if they expire) and then only
+the bytes past each phase's cached offset. Lines are rendered once
+(structured JSON lines to their @message, ANSI colours stripped) and the
+"N to add, M to change, K to destroy" summaries are picked out as they
+arrive; viewers just read on from their own line position.
+"""
+import json
+import os
+import re
+import threading
+import time
+
+from app.cache import TTLCache
+from app.run_tracker import FINAL_STATUSES, IDLE_STATUSES
+from app.terraform_service import get_run_details, read_log
+
+POLL_INTERVAL = float(os.getenv("RUN_LOG_POLL_INTERVAL", "2"))
+STREAM_MAX_SECONDS = float(os.getenv("RUN_LOG_STREAM_MAX_SECONDS", "900"))
+MAX_LINES = int(os.getenv("RUN_LOG_MAX_LINES", "20000"))
+PHASES = ("plan", "apply")
+# Phase statuses after which nothing more is written to the log.
+PHASE_DONE = frozenset({"finished", "errored", "canceled", "unreachable"})
+# Phase statuses that have not produced output yet.
+PHASE_WAITING = frozenset({"pending", "managed_queued", "queued"})
+
+_ANSI = re.compile(r"\x1b\[[0-9;]*[A-Za-z]")
+_PLAN_COUNTS = re.compile(r"(\d+) to (import|add|change|destroy)\b")
+_APPLY_COUNTS = re.compile(r"(\d+) (imported|added|changed|destroyed)\b")
+_APPLIED = {"imported": "import", "added": "add", "changed": "change", "destroyed": "destroy"}
+
+_logs = TTLCache(maxsize=int(os.getenv("RUN_LOG_CACHE_SIZE", "128")), ttl=3600)
+_logs_lock = threading.Lock()
+_totals = {"polls": 0, "bytes_read": 0}
+
+
+def render_line(raw):
+    """One log line as shown to people: JSON lines as their @message, no colour codes."""
+    line = raw.replace("\x02", "").replace("\x03", "").rstrip("\r")
+    if line.startswith("{"):
+        try:
+            line = json.loads(line).get("@message", line)
+        except (ValueError, AttributeError):
+            pass
+    return _ANSI.sub("", line)
+
+
+def parse_summary(line):
+    """{"add", "change", "destroy"[, "import"]} from a plan or apply summary line, else None."""
+    line = line.strip()
+    if line.startswith("Plan:"):
+        counts = {kind: int(n) for n, kind in _PLAN_COUNTS.findall(line)}
+    elif line.startswith("Apply complete!"):
+        counts = {_APPLIED[kind]: int(n) for n, kind in _APPLY_COUNTS.findall(line)}
+    elif line.startswith("No changes."):
+        counts = {}
+    else:
+        return None
+    return {"add": 0, "change": 0, "destroy": 0, **counts}
+
+
+def format_summary(summary):
+    parts = [f"{summary['import']} to import"] if summary.get("import") else []
+    parts += [f"{summary[k]} to {k}" for k in ("add", "change", "destroy")]
+    return ", ".join(parts)
+
+
+class PhaseLog:
+    def __init__(self):
+        self.status = None
+        self.url = None
+        self.offset = 0
+        self.lines = []
+        self.first = 0  # index of lines[0]; earlier lines were dropped past MAX_LINES
+        self.summary = None
+        self.complete = False
+        self._partial = b""
+
+    @property
+    def quiet(self):
+        """Nothing more to fetch right now."""
+        return self.complete or self.status is None or self.status in PHASE_WAITING
+
+    def append(self, chunk, finished):
+        self.offset += len(chunk)
+        *lines, self._partial = (self._partial + chunk).split(b"\n")
+        ended = b"\x03" in chunk or (finished and not chunk)
+        if ended and self._partial:
+            lines.append(self._partial)
+            self._partial = b""
+        for raw in lines:
+            if raw.strip(b"\x02\x03") or not raw:
+                self._add(render_line(raw.decode("utf-8", "replace")))
+        self.complete = ended
+
+    def _add(self, line):
+        summary = parse_summary(line)
+        if summary is not None:
+            self.summary = summary
+        self.lines.append(line)
+        if len(self.lines) > MAX_LINES:
+            drop = len(self.lines) - MAX_LINES
+            del self.lines[:drop]
+            self.first += drop
+
+    def read(self, position):
+        """(new lines, next position, lines dropped before they could be read)."""
+        start = max(position, self.first)
+        return self.lines[start - self.first:], self.first + len(self.lines), start - position
+
+
+class RunLog:
+    def __init__(self, run_id):
+        self.run_id = run_id
+        self.status = None
+        self.phases = {phase: PhaseLog() for phase in PHASES}
+        self.error = None
+        self.polled_at = 0.0
+        self._poll_lock = threading.Lock()
+        self._lock = threading.Lock()
+
+    @property
+    def settled(self):
+        """The run is finished or waiting on a person, and every log is read to its end."""
+        return (self.status in FINAL_STATUSES or self.status in IDLE_STATUSES) and all(
+            log.quiet for log in self.phases.values()
+        )
+
+    def poll(self):
+        """
+        Fetches whatever is new, at most once per POLL_INTERVAL across all
+        viewers. A viewer that finds another one polling returns at once and
+        picks the new lines up on its next read.
+        """
+        if not self._poll_lock.acquire(blocking=False):
+            return
+        try:
+            due = time.monotonic() - self.polled_at >= POLL_INTERVAL
+            if due and not (self.status in FINAL_STATUSES and self.settled):
+                self.polled_at = time.monotonic()
+                self._fetch()
+        finally:
+            self._poll_lock.release()
+
+    def _fetch(self):
+        fetched = 0
+        try:
+            details = get_run_details(self.run_id)
+            self.status = details["status"]
+            for phase in PHASES:
+                info, log = details[phase], self.phases[phase]
+                if info is None or log.complete:
+                    continue
+                log.status = info["status"]
+                log.url = info["log_read_url"] or log.url
+                if log.status in PHASE_WAITING:
+                    continue
+                if not log.url:
+                    log.complete = log.status in PHASE_DONE  # e.g. an apply that never ran
+                    continue
+                chunk = read_log(log.url, log.offset)
+                if chunk is None:  # URL expired; the next poll brings a fresh one
+                    log.url = None
+                    continue
+                fetched += len(chunk)
+                with self._lock:
+                    log.append(chunk, finished=log.status in PHASE_DONE)
+            self.error = None
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            with _logs_lock:
+                _totals["polls"] += 1
+                _totals["bytes_read"] += fetched
+
+    def read(self, phase, position):
+        with self._lock:
+            return self.phases[phase].read(position)
+
+    def summary(self):
+        return {phase: log.summary for phase, log in self.phases.items()}
+
+
+def get_log(run_id):
+    with _logs_lock:
+        log = _logs.get(run_id)
+        if log is None:
+            log = RunLog(run_id)
+            _logs.set(run_id, log)
+        return log
+
+
+def stream(run_id, max_seconds=STREAM_MAX_SECONDS):
+    """
+    Yields the run's plan and then apply output as it is written, followed
+    by the parsed change summaries. Stops once the run settles or after
+    `max_seconds`.
+    """
+    log = get_log(run_id)
+    positions = dict.fromkeys(PHASES, 0)
+    started = set()
+    last_error = None
+    opened = time.monotonic()
+    deadline = opened + max_seconds
+    while True:
+        log.poll()
+        for phase in PHASES:
+            lines, positions[phase], dropped = log.read(phase, positions[phase])
+            if lines and phase not in started:
+                started.add(phase)
+                yield f"==> {phase}\n"
+            if dropped:
+                yield f"[... {dropped} earlier lines not kept ...]\n"
+            if lines:
+                yield "\n".join(lines) + "\n"
+        if log.error != last_error:
+            last_error = log.error
+            if last_error:
+                yield f"[error reading logs: {last_error}]\n"
+        # A run waiting on a person may have moved on (e.g. been applied) since
+        # it was last polled, so only trust that after a poll this viewer saw.
+        fresh = log.status in FINAL_STATUSES or log.polled_at >= opened
+        if (log.settled and fresh) or time.monotonic() >= deadline:
+            break
+        time.sleep(POLL_INTERVAL)
+
+    yield f"\n[run {run_id}: {log.status or 'unknown'}]\n"
+    for phase, summary in log.summary().items():
+        if summary is not None:
+            yield f"[{phase}: {format_summary(summary)}]\n"
+
+
+def stats():
+    with _logs_lock:
+        return dict(_logs.stats(), **_totals)
@@ -0,0 +1,181 @@
+"""
+Background tracker for Terraform Cloud run status.
+
+Run ids are recorded in the `runs` collection. One tracker per deployment
+(elected through a lease document in `locks`) polls the unsettled ones,
+grouping them by workspace so each poll is a single runs-listing request per
+workspace. Active runs are polled quickly; runs waiting on a person back off;
+finished runs are no longer polled.
+"""
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+
+from app import background
+from app.terraform_service import get_run_status, list_workspace_runs
+
+POLL_TICK = float(os.getenv("RUN_TRACKER_TICK", "2"))
+FAST_INTERVAL = float(os.getenv("RUN_TRACKER_FAST_INTERVAL", "5"))
+MAX_INTERVAL = float(os.getenv("RUN_TRACKER_MAX_INTERVAL", "120"))
+LEASE_SECONDS = 30
+BATCH_LIMIT = 500
+
+FINAL_STATUSES = frozenset({
+    "applied", "planned_and_finished", "discarded", "errored", "canceled", "force_canceled",
+})
+# Waiting on a person (confirm/override) rather than on Terraform Cloud.
+IDLE_STATUSES = frozenset({
+    "planned", "cost_estimated", "policy_checked", "policy_override", "policy_soft_failed",
+    "post_plan_completed",
+})
+
+
+
+def next_interval(status, previous):
+    """Seconds until the next poll, or None once the run has settled."""
+    if status in FINAL_STATUSES:
+        return None
+    if status in IDLE_STATUSES:
+        return min(max(previous or FAST_INTERVAL, FAST_INTERVAL) * 2, MAX_INTERVAL)
+    return FAST_INTERVAL
+
+
+def ensure_indexes(db):
+    db.runs.create_index([("settled", ASCENDING), ("next_poll_at", ASCENDING)])
+    db.runs.create_index([("workspace_id", ASCENDING), ("created_at", DESCENDING)])
+
+
+def track_run(db, run_id, workspace_id, status="pending"):
+    """Records a run (or re-activates it, e.g. after an apply) for polling."""
+    now = background.now()
+    db.runs.update_one(
+        {"_id": run_id},
+        {
+            "$set": {
+                "workspace_id": workspace_id,
+                "status": status,
+                "settled": False,
+                "interval": FAST_INTERVAL,
+                "next_poll_at": now,
+                "updated_at": now,
+            },
+            "$setOnInsert": {"created_at": now},
+        },
+        upsert=True,
+    )
+
+
+def wake_run(db, run_id):
+    """Polls an already tracked run again at the fast rate (e.g. after apply)."""
+    now = background.now()
+    db.runs.update_one(
+        {"_id": run_id},
+        {"$set": {"settled": False, "interval": FAST_INTERVAL, "next_poll_at": now, "updated_at": now}},
+    )
+
+
+def latest_statuses(db, workspace_ids):
+    """{workspace_id: {"run_id", "status", "updated_at"}} for the newest run of each."""
+    if not workspace_ids:
+        return {}
+    rows = db.runs.aggregate([
+        {"$match": {"workspace_id": {"$in": list(workspace_ids)}}},
+        {"$sort": {"created_at": -1}},
+        {"$group": {
+            "_id": "$workspace_id",
+            "run_id": {"$first": "$_id"},
+            "status": {"$first": "$status"},
+            "updated_at": {"$first": "$updated_at"},
+        }},
+    ])
+    return {row["_id"]: row for row in rows}
+
+
+class RunTracker:
+    def __init__(self, app):
+        self.app = app
+        self.owner = background.owner_id()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.polls = 0
+        self.requests = 0
+
+    def start(self):
+        with self._lock:
+            self._thread = background.ensure_thread(self._thread, self._loop, "run-tracker")
+
+    def _loop(self):
+        indexed = False
+        while True:
+            time.sleep(POLL_TICK)
+            try:
+                db = self.app.mongo
+                if not indexed:
+                    ensure_indexes(db)
+                    indexed = True
+                if background.take_lease(db, "run_tracker", self.owner, LEASE_SECONDS):
+                    self.poll_once(db)
+            except Exception:
+                self.app.logger.exception("Run tracker poll failed")
+
+    def poll_once(self, db):
+        now = background.now()
+        due = list(db.runs.find(
+            {"settled": False, "next_poll_at": {"$lte": now}},
+            {"workspace_id": 1, "status": 1, "interval": 1},
+        ).limit(BATCH_LIMIT))
+        if not due:
+            return 0
+
+        by_workspace = defaultdict(list)
+        for run in due:
+            by_workspace[run["workspace_id"]].append(run)
+
+        ops = []
+        for workspace_id, runs in by_workspace.items():
+            try:
+                statuses = list_workspace_runs(workspace_id)
+                self.requests += 1
+            except Exception:
+                # Terraform Cloud unavailable for this workspace: try again later.
+                for run in runs:
+                    interval = min((run.get("interval") or FAST_INTERVAL) * 2, MAX_INTERVAL)
+                    ops.append(UpdateOne({"_id": run["_id"]}, {"$set": {
+                        "interval": interval,
+                        "next_poll_at": now + timedelta(seconds=interval),
+                    }}))
+                continue
+            for run in runs:
+                status = statuses.get(run["_id"])
+                if status is None:
+                    # Older than the listing window: fall back to a direct lookup.
+                    try:
+                        status = get_run_status(run["_id"])
+                        self.requests += 1
+                    except Exception:
+                        status = run["status"]
+                interval = next_interval(status, run.get("interval") if status == run["status"] else None)
+                fields = {"status": status, "updated_at": now, "settled": interval is None}
+                if interval is not None:
+                    fields["interval"] = interval
+                    fields["next_poll_at"] = now + timedelta(seconds=interval)
+                ops.append(UpdateOne({"_id": run["_id"]}, {"$set": fields}))
+        if ops:
+            db.runs.bulk_write(ops, ordered=False)
+        self.polls += 1
+        return len(ops)
+
+    def stats(self):
+        return {"polls": self.polls, "requests": self.requests}
+
+
+def init_app(app):
+    tracker = RunTracker(app)
+    app.extensions["run_tracker"] = tracker
+    if os.getenv("RUN_TRACKER_ENABLED", "1") == "1":
+        background.register(app, tracker.start)
+    return tracker
@@ -0,0 +1,208 @@
+"""
+Curated, known-good HCL for prompts that come up all the time. Each entry
+lists a few ways people phrase the request; app.retrieval indexes every
+phrasing and answers close matches without calling the LLM.
+"""
+
+AZURE_PROVIDER = '''terraform {
+  required_providers {
+    azurerm = {
+      source  = "hashicorp/azurerm"
+      version = "~> 3.0"
+    }
+  }
+}
+
+provider "azurerm" {
+  features {}
+}
+'''
+
+AWS_PROVIDER = '''terraform {
+  required_providers {
+    aws = {
+      source  = "hashicorp/aws"
+      version = "~> 5.0"
+    }
+  }
+}
+
+provider "aws" {
+  region = "us-east-1"
+}
+'''
+
+GOOGLE_PROVIDER = '''terraform {
+  required_providers {
+    google = {
+      source  = "hashicorp/google"
+      version = "~> 5.0"
+    }
+  }
+}
+
+variable "project_id" {
+  type = string
+}
+
+provider "google" {
+  project = var.project_id
+  region  = "us-central1"
+}
+'''
+
+SNIPPETS = [
+    {
+        "prompts": [
+            "create an azure resource group",
+            "azure resource group in east us",
+            "make a resource group on azure",
+        ],
+        "hcl": AZURE_PROVIDER + '''
+resource "azurerm_resource_group" "rg" {
+  name     = "rg-demo"
+  location = "eastus"
+}
+''',
+    },
+    {
+        "prompts": [
+            "create an azure storage account",
+            "azure storage account with a resource group",
+            "storage account in azure",
+        ],
+        "hcl": AZURE_PROVIDER + '''
+resource "azurerm_resource_group" "rg" {
+  name     = "rg-storage-demo"
+  location = "eastus"
+}
+
+resource "random_string" "suffix" {
+  length  = 8
+  upper   = false
+  special = false
+}
+
+resource "azurerm_storage_account" "sa" {
+  name                     = "stdemo${random_string.suffix.result}"
+  resource_group_name      = azurerm_resource_group.rg.name
+  location                 = azurerm_resource_group.rg.location
+  account_tier             = "Standard"
+  account_replication_type = "LRS"
+  min_tls_version          = "TLS1_2"
+}
+''',
+    },
+    {
+        "prompts": [
+            "create an azure virtual network with a subnet",
+            "azure vnet and subnet",
+            "virtual network on azure",
+        ],
+        "hcl": AZURE_PROVIDER + '''
+resource "azurerm_resource_group" "rg" {
+  name     = "rg-network-demo"
+  location = "eastus"
+}
+
+resource "azurerm_virtual_network" "vnet" {
+  name                = "vnet-demo"
+  address_space       = ["10.0.0.0/16"]
+  location            = azurerm_resource_group.rg.location
+  resource_group_name = azurerm_resource_group.rg.name
+}
+
+resource "azurerm_subnet" "subnet" {
+  name                 = "snet-default"
+  resource_group_name  = azurerm_resource_group.rg.name
+  virtual_network_name = azurerm_virtual_network.vnet.name
+  address_prefixes     = ["10.0.1.0/24"]
+}
+''',
+    },
+    {
+        "prompts": [
+            "create an s3 bucket with versioning",
+            "aws s3 bucket with versioning enabled",
+            "versioned s3 bucket",
+        ],
+        "hcl": AWS_PROVIDER + '''
+resource "aws_s3_bucket" "bucket" {
+  bucket_prefix = "demo-bucket-"
+}
+
+resource "aws_s3_bucket_versioning" "bucket" {
+  bucket = aws_s3_bucket.bucket.id
+
+  versioning_configuration {
+    status = "Enabled"
+  }
+}
+
+resource "aws_s3_bucket_public_access_block" "bucket" {
+  bucket                  = aws_s3_bucket.bucket.id
+  block_public_acls       = true
+  block_public_policy     = true
+  ignore_public_acls      = true
+  restrict_public_buckets = true
+}
+''',
+    },
+    {
+        "prompts": [
+            "create an s3 bucket",
+            "aws s3 bucket",
+            "private s3 bucket on aws",
+        ],
+        "hcl": AWS_PROVIDER + '''
+resource "aws_s3_bucket" "bucket" {
+  bucket_prefix = "demo-bucket-"
+}
+
+resource "aws_s3_bucket_public_access_block" "bucket" {
+  bucket                  = aws_s3_bucket.bucket.id
+  block_public_acls       = true
+  block_public_policy     = true
+  ignore_public_acls      = true
+  restrict_public_buckets = true
+}
+''',
+    },
+    {
+        "prompts": [
+            "create an aws vpc with a public subnet",
+            "aws vpc and subnet",
+            "vpc on aws",
+        ],
+        "hcl": AWS_PROVIDER + '''
+resource "aws_vpc" "main" {
+  cidr_block           = "10.0.0.0/16"
+  enable_dns_hostnames = true
+}
+
+resource "aws_subnet" "public" {
+  vpc_id                  = aws_vpc.main.id
+  cidr_block              = "10.0.1.0/24"
+  map_public_ip_on_launch = true
+}
+
+resource "aws_internet_gateway" "gw" {
+  vpc_id = aws_vpc.main.id
+}
+''',
+    },
+    {
+        "prompts": [
+            "create a google cloud storage bucket",
+            "gcs bucket on gcp",
+            "gcp storage bucket",
+        ],
+        "hcl": GOOGLE_PROVIDER + '''
+resource "google_storage_bucket" "bucket" {
+  name                        = "${var.project_id}-demo-bucket"
+  location                    = "US"
+  uniform_bucket_level_access = true
+}
+''',
+    },
+]
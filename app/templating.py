@@ -0,0 +1,27 @@
+"""
+Registers the page templates from app.main with the app's Jinja loader.
+
+Templates are compiled once per process (Jinja keeps compiled templates in
+its environment cache) and the generated bytecode is kept on disk, so new
+worker processes skip compilation as well.
+"""
+import os
+
+from jinja2 import ChoiceLoader, DictLoader, FileSystemBytecodeCache
+
+
+def init_app(app):
+    from app.main import TEMPLATES
+
+    cache_dir = os.getenv("TEMPLATE_CACHE_DIR")
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+    # Must be configured before app.jinja_env is first used.
+    app.jinja_options = dict(app.jinja_options, bytecode_cache=FileSystemBytecodeCache(cache_dir))
+    loaders = [DictLoader(TEMPLATES)]
+    if app.jinja_loader is not None:
+        loaders.append(app.jinja_loader)
+    app.jinja_loader = ChoiceLoader(loaders)
+
+    for name in TEMPLATES:
+        app.jinja_env.get_template(name)
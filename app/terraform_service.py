@@ -1,9 +1,66 @@
 import os
-import io
+import gzip
+import hashlib
 import tarfile
-import requests
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-TERRAFORM_API = "https://app.terraform.io/api/v2"
+from app.cache import TTLCache
+from app.http_client import PooledClient
+from app.metrics import timed
+from app.rate_limit import RateLimiter, store_from_env
+
+TERRAFORM_API = os.getenv("TERRAFORM_API", "https://app.terraform.io/api/v2")
+
+# One pooled, keep-alive client shared by every helper below.
+client = PooledClient(
+    pool_size=int(os.getenv("TFC_POOL_SIZE", "10")),
+    max_retries=int(os.getenv("TFC_MAX_RETRIES", "3")),
+    timeouts={"upload": (5, 60)},
+    default_timeout=(5, 30),
+    name="terraform",
+    # Terraform Cloud allows 30 requests/second per token.
+    rate_limiter=RateLimiter(
+        "terraform",
+        rate=float(os.getenv("TFC_RATE_LIMIT", "30")),
+        store=store_from_env(),
+    ),
+)
+
+# Plan/apply logs live on pre-signed archivist URLs: no token, no API rate limit.
+log_client = PooledClient(
+    pool_size=int(os.getenv("TFC_LOG_POOL_SIZE", "10")),
+    max_retries=int(os.getenv("TFC_MAX_RETRIES", "3")),
+    default_timeout=(5, 30),
+    name="terraform_logs",
+)
+
+WORKSPACE_PAGE_SIZE = 100  # Terraform Cloud maximum
+WORKSPACE_PAGE_WORKERS = int(os.getenv("TFC_PAGE_WORKERS", "8"))
+
+# (org, search) -> [{"id", "name"}]; dropped when a workspace is created or deleted.
+_workspace_list_cache = TTLCache(
+    maxsize=256, ttl=float(os.getenv("TFC_WORKSPACE_LIST_TTL", "60"))
+)
+
+# workspace id -> metadata (name, org, execution mode, permissions), and
+# (org, name) -> workspace id. Entries are refreshed in the background once
+# they are WORKSPACE_REFRESH_AHEAD of the way to expiry, and dropped on delete.
+WORKSPACE_META_TTL = float(os.getenv("TFC_WORKSPACE_META_TTL", "300"))
+WORKSPACE_REFRESH_AHEAD = 0.8
+_workspace_meta_cache = TTLCache(
+    maxsize=int(os.getenv("TFC_WORKSPACE_CACHE_SIZE", "1024")), ttl=WORKSPACE_META_TTL
+)
+_workspace_id_cache = TTLCache(
+    maxsize=int(os.getenv("TFC_WORKSPACE_CACHE_SIZE", "1024")), ttl=WORKSPACE_META_TTL
+)
+_refresh_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="tfc-refresh")
+_refreshing = set()
+_refresh_lock = threading.Lock()
+
+# content hash -> gzipped tarball, so re-uploads of the same HCL skip the rebuild.
+_tarball_cache = TTLCache(maxsize=64, ttl=3600)
 
 def _headers():
     token = os.getenv("TERRAFORM_TOKEN")
@@ -15,26 +72,31 @@ def _headers():
     }
 
 # ---------- Workspace helpers ----------
+@timed("tfc.get_or_create_workspace_id")
 def get_or_create_workspace_id(org_name, workspace_name):
+    cached = _workspace_id_cache.get((org_name, workspace_name))
+    if cached is not None:
+        return cached
     url = f"{TERRAFORM_API}/organizations/{org_name}/workspaces/{workspace_name}"
-    r = requests.get(url, headers=_headers(), timeout=30)
+    r = client.get(url, headers=_headers())
     if r.status_code == 200:
-        return r.json()["data"]["id"]
+        return _remember_workspace(r.json()["data"], org_name)["id"]
     payload = {
         "data": {
             "type": "workspaces",
             "attributes": {"name": workspace_name, "auto-apply": True},
         }
     }
-    r = requests.post(
+    r = client.post(
         f"{TERRAFORM_API}/organizations/{org_name}/workspaces",
         headers=_headers(),
         json=payload,
-        timeout=30,
     )
     r.raise_for_status()
-    return r.json()["data"]["id"]
+    invalidate_workspace_list(org_name)
+    return _remember_workspace(r.json()["data"], org_name)["id"]
 
+@timed("tfc.create_workspace")
 def create_workspace(org_name, workspace_name):
     """Creates a new Terraform workspace with auto-apply enabled."""
     url = f"{TERRAFORM_API}/organizations/{org_name}/workspaces"
@@ -49,26 +111,152 @@ def create_workspace(org_name, workspace_name):
             },
         }
     }
-    r = requests.post(url, headers=_headers(), json=payload, timeout=30)
+    r = client.post(url, headers=_headers(), json=payload)
     if r.status_code not in (200, 201):
         raise RuntimeError(f"Error creating workspace: {r.text}")
-    return r.json()["data"]["id"]
+    invalidate_workspace_list(org_name)
+    return _remember_workspace(r.json()["data"], org_name)["id"]
 
+@timed("tfc.delete_workspace")
 def delete_workspace(workspace_id):
     url = f"{TERRAFORM_API}/workspaces/{workspace_id}"
-    r = requests.delete(url, headers=_headers(), timeout=30)
-    if r.status_code not in (200, 204):
+    r = client.delete(url, headers=_headers())
+    # 404: already gone, which is what the caller wanted.
+    if r.status_code not in (200, 204, 404):
         raise RuntimeError(f"Failed to delete workspace: {r.status_code} {r.text}")
+    # The org is not known from the id alone, so drop every cached listing.
+    invalidate_workspace_list()
+    forget_workspace(workspace_id)
     return True
 
-def list_workspaces_in_org(org_name):
+@timed("tfc.fetch_workspace_page")
+def fetch_workspace_page(org_name, page, search=None):
+    params = {"page[number]": page, "page[size]": WORKSPACE_PAGE_SIZE}
+    if search:
+        params["search[name]"] = search
     url = f"{TERRAFORM_API}/organizations/{org_name}/workspaces"
-    r = requests.get(url, headers=_headers(), timeout=30)
+    r = client.get(url, headers=_headers(), params=params)
     r.raise_for_status()
-    data = r.json().get("data", [])
-    return [{"id": d["id"], "name": d["attributes"]["name"]} for d in data]
+    return r.json()
+
+@timed("tfc.list_workspaces_in_org")
+def list_workspaces_in_org(org_name, search=None, use_cache=True):
+    """
+    Lists every workspace in the org, following `meta.pagination`.
+
+    Page 1 is read first to learn the page count, the rest are fetched
+    concurrently. `search` is passed through as `search[name]` so the
+    server does the filtering. Results are cached per (org, search).
+    """
+    key = (org_name, search or "")
+    if use_cache:
+        cached = _workspace_list_cache.get(key)
+        if cached is not None:
+            return list(cached)
+
+    first = fetch_workspace_page(org_name, 1, search)
+    pages = [first]
+    total_pages = (first.get("meta", {}).get("pagination", {}) or {}).get("total-pages") or 1
+    if total_pages > 1:
+        workers = min(WORKSPACE_PAGE_WORKERS, total_pages - 1)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            pages.extend(pool.map(
+                lambda n: fetch_workspace_page(org_name, n, search),
+                range(2, total_pages + 1),
+            ))
+
+    result = [
+        {"id": d["id"], "name": d["attributes"]["name"]}
+        for page in pages
+        for d in page.get("data", [])
+    ]
+    _workspace_list_cache.set(key, result)
+    return list(result)
+
+def invalidate_workspace_list(org_name=None):
+    if org_name is None:
+        _workspace_list_cache.invalidate()
+    else:
+        _workspace_list_cache.invalidate(lambda key: key[0] == org_name)
+
+# ---------- Workspace metadata ----------
+def _remember_workspace(data, org_name=None):
+    attrs = data.get("attributes", {})
+    org = (data.get("relationships", {}).get("organization", {}).get("data") or {}).get("id") or org_name
+    permissions = attrs.get("permissions") or {}
+    meta = {
+        "id": data["id"],
+        "name": attrs.get("name"),
+        "org": org,
+        "execution_mode": attrs.get("execution-mode"),
+        "can_queue_run": permissions.get("can-queue-run", False),
+        "can_queue_apply": permissions.get("can-queue-apply", False),
+        "fetched_at": time.monotonic(),
+    }
+    _workspace_meta_cache.set(meta["id"], meta)
+    if org and meta["name"]:
+        _workspace_id_cache.set((org, meta["name"]), meta["id"])
+    return meta
+
+@timed("tfc.fetch_workspace")
+def _fetch_workspace(workspace_id):
+    r = client.get(f"{TERRAFORM_API}/workspaces/{workspace_id}", headers=_headers())
+    r.raise_for_status()
+    return _remember_workspace(r.json()["data"])
+
+def _refresh_in_background(workspace_id):
+    with _refresh_lock:
+        if workspace_id in _refreshing:
+            return
+        _refreshing.add(workspace_id)
+
+    def refresh():
+        try:
+            _fetch_workspace(workspace_id)
+        except Exception:
+            pass  # the entry simply expires and the next caller fetches it
+        finally:
+            with _refresh_lock:
+                _refreshing.discard(workspace_id)
+
+    _refresh_pool.submit(refresh)
+
+def get_workspace(workspace_id, use_cache=True):
+    """
+    Workspace metadata: id, name, org, execution_mode, can_queue_run and
+    can_queue_apply. Cached per workspace; entries close to expiry are
+    refreshed in the background while the cached copy is returned.
+    """
+    meta = _workspace_meta_cache.get(workspace_id) if use_cache else None
+    if meta is None:
+        return _fetch_workspace(workspace_id)
+    if time.monotonic() - meta["fetched_at"] > WORKSPACE_META_TTL * WORKSPACE_REFRESH_AHEAD:
+        _refresh_in_background(workspace_id)
+    return meta
+
+@timed("tfc.workspace_exists")
+def workspace_exists(workspace_id):
+    """Uncached existence check; raises if Terraform Cloud cannot tell."""
+    r = client.get(f"{TERRAFORM_API}/workspaces/{workspace_id}", headers=_headers())
+    if r.status_code == 404:
+        forget_workspace(workspace_id)
+        return False
+    r.raise_for_status()
+    _remember_workspace(r.json()["data"])
+    return True
+
+def forget_workspace(workspace_id):
+    meta = _workspace_meta_cache.pop(workspace_id)
+    if meta is not None:
+        _workspace_id_cache.pop((meta["org"], meta["name"]))
+    else:
+        _workspace_id_cache.invalidate()
+
+def workspace_cache_stats():
+    return {"metadata": _workspace_meta_cache.stats(), "ids": _workspace_id_cache.stats()}
 
 # ---------- Variables ----------
+@timed("tfc.add_env_variable")
 def add_env_variable(workspace_id, key, value, sensitive=True):
     url = f"{TERRAFORM_API}/workspaces/{workspace_id}/vars"
     payload = {
@@ -83,12 +271,39 @@ def add_env_variable(workspace_id, key, value, sensitive=True):
             },
         }
     }
-    r = requests.post(url, headers=_headers(), json=payload, timeout=30)
+    r = client.post(url, headers=_headers(), json=payload)
     if r.status_code not in (200, 201):
         raise RuntimeError(f"Error adding variable {key}: {r.text}")
     return True
 
+@timed("tfc.list_env_variables")
+def list_env_variables(workspace_id):
+    url = f"{TERRAFORM_API}/workspaces/{workspace_id}/vars"
+    r = client.get(url, headers=_headers())
+    r.raise_for_status()
+    return [
+        {"id": d["id"], "key": d["attributes"]["key"], "sensitive": d["attributes"].get("sensitive", False)}
+        for d in r.json().get("data", [])
+        if d["attributes"].get("category") == "env"
+    ]
+
+@timed("tfc.update_env_variable")
+def update_env_variable(workspace_id, var_id, key, value, sensitive=True):
+    url = f"{TERRAFORM_API}/workspaces/{workspace_id}/vars/{var_id}"
+    payload = {
+        "data": {
+            "id": var_id,
+            "type": "vars",
+            "attributes": {"key": key, "value": value, "sensitive": sensitive},
+        }
+    }
+    r = client.patch(url, headers=_headers(), json=payload, idempotent=True)
+    if r.status_code != 200:
+        raise RuntimeError(f"Error updating variable {key}: {r.text}")
+    return True
+
 # ---------- Configuration upload / runs ----------
+@timed("tfc.create_configuration_version")
 def create_configuration_version(workspace_id, auto_queue_runs=False):
     url = f"{TERRAFORM_API}/workspaces/{workspace_id}/configuration-versions"
     payload = {
@@ -97,26 +312,49 @@ def create_configuration_version(workspace_id, auto_queue_runs=False):
             "attributes": {"auto-queue-runs": auto_queue_runs},
         }
     }
-    r = requests.post(url, headers=_headers(), json=payload, timeout=30)
+    r = client.post(url, headers=_headers(), json=payload)
     r.raise_for_status()
     return r.json()["data"]
 
+def content_hash(tf_code):
+    return hashlib.sha256(tf_code.encode("utf-8")).hexdigest()
+
+@timed("tfc.build_tarball")
+def build_tarball(tf_code):
+    """
+    Returns a gzipped tar holding main.tf, built in one pass and memoized by
+    content hash. mtimes are zeroed so identical HCL yields identical bytes.
+    """
+    key = content_hash(tf_code)
+    cached = _tarball_cache.get(key)
+    if cached is not None:
+        return cached
+    tf_bytes = tf_code.encode("utf-8")
+    info = tarfile.TarInfo(name="main.tf")
+    info.size = len(tf_bytes)
+    info.mode = 0o644
+    info.mtime = 0
+    padding = -len(tf_bytes) % tarfile.BLOCKSIZE
+    archive = gzip.compress(
+        info.tobuf(format=tarfile.USTAR_FORMAT)
+        + tf_bytes
+        + tarfile.NUL * (padding + 2 * tarfile.BLOCKSIZE),
+        mtime=0,
+    )
+    _tarball_cache.set(key, archive)
+    return archive
+
+@timed("tfc.upload_tf_to_url")
 def upload_tf_to_url(upload_url, tf_code):
-    buf = io.BytesIO()
-    with tarfile.open(mode="w:gz", fileobj=buf) as tar:
-        tf_bytes = tf_code.encode("utf-8")
-        info = tarfile.TarInfo(name="main.tf")
-        info.size = len(tf_bytes)
-        tar.addfile(tarinfo=info, fileobj=io.BytesIO(tf_bytes))
-    buf.seek(0)
-    r = requests.put(
+    r = client.put(
         upload_url,
+        endpoint="upload",
         headers={"Content-Type": "application/octet-stream"},
-        data=buf.getvalue(),
-        timeout=60,
+        data=build_tarball(tf_code),
     )
     r.raise_for_status()
 
+@timed("tfc.trigger_plan_run")
 def trigger_plan_run(workspace_id, config_id):
     url = f"{TERRAFORM_API}/runs"
     payload = {
@@ -134,27 +372,74 @@ def trigger_plan_run(workspace_id, config_id):
             },
         }
     }
-    r = requests.post(url, headers=_headers(), json=payload, timeout=30)
+    r = client.post(url, headers=_headers(), json=payload)
     r.raise_for_status()
     return r.json()["data"]["id"]
 
+@timed("tfc.check_user_permissions")
 def check_user_permissions(workspace_id):
-    url = f"{TERRAFORM_API}/workspaces/{workspace_id}/permissions"
-    r = requests.get(url, headers=_headers(), timeout=30)
-    if r.status_code != 200:
+    """Whether the token may queue applies here, from the cached workspace metadata."""
+    try:
+        return get_workspace(workspace_id)["can_queue_apply"]
+    except Exception:
         return False
-    return (
-        r.json()
-        .get("data", {})
-        .get("attributes", {})
-        .get("can-queue-apply", False)
-    )
 
+@timed("tfc.apply_run")
 def apply_run(run_id):
     url = f"{TERRAFORM_API}/runs/{run_id}/actions/apply"
-    r = requests.post(url, headers=_headers(), timeout=30)
-    return r.status_code == 200
+    r = client.post(url, headers=_headers())
+    return r.status_code in (200, 202)
 
+# ---------- Run status ----------
+@timed("tfc.list_workspace_runs")
+def list_workspace_runs(workspace_id, page_size=20):
+    """Most recent runs of a workspace as {run_id: status}, in one request."""
+    url = f"{TERRAFORM_API}/workspaces/{workspace_id}/runs"
+    r = client.get(url, headers=_headers(), params={"page[size]": page_size})
+    r.raise_for_status()
+    return {d["id"]: d["attributes"]["status"] for d in r.json().get("data", [])}
 
+@timed("tfc.get_run_status")
+def get_run_status(run_id):
+    url = f"{TERRAFORM_API}/runs/{run_id}"
+    r = client.get(url, headers=_headers())
+    r.raise_for_status()
+    return r.json()["data"]["attributes"]["status"]
 
+@timed("tfc.get_run_details")
+def get_run_details(run_id):
+    """
+    Run status plus its plan and apply (id, status, log_read_url) in one
+    request. A phase that does not exist yet is None.
+    """
+    url = f"{TERRAFORM_API}/runs/{run_id}"
+    r = client.get(url, headers=_headers(), params={"include": "plan,apply"})
+    r.raise_for_status()
+    body = r.json()
+    included = {(d["type"], d["id"]): d.get("attributes", {}) for d in body.get("included", [])}
+    relationships = body["data"].get("relationships", {})
+    details = {"status": body["data"]["attributes"]["status"]}
+    for phase, kind in (("plan", "plans"), ("apply", "applies")):
+        ref = (relationships.get(phase) or {}).get("data")
+        attrs = included.get((kind, ref["id"])) if ref else None
+        details[phase] = None if attrs is None else {
+            "id": ref["id"],
+            "status": attrs.get("status"),
+            "log_read_url": attrs.get("log-read-url"),
+        }
+    return details
 
+@timed("tfc.read_log")
+def read_log(log_url, offset=0):
+    """
+    Log bytes from `offset` on, as a Range request so only output not seen
+    yet is transferred. Returns None once the pre-signed URL has expired.
+    """
+    r = log_client.get(log_url, headers={"Range": f"bytes={offset}-"})
+    if r.status_code == 416:  # nothing past `offset` yet
+        return b""
+    if r.status_code in (401, 403, 404):
+        return None
+    r.raise_for_status()
+    # 200: the server ignored the range and sent the whole log.
+    return r.content if r.status_code == 206 else r.content[offset:]
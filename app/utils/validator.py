@@ -1,12 +1,415 @@
 import re
 
-def simple_hcl_sanity_check(hcl_code: str):
-    if not hcl_code or len(hcl_code.strip()) < 30:
-        return False, "HCL too short or empty"
-    if "resource" not in hcl_code:
+UNSAFE_PATTERN = re.compile(r"(bash|curl|sudo|rm\s+-rf)", re.IGNORECASE)
+HCL_TOP_LEVEL = (
+    "terraform", "provider", "resource", "data", "variable", "output", "locals", "module",
+    "moved", "import", "check", "removed",
+)
+
+# ---------- Tokenizer ----------
+# Code between strings. Each alternative is a complete token; the scanner
+# decides what it means from the enclosing context.
+_CODE_TOKEN = re.compile(r"""
+    [ \t\r]*
+    (?: (?P<ws>[ \t\r]+)
+  | (?P<nl>\n)
+  | (?P<comment>\#[^\n]*|//[^\n]*|/\*.*?\*/)
+  | (?P<heredoc><<-?(?P<marker>[A-Za-z_][A-Za-z0-9_]*)[ \t]*\r?\n)
+  | (?P<partial>/\*|<<)
+  | (?P<ident>[A-Za-z_][A-Za-z0-9_\-]*)
+  | (?P<number>\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)
+  | (?P<quote>")
+  | (?P<open>[{\[(])
+  | (?P<close>[}\])])
+  | (?P<op>==|!=|<=|>=|&&|\|\||=>|\.\.\.|[=!<>+\-*/%?:.,])
+    )
+""", re.VERBOSE | re.DOTALL)
+
+# Inside a quoted string: literal text, an interpolation opener, or the end.
+_STRING_TOKEN = re.compile(r"""
+    (?P<text>(?:[^"\\$%\n]|\\.|\$\$\{|%%\{|\$(?!\{)|%(?!\{))+)
+  | (?P<interp>[$%]\{)
+  | (?P<end>")
+  | (?P<nl>\n)
+""", re.VERBOSE)
+
+_HEREDOC_LINE = re.compile(r"[^\n]*\n")
+
+# Fast paths for the common case, each consuming many tokens in one match:
+# runs of expression text and of `name = value` / blank / comment lines that
+# contain nothing affecting nesting, and whole block-opening / closing lines.
+_FREE = r"""(?:[^"{}\[\]()\n\#/<]|"(?:[^"\\$%\n]|\\.|\$(?!\{)|%(?!\{))*")"""
+_COMMENT_EOL = r"(?:(?:\#|//)[^\n]*)?\n"
+_EXPR_RUN = re.compile(_FREE + "+")
+_EXPR_LINES = re.compile(r"(?:" + _FREE + "*" + _COMMENT_EOL + ")+")
+_BODY_LINES = re.compile(
+    r"(?:[ \t]*(?:[A-Za-z_][A-Za-z0-9_\-]*[ \t]*=(?!=)" + _FREE + "*)?" + _COMMENT_EOL + ")+"
+)
+_BLOCK_LINE = re.compile(
+    r"""[ \t]*(?P<type>[A-Za-z_][A-Za-z0-9_\-]*)"""
+    r"""(?P<labels>(?:[ \t]+(?:"[^"\\$%\n]*"|[A-Za-z_][A-Za-z0-9_\-]*))*)[ \t]*\{[ \t]*""" + _COMMENT_EOL
+)
+_CLOSE_LINE = re.compile(r"[ \t]*\}[ \t]*" + _COMMENT_EOL)
+_LABEL = re.compile(r'"([^"]*)"|([A-Za-z_][A-Za-z0-9_\-]*)')
+_CLOSERS = {"}": "{", "]": "[", ")": "("}
+
+
+class HclSyntaxError(ValueError):
+    def __init__(self, message, line):
+        super().__init__(f"{message} (line {line})")
+        self.line = line
+
+
+class HclScanner:
+    """
+    Single-pass tokenizer and block parser for Terraform HCL.
+
+    Tracks brace/bracket/string/heredoc nesting, builds an inventory of
+    top-level blocks and applies UNSAFE_PATTERN only to string content inside
+    blocks that execute commands (provisioners and `data "external"`).
+
+    Text can be fed in pieces (e.g. from a streaming LLM response); a token
+    that touches the end of the buffer is held back until more text arrives
+    or `final=True` is passed. Only that unscanned tail is kept in the
+    buffer, so feeding many small chunks stays linear.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self.buffer = ""          # text from the first unscanned character on
+        self.pos = 0              # scan position within buffer
+        self.base = 0             # offset of buffer in the text fed so far
+        # Frames: ("block", info) | ("{"|"["|"(", None) | ("str", parts) | ("interp", None) | ("heredoc", marker)
+        self.stack = []
+        self.head = None          # tokens of the statement being read in a block body
+        self.in_expression = False
+        self.inventory = {
+            "providers": [], "resources": [], "data": [], "variables": [],
+            "outputs": [], "modules": [], "locals": 0, "terraform": 0,
+            "required_providers": False,
+        }
+        self.unsafe = None
+        self.blocks = 0
+        self.exec_depth = 0       # open blocks that execute commands
+
+    @property
+    def text(self):
+        """Everything fed so far."""
+        if len(self._chunks) > 1:
+            self._chunks = ["".join(self._chunks)]
+        return self._chunks[0] if self._chunks else ""
+
+    # ----- helpers -----
+    def _offset(self):
+        return self.base + self.pos
+
+    def _line(self, offset=None):
+        return self.text.count("\n", 0, self._offset() if offset is None else offset) + 1
+
+    def _error(self, message, offset=None):
+        raise HclSyntaxError(message, self._line(offset))
+
+    def _top(self):
+        return self.stack[-1] if self.stack else None
+
+    def _in_body(self):
+        top = self._top()
+        return top is None or top[0] == "block"
+
+    def _check_unsafe(self, text):
+        if self.unsafe is None and self.exec_depth and UNSAFE_PATTERN.search(text):
+            self.unsafe = self._line()
+
+    # ----- statements -----
+    def _open_block(self):
+        btype, labels = self.head[0], self.head[1:]
+        depth = sum(1 for kind, _ in self.stack if kind == "block")
+        is_exec = btype == "provisioner" or (
+            depth == 0 and btype == "data" and labels[:1] == ["external"]
+        )
+        self.exec_depth += is_exec
+        info = {"type": btype, "labels": labels, "exec": is_exec, "pos": self._offset()}
+        if depth == 0:
+            self._record(btype, labels)
+        elif btype == "required_providers" and self.stack[-1][1]["type"] == "terraform":
+            self.inventory["required_providers"] = True
+        self.stack.append(("block", info))
+        self.head = None
+        self.blocks += 1
+
+    def _record(self, btype, labels):
+        inv = self.inventory
+        if btype == "provider" and labels:
+            inv["providers"].append(labels[0])
+        elif btype == "resource" and len(labels) == 2:
+            inv["resources"].append(tuple(labels))
+        elif btype == "data" and len(labels) == 2:
+            inv["data"].append(tuple(labels))
+        elif btype == "variable" and labels:
+            inv["variables"].append(labels[0])
+        elif btype == "output" and labels:
+            inv["outputs"].append(labels[0])
+        elif btype == "module" and labels:
+            inv["modules"].append(labels[0])
+        elif btype in ("locals", "terraform"):
+            inv[btype] += 1
+        elif btype not in HCL_TOP_LEVEL:
+            self._error(f"Unknown top-level block '{btype}'")
+
+    # ----- scanning -----
+    def feed(self, chunk, final=False):
+        if chunk:
+            self._chunks.append(chunk)
+        if self.pos:
+            self.base += self.pos
+            self.buffer = self.buffer[self.pos:]
+            self.pos = 0
+        self.buffer += chunk
+        text, end = self.buffer, len(self.buffer)
+        code_match, string_match, heredoc_match = _CODE_TOKEN.match, _STRING_TOKEN.match, _HEREDOC_LINE.match
+        body_lines, block_line, close_line = _BODY_LINES.match, _BLOCK_LINE.match, _CLOSE_LINE.match
+        expr_lines, expr_run = _EXPR_LINES.match, _EXPR_RUN.match
+        stack = self.stack
+
+        while self.pos < end:
+            top = stack[-1] if stack else None
+            kind = top[0] if top else "block"
+
+            if not self.exec_depth:
+                pos = self.pos
+                if kind == "block":
+                    if self.head is None and not self.in_expression:
+                        m = body_lines(text, pos)
+                        if m is not None:
+                            self.pos = m.end()
+                            continue
+                        m = block_line(text, pos)
+                        if m is not None:
+                            self.head = [m.group("type")] + [
+                                a if b == "" else b for a, b in _LABEL.findall(m.group("labels"))
+                            ]
+                            self._open_block()  # at the start of the line, for error lines
+                            self.pos = m.end()
+                            continue
+                        if top is not None:
+                            m = close_line(text, pos)
+                            if m is not None:
+                                self.pos = m.end()
+                                self._close("}")
+                                continue
+                    elif self.in_expression:
+                        m = expr_run(text, pos)
+                        if m is not None and m.end() < end:
+                            self.pos = m.end()
+                elif kind in "{[(":
+                    m = expr_lines(text, pos) or expr_run(text, pos)
+                    if m is not None and m.end() < end:
+                        self.pos = m.end()
+                if self.pos >= end:
+                    break
+
+            if kind == "heredoc":
+                m = heredoc_match(text, self.pos)
+                if m is None:
+                    if not final:
+                        break
+                    line, next_pos = text[self.pos:], end  # last line without a newline
+                else:
+                    line, next_pos = m.group(0), m.end()
+                if line.strip() == top[1]:
+                    self.stack.pop()
+                else:
+                    self._check_unsafe(line)
+                self.pos = next_pos
+                continue
+
+            if kind == "str":
+                m = string_match(text, self.pos)
+                if m is None or (m.end() == end and not final and m.lastgroup == "text"):
+                    if m is None and final:
+                        self._error("Invalid escape in string")
+                    break
+                group = m.lastgroup
+                if group == "text":
+                    top[1].append(m.group(0))
+                elif group == "interp":
+                    top[1].append(None)  # not a plain literal any more
+                    self.stack.append(("interp", None))
+                elif group == "end":
+                    self.stack.pop()
+                    self._end_string(top[1])
+                else:
+                    self._error("Unterminated string")
+                self.pos = m.end()
+                continue
+
+            m = code_match(text, self.pos)
+            if m is None:
+                self._error(f"Unexpected character {text[self.pos]!r}")
+            if m.lastgroup == "partial":
+                if not final:
+                    break  # the rest of the comment / heredoc header has not arrived yet
+                self._error("Unterminated comment" if m.group("partial") == "/*" else "Malformed heredoc")
+            if m.end() == end and not final and m.lastgroup not in ("open", "close", "quote", "nl"):
+                break
+            self.pos = m.end()
+            self._code_token(m)
+
+        if final:
+            self._finish()
+        return self
+
+    def _code_token(self, m):
+        group = m.lastgroup
+        if group in ("ws", "comment"):
+            return
+        body = self._in_body()
+
+        if group == "nl":
+            if body:
+                if self.head and not self.in_expression:
+                    self._error("Incomplete statement")
+                self.head = None
+                self.in_expression = False
+            return
+
+        if body and not self.in_expression:
+            if group == "ident":
+                if self.head is None:
+                    self.head = [m.group(group)]
+                else:
+                    self.head.append(m.group(group))
+                return
+            if group == "quote" and self.head:
+                self.stack.append(("str", []))
+                return
+            if group == "open" and m.group(group) == "{" and self.head:
+                self._open_block()
+                return
+            if group == "op" and m.group(group) == "=" and self.head and len(self.head) == 1:
+                self.in_expression = True
+                return
+            if group == "close" and m.group(group) == "}" and not self.head:
+                pass  # handled below as the end of this block
+            else:
+                self._error(f"Unexpected {m.group(group)!r}")
+
+        if group == "quote":
+            self.stack.append(("str", []))
+        elif group == "heredoc":
+            self.stack.append(("heredoc", m.group("marker")))
+        elif group == "open":
+            self.stack.append((m.group(group), None))
+        elif group == "close":
+            self._close(m.group(group))
+
+    def _close(self, char):
+        top = self._top()
+        if top is None:
+            self._error(f"Unmatched {char!r}")
+        kind = top[0]
+        if char == "}" and kind == "interp":
+            self.stack.pop()
+            return
+        if char == "}" and kind == "block":
+            if self.head and not self.in_expression:
+                self._error("Incomplete statement")
+            self.stack.pop()
+            self.exec_depth -= top[1]["exec"]
+            self.head = None
+            self.in_expression = False
+            return
+        if kind != _CLOSERS[char]:
+            self._error(f"Mismatched {char!r}")
+        self.stack.pop()
+
+    def _end_string(self, parts):
+        literal = None if None in parts else "".join(parts)
+        self._check_unsafe("".join(p for p in parts if p is not None))
+        if self._in_body() and not self.in_expression and self.head:
+            if literal is None:
+                self._error("Block labels cannot contain interpolation")
+            self.head.append(literal)
+
+    def _finish(self):
+        if self.head and not self.in_expression:
+            self._error("Incomplete statement")
+        if self.stack:
+            kind, info = self.stack[-1]
+            if kind == "str":
+                self._error("Unterminated string")
+            if kind == "heredoc":
+                self._error(f"Unterminated heredoc {info}")
+            if kind == "block":
+                self._error(f"Unclosed block '{info['type']}'", info["pos"])
+            self._error(f"Unclosed {kind!r}")
+
+
+def parse_hcl(hcl_code: str):
+    """Returns the block inventory of `hcl_code`; raises HclSyntaxError."""
+    scanner = HclScanner().feed(hcl_code, final=True)
+    return scanner.inventory, scanner.unsafe
+
+
+def _verdict(inventory, unsafe_line):
+    if unsafe_line is not None:
+        return False, f"Unsafe content found (line {unsafe_line})"
+    if not inventory["resources"]:
         return False, "No resource block found"
-    if "provider" not in hcl_code:
+    if not inventory["providers"] and not inventory["required_providers"]:
         return False, "No provider block found"
-    if re.search(r"(bash|curl|sudo|rm\s+-rf)", hcl_code, re.IGNORECASE):
-        return False, "Unsafe content found"
     return True, "OK"
+
+
+def simple_hcl_sanity_check(hcl_code: str):
+    if not hcl_code or len(hcl_code.strip()) < 30:
+        return False, "HCL too short or empty"
+    try:
+        inventory, unsafe_line = parse_hcl(hcl_code)
+    except HclSyntaxError as e:
+        return False, f"Syntax error: {e}"
+    return _verdict(inventory, unsafe_line)
+
+
+class IncrementalHclValidator:
+    """
+    Checks streamed HCL chunk by chunk so a bad generation can be aborted
+    before the whole response has been paid for.
+
+    feed() returns (False, reason) as soon as the text is clearly unusable:
+    a syntax error, an unknown top-level block or unsafe commands in an exec
+    context. finish() applies the full check to the complete text.
+    """
+
+    def __init__(self):
+        self._scanner = HclScanner()
+        self._error = None
+
+    @property
+    def text(self):
+        return self._scanner.text
+
+    def feed(self, chunk):
+        if self._error:
+            return False, self._error
+        try:
+            self._scanner.feed(chunk)
+        except HclSyntaxError as e:
+            self._error = f"Syntax error: {e}" if self._scanner.blocks else "Output is not HCL"
+            return False, self._error
+        if self._scanner.unsafe is not None:
+            self._error = f"Unsafe content found (line {self._scanner.unsafe})"
+            return False, self._error
+        return True, "OK"
+
+    def finish(self):
+        if self._error:
+            return False, self._error
+        text = self._scanner.text
+        if len(text.strip()) < 30:
+            return False, "HCL too short or empty"
+        try:
+            self._scanner.feed("", final=True)
+        except HclSyntaxError as e:
+            return False, f"Syntax error: {e}"
+        return _verdict(self._scanner.inventory, self._scanner.unsafe)
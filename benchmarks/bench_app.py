@@ -0,0 +1,235 @@
+"""
+End-to-end benchmark of the Flask app against local fake upstreams.
+
+    python -m benchmarks.bench_app [--requests 200] [--concurrency 8]
+        [--tfc-latency 0.05] [--tfc-error-rate 0] [--tfc-429-rate 0]
+        [--hf-latency 0.5] [--hf-error-rate 0] [--hf-429-rate 0]
+        [--mongo-uri mongodb://...]
+
+Starts the fake Terraform Cloud and HF servers from fake_upstreams, serves
+the app on a threaded local server, then drives /login, /dashboard,
+/generate and /apply in turn with `--concurrency` logged-in clients and
+prints p50/p95/p99 latency and requests/second per route. Submitted
+/generate jobs are also followed to completion ("generate job" row).
+
+Without --mongo-uri the app runs on mongomock, which is enough to compare
+runs against each other but not to measure Mongo itself. mongomock is a
+development dependency: pip install -r requirements-dev.txt.
+"""
+import argparse
+import logging
+import os
+import statistics
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.fake_upstreams import Faults, HuggingFaceHandler, TerraformHandler, serve
+
+PASSWORD = "bench-password"
+
+
+def percentile(samples, q):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+def start_upstreams(args):
+    tfc = serve(TerraformHandler, Faults(
+        latency=args.tfc_latency, jitter=args.tfc_latency / 2,
+        error_rate=args.tfc_error_rate, throttle_rate=args.tfc_429_rate, retry_after=args.retry_after,
+    ))
+    hf = serve(HuggingFaceHandler, Faults(
+        latency=args.hf_latency, jitter=args.hf_latency / 2,
+        error_rate=args.hf_error_rate, throttle_rate=args.hf_429_rate, retry_after=args.retry_after,
+    ))
+    return tfc, hf
+
+
+def configure_env(args, tfc, hf):
+    # Must run before app modules are imported: their clients read these at import time.
+    os.environ["TERRAFORM_API"] = tfc.base_url + "/api/v2"
+    os.environ["HF_API_URL"] = hf.base_url + "/v1/chat/completions"
+    os.environ.setdefault("TERRAFORM_TOKEN", "bench-token")
+    os.environ.setdefault("TERRAFORM_ORG_NAME", "bench-org")
+    os.environ.setdefault("HF_TOKEN", "bench-token")
+    os.environ.setdefault("TFC_RATE_LIMIT", "1000")
+    os.environ.setdefault("HF_RATE_LIMIT", "1000")
+    os.environ.setdefault("JOB_QUEUE_LIMIT", str(max(32, args.requests)))
+    if args.mongo_uri:
+        os.environ["MONGO_URI"] = args.mongo_uri
+        os.environ.setdefault("MONGO_DB", "bench_" + uuid.uuid4().hex[:8])
+
+
+def build_app(args):
+    from app import create_app, db
+
+    if not args.mongo_uri:
+        import mongomock
+
+        mock = mongomock.MongoClient()
+        db.MongoClient = lambda uri, **kwargs: mock
+    return create_app()
+
+
+def seed(app, clients):
+    from werkzeug.security import generate_password_hash
+
+    hashed = generate_password_hash(PASSWORD)
+    db = app.mongo
+    users = []
+    for i in range(clients):
+        email = f"bench-{i}-{uuid.uuid4().hex[:6]}@example.com"
+        db.users.insert_one({"email": email, "password": hashed})
+        ws = db.workspaces.insert_one({
+            "owner": email, "name": f"bench-{i}", "workspace_id": f"ws-bench-{i}", "vars": [],
+        })
+        users.append((email, str(ws.inserted_id)))
+    return users
+
+
+def serve_app(app):
+    from werkzeug.serving import make_server
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, "http://127.0.0.1:%d" % server.server_port
+
+
+def make_session(base_url, email, ws_oid):
+    import requests
+
+    s = requests.Session()
+    s.post(f"{base_url}/login", data={"email": email, "password": PASSWORD}, allow_redirects=False)
+    s.get(f"{base_url}/workspace/{ws_oid}/open", allow_redirects=False)
+    return s
+
+
+def run_phase(name, sessions, total, call):
+    """Runs `call(session, i)` `total` times over the sessions; returns timings."""
+    latencies, failures = [], 0
+    lock = threading.Lock()
+    counter = iter(range(total))
+
+    def worker(session):
+        nonlocal failures
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            start = time.perf_counter()
+            ok = call(session, i)
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                failures += 0 if ok else 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(sessions)) as pool:
+        list(pool.map(worker, sessions))
+    wall = time.perf_counter() - start
+    return {"route": name, "n": len(latencies), "failed": failures, "wall": wall, "latencies": latencies}
+
+
+def wait_for_jobs(base_url, submitted, timeout):
+    """Polls each job (as its owner) until it settles; returns completion times."""
+    durations, failed = [], 0
+    pending = dict(submitted)
+    deadline = time.time() + timeout
+    while pending and time.time() < deadline:
+        for job_id, (session, started) in list(pending.items()):
+            job = session.get(f"{base_url}/jobs/{job_id}").json()
+            if job["status"] in ("succeeded", "failed"):
+                durations.append(time.perf_counter() - started)
+                failed += job["status"] == "failed"
+                pending.pop(job_id)
+        time.sleep(0.05)
+    return durations, failed + len(pending)
+
+
+def report(rows):
+    print(f"{'route':<14}{'n':>6}{'fail':>6}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for row in rows:
+        lat = row["latencies"]
+        rps = row["n"] / row["wall"] if row["wall"] else 0.0
+        print(f"{row['route']:<14}{row['n']:>6}{row['failed']:>6}{rps:>9.1f}"
+              f"{percentile(lat, 50) * 1000:>9.1f}{percentile(lat, 95) * 1000:>9.1f}"
+              f"{percentile(lat, 99) * 1000:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=200, help="requests per route")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--prompts", type=int, default=8, help="distinct prompts sent to /generate")
+    parser.add_argument("--tfc-latency", type=float, default=0.05, help="seconds")
+    parser.add_argument("--tfc-error-rate", type=float, default=0.0)
+    parser.add_argument("--tfc-429-rate", type=float, default=0.0)
+    parser.add_argument("--hf-latency", type=float, default=0.5, help="seconds")
+    parser.add_argument("--hf-error-rate", type=float, default=0.0)
+    parser.add_argument("--hf-429-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After sent with 429s")
+    parser.add_argument("--job-timeout", type=float, default=120.0)
+    parser.add_argument("--mongo-uri", help="real MongoDB instead of mongomock")
+    args = parser.parse_args()
+
+    tfc, hf = start_upstreams(args)
+    configure_env(args, tfc, hf)
+    app = build_app(args)
+    users = seed(app, args.concurrency)
+    server, base_url = serve_app(app)
+    sessions = [make_session(base_url, email, ws_oid) for email, ws_oid in users]
+    emails = {id(s): email for s, (email, _) in zip(sessions, users)}
+
+    def login(s, i):
+        r = s.post(f"{base_url}/login", data={"email": emails[id(s)], "password": PASSWORD},
+                   allow_redirects=False)
+        return r.status_code == 302
+
+    def dashboard(s, i):
+        return s.get(f"{base_url}/dashboard").status_code == 200
+
+    submitted = {}
+
+    def generate(s, i):
+        started = time.perf_counter()
+        r = s.post(f"{base_url}/generate", data={"prompt": f"resource group number {i % args.prompts}"},
+                   headers={"Accept": "application/json"})
+        if r.status_code != 202:
+            return False
+        submitted[r.json()["job_id"]] = (s, started)
+        return True
+
+    def apply(s, i):
+        r = s.post(f"{base_url}/apply", data={"run_id": f"run-bench-{i}"})
+        return r.status_code == 200
+
+    rows = [
+        run_phase("/login", sessions, args.requests, login),
+        run_phase("/dashboard", sessions, args.requests, dashboard),
+    ]
+    gen = run_phase("/generate", sessions, args.requests, generate)
+    rows.append(gen)
+    job_started = time.perf_counter()
+    durations, job_failures = wait_for_jobs(base_url, submitted, args.job_timeout)
+    rows.append({"route": "generate job", "n": len(durations), "failed": job_failures,
+                 "wall": time.perf_counter() - job_started + gen["wall"], "latencies": durations})
+    rows.append(run_phase("/apply", sessions, args.requests, apply))
+
+    print(f"concurrency {args.concurrency}, {args.requests} requests per route, "
+          f"mongo: {'real' if args.mongo_uri else 'mongomock'}")
+    report(rows)
+    print(f"upstream requests: terraform {tfc.requests} ({tfc.errors} errors, {tfc.throttled} throttled), "
+          f"hf {hf.requests} ({hf.errors} errors, {hf.throttled} throttled)")
+    if durations:
+        print(f"job completion mean {statistics.mean(durations) * 1000:.0f} ms")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Worker startup time: fresh interpreters importing the app package and
+calling create_app(), as a pre-fork server worker or a CLI command would.
+
+    python -m benchmarks.bench_startup [--runs 10]
+
+Reports the median time spent importing, in create_app() and for the
+whole process, and whether a Mongo client existed once create_app()
+returned (it should not: the client is created on first use).
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+PROBE = """
+import json, time
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+flask_app = app.create_app()
+t2 = time.perf_counter()
+print(json.dumps({
+    "import": t1 - t0,
+    "create_app": t2 - t1,
+    "mongo_connected": getattr(flask_app.mongo, "connected", True),
+    "requests_loaded": "requests" in __import__("sys").modules,
+}))
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    env = dict(os.environ, RUN_TRACKER_ENABLED=os.getenv("RUN_TRACKER_ENABLED", "0"))
+    samples = []
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        out = subprocess.run(
+            [sys.executable, "-c", PROBE], env=env, capture_output=True, text=True, check=True,
+        ).stdout
+        sample = json.loads(out.strip().splitlines()[-1])
+        sample["process"] = time.perf_counter() - start
+        samples.append(sample)
+
+    for key in ("import", "create_app", "process"):
+        print(f"{key:<11} median {statistics.median(s[key] for s in samples) * 1000:8.1f} ms")
+    print(f"mongo client created at startup: {any(s['mongo_connected'] for s in samples)}")
+    print(f"requests imported at startup:    {any(s['requests_loaded'] for s in samples)}")
+
+
+if __name__ == "__main__":
+    main()
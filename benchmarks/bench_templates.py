@@ -0,0 +1,65 @@
+"""
+Render cost of the page templates: render_template_string (parse + compile
+on every call) against the registered, precompiled templates.
+
+    python -m benchmarks.bench_templates [--repeat 2000] [--workspaces 20]
+
+Runs the app on mongomock (pip install -r requirements-dev.txt).
+"""
+import argparse
+import os
+import time
+
+from flask import render_template, render_template_string
+
+os.environ.setdefault("RUN_TRACKER_ENABLED", "0")
+
+SAMPLE = {
+    "login.html": lambda n: {},
+    "dashboard.html": lambda n: {
+        "user": "bench@example.com",
+        "workspaces": [{"_id": f"64b{i:021d}", "name": f"ws-{i}", "workspace_id": f"ws-{i}"} for i in range(n)],
+        "runs": {f"ws-{i}": {"status": "applied", "run_id": f"run-{i}"} for i in range(n)},
+    },
+    "vars.html": lambda n: {
+        "ws": {"name": "ws-0"}, "wid": "64b000000000000000000000",
+        "vars": [{"key": f"KEY_{i}", "sensitive": bool(i % 2)} for i in range(n)],
+    },
+    "prompt.html": lambda n: {"ws_name": "ws-0"},
+}
+
+
+def per_call_us(fn, repeat):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=2000)
+    parser.add_argument("--workspaces", type=int, default=20, help="rows on the dashboard / vars pages")
+    args = parser.parse_args()
+
+    import mongomock
+
+    from app import create_app, db
+    from app.main import TEMPLATES
+
+    db.MongoClient = lambda uri, **kwargs: mongomock.MongoClient()
+    app = create_app()
+
+    print(f"{'template':<16}{'string us':>12}{'registered us':>15}{'speedup':>9}")
+    with app.test_request_context("/"):
+        for name, context in SAMPLE.items():
+            ctx = context(args.workspaces)
+            source = TEMPLATES[name]
+            before = per_call_us(lambda: render_template_string(source, **ctx), args.repeat)
+            after = per_call_us(lambda: render_template(name, **ctx), args.repeat)
+            print(f"{name:<16}{before:>12.1f}{after:>15.1f}{before / after:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Benchmark for app.utils.validator on large generated configurations.
+
+    python -m benchmarks.bench_validator [--blocks 600] [--repeat 20]
+
+Reports per-call time for simple_hcl_sanity_check and for feeding the same
+text to IncrementalHclValidator in 64-byte chunks.
+"""
+import argparse
+import statistics
+import time
+
+from app.utils.validator import IncrementalHclValidator, simple_hcl_sanity_check
+
+HEADER = '''terraform {
+  required_providers {
+    azurerm = { source = "hashicorp/azurerm", version = "~> 3.0" }
+  }
+}
+
+provider "azurerm" {
+  features {}
+}
+
+variable "location" {
+  default = "eastus"
+}
+'''
+
+BLOCK = '''
+resource "azurerm_storage_account" "sa_{i}" {{
+  name                     = "sa${{var.location}}{i}"
+  resource_group_name      = azurerm_resource_group.rg_{i}.name
+  location                 = var.location
+  account_tier             = "Standard"
+  account_replication_type = "LRS"
+  tags = {{
+    env   = "bench"
+    index = {i}
+  }}
+}}
+
+resource "azurerm_resource_group" "rg_{i}" {{
+  name     = "rg-{i}"
+  location = var.location
+}}
+'''
+
+
+def build_config(blocks):
+    return HEADER + "".join(BLOCK.format(i=i) for i in range(blocks))
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--blocks", type=int, default=600, help="resource pairs to generate")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    config = build_config(args.blocks)
+    lines = config.count("\n")
+    ok, msg = simple_hcl_sanity_check(config)
+    assert ok, msg
+
+    def incremental():
+        v = IncrementalHclValidator()
+        for i in range(0, len(config), 64):
+            v.feed(config[i:i + 64])
+        assert v.finish()[0]
+
+    print(f"{lines} lines, {len(config) / 1024:.0f} KiB")
+    for name, fn in (("sanity_check", lambda: simple_hcl_sanity_check(config)), ("incremental", incremental)):
+        samples = timed(fn, args.repeat)
+        print(f"{name:>14}: median {statistics.median(samples):7.2f} ms   min {min(samples):7.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+"""
+Local stand-ins for the Terraform Cloud v2 API and the HF chat-completions
+router, for benchmarking without network access.
+
+Each server answers the endpoints app/ uses with canned JSON after
+`latency` seconds (plus up to `jitter`), and fails a `error_rate` fraction
+of requests with 500 and a `throttle_rate` fraction with 429 +
+Retry-After. Point the app at them with TERRAFORM_API / HF_API_URL.
+"""
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+HCL_RESPONSE = '''terraform {
+  required_providers {
+    azurerm = { source = "hashicorp/azurerm", version = "~> 3.0" }
+  }
+}
+
+provider "azurerm" {
+  features {}
+}
+
+resource "azurerm_resource_group" "rg" {
+  name     = "bench-rg"
+  location = "eastus"
+}
+'''
+
+
+# Plan/apply output, one line written every LOG_LINE_SECONDS.
+LOG_LINE_SECONDS = 0.05
+PHASE_LOGS = {
+    "plan": [
+        "Terraform v1.7.5\n",
+        "Initializing plugins and modules...\n",
+        "\x1b[0m\x1b[1mazurerm_resource_group.rg: Refreshing state...\x1b[0m\n",
+        "\n",
+        "Terraform will perform the following actions:\n",
+        "  # azurerm_resource_group.rg will be created\n",
+        '  + resource "azurerm_resource_group" "rg" {\n',
+        '      + location = "eastus"\n',
+        '      + name     = "bench-rg"\n',
+        "    }\n",
+        "\n",
+        "\x1b[1mPlan:\x1b[0m 1 to add, 0 to change, 0 to destroy.\n",
+    ],
+    "apply": [
+        "Terraform v1.7.5\n",
+        "azurerm_resource_group.rg: Creating...\n",
+        "azurerm_resource_group.rg: Creation complete after 2s\n",
+        "\n",
+        "Apply complete! Resources: 1 added, 0 changed, 0 destroyed.\n",
+    ],
+}
+
+
+class Faults:
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, throttle_rate=0.0, retry_after=1,
+                 model_latency=None):
+        self.latency = latency
+        # HF only: extra seconds per model name, to exercise model routing.
+        self.model_latency = dict(model_latency or {})
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real services
+    routes = ()
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body=b"", content_type="application/vnd.api+json", headers=None):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _dispatch(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        server = self.server
+        with server.lock:
+            server.requests += 1
+        faults = server.faults
+        time.sleep(faults.latency + random.random() * faults.jitter)
+        roll = random.random()
+        if roll < faults.throttle_rate:
+            with server.lock:
+                server.throttled += 1
+            return self._send(429, {"errors": [{"status": "429"}]},
+                              headers={"Retry-After": str(faults.retry_after)})
+        if roll < faults.throttle_rate + faults.error_rate:
+            with server.lock:
+                server.errors += 1
+            return self._send(500, {"errors": [{"status": "500"}]})
+
+        path = self.path.split("?", 1)[0]
+        for method, pattern, name in self.routes:
+            if method != self.command:
+                continue
+            m = re.fullmatch(pattern, path)
+            if m:
+                payload = json.loads(body) if body and name != "upload" else body
+                return getattr(self, "do_" + name)(payload, *m.groups())
+        self._send(404, {"errors": [{"status": "404", "title": path}]})
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _dispatch
+
+
+class TerraformHandler(_Handler):
+    routes = (
+        ("GET", r"/api/v2/organizations/([^/]+)/workspaces", "list_workspaces"),
+        ("POST", r"/api/v2/organizations/([^/]+)/workspaces", "create_workspace"),
+        ("GET", r"/api/v2/organizations/([^/]+)/workspaces/([^/]+)", "show_workspace_by_name"),
+        ("GET", r"/api/v2/workspaces/([^/]+)", "show_workspace"),
+        ("DELETE", r"/api/v2/workspaces/([^/]+)", "delete_workspace"),
+        ("GET", r"/api/v2/workspaces/([^/]+)/vars", "list_vars"),
+        ("POST", r"/api/v2/workspaces/([^/]+)/vars", "create_var"),
+        ("PATCH", r"/api/v2/workspaces/([^/]+)/vars/([^/]+)", "update_var"),
+        ("POST", r"/api/v2/workspaces/([^/]+)/configuration-versions", "create_config_version"),
+        ("PUT", r"/uploads/([^/]+)", "upload"),
+        ("POST", r"/api/v2/runs", "create_run"),
+        ("GET", r"/api/v2/runs/([^/]+)", "show_run"),
+        ("POST", r"/api/v2/runs/([^/]+)/actions/apply", "apply_run"),
+        ("GET", r"/api/v2/workspaces/([^/]+)/runs", "list_runs"),
+        ("GET", r"/logs/([^/]+)/(plan|apply)", "read_log"),
+    )
+
+    def _workspace(self, ws_id, name=None, org="bench-org"):
+        return {"id": ws_id, "type": "workspaces", "attributes": {
+            "name": name or ws_id, "execution-mode": "remote", "auto-apply": True,
+            "permissions": {"can-queue-run": True, "can-queue-apply": True},
+        }, "relationships": {"organization": {"data": {"id": org, "type": "organizations"}}}}
+
+    def do_list_workspaces(self, _, org):
+        data = [self._workspace(f"ws-{org}-{i}", f"bench-{i}", org) for i in range(20)]
+        self._send(200, {"data": data, "meta": {"pagination": {"current-page": 1, "total-pages": 1}}})
+
+    def do_create_workspace(self, payload, org):
+        name = payload["data"]["attributes"]["name"]
+        self._send(201, {"data": self._workspace("ws-" + uuid.uuid4().hex[:16], name, org)})
+
+    def do_show_workspace_by_name(self, _, org, name):
+        self._send(200, {"data": self._workspace(f"ws-{org}-{name}", name, org)})
+
+    def do_show_workspace(self, _, ws_id):
+        self._send(200, {"data": self._workspace(ws_id)})
+
+    def do_delete_workspace(self, _, ws_id):
+        self._send(204)
+
+    def do_list_vars(self, _, ws_id):
+        self._send(200, {"data": []})
+
+    def do_create_var(self, payload, ws_id):
+        self._send(201, {"data": dict(payload["data"], id="var-" + uuid.uuid4().hex[:16])})
+
+    def do_update_var(self, payload, ws_id, var_id):
+        self._send(200, {"data": payload["data"]})
+
+    def do_create_config_version(self, _, ws_id):
+        cv_id = "cv-" + uuid.uuid4().hex[:16]
+        host, port = self.server.server_address[:2]
+        self._send(201, {"data": {"id": cv_id, "type": "configuration-versions", "attributes": {
+            "status": "pending", "upload-url": f"http://{host}:{port}/uploads/{cv_id}",
+        }}})
+
+    def do_upload(self, body, cv_id):
+        self._send(200, content_type="text/plain")
+
+    def do_create_run(self, payload, *_):
+        run_id = "run-" + uuid.uuid4().hex[:16]
+        with self.server.lock:
+            self.server.runs[run_id] = {"plan": time.monotonic()}
+        self._send(201, {"data": {"id": run_id, "type": "runs", "attributes": {"status": "pending"}}})
+
+    def _phase_log(self, run_id, phase):
+        """(log bytes written so far, finished) for a phase that writes one line per LOG_LINE_SECONDS."""
+        started = self.server.runs.get(run_id, {}).get(phase)
+        if started is None:
+            return None, False
+        lines = PHASE_LOGS[phase]
+        shown = min(len(lines), int((time.monotonic() - started) / LOG_LINE_SECONDS) + 1)
+        done = shown == len(lines)
+        return ("\x02" + "".join(lines[:shown]) + ("\x03" if done else "")).encode(), done
+
+    def do_show_run(self, _, run_id):
+        host, port = self.server.server_address[:2]
+        phases, included = {}, []
+        for phase, kind in (("plan", "plans"), ("apply", "applies")):
+            text, done = self._phase_log(run_id, phase)
+            status = "pending" if text is None else "finished" if done else "running"
+            phases[phase] = status
+            included.append({"id": f"{phase}-{run_id}", "type": kind, "attributes": {
+                "status": status, "log-read-url": f"http://{host}:{port}/logs/{run_id}/{phase}",
+            }})
+        status = {"pending": "planning", "running": "planning", "finished": "planned"}[phases["plan"]]
+        if phases["apply"] != "pending":
+            status = "applied" if phases["apply"] == "finished" else "applying"
+        self._send(200, {"data": {"id": run_id, "type": "runs", "attributes": {"status": status},
+                                  "relationships": {
+                                      "plan": {"data": {"id": f"plan-{run_id}", "type": "plans"}},
+                                      "apply": {"data": {"id": f"apply-{run_id}", "type": "applies"}},
+                                  }},
+                         "included": included})
+
+    def do_read_log(self, _, run_id, phase):
+        text, _ = self._phase_log(run_id, phase)
+        text = text or b""
+        with self.server.lock:
+            self.server.log_bytes += len(text)
+        m = re.fullmatch(r"bytes=(\d+)-", self.headers.get("Range", ""))
+        if not m:
+            return self._send(200, text, content_type="text/plain")
+        offset = int(m.group(1))
+        if offset >= len(text):
+            return self._send(416, content_type="text/plain")
+        self._send(206, text[offset:], content_type="text/plain",
+                   headers={"Content-Range": f"bytes {offset}-{len(text) - 1}/*"})
+
+    def do_apply_run(self, _, run_id):
+        with self.server.lock:
+            self.server.runs.setdefault(run_id, {})["apply"] = time.monotonic()
+        self._send(202)
+
+    def do_list_runs(self, _, ws_id):
+        self._send(200, {"data": []})
+
+
+class HuggingFaceHandler(_Handler):
+    routes = (("POST", r"/v1/chat/completions", "chat"),)
+
+    def do_chat(self, payload):
+        time.sleep(self.server.faults.model_latency.get(payload.get("model"), 0.0))
+        if not payload.get("stream"):
+            return self._send(200, {"choices": [{"message": {"role": "assistant", "content": HCL_RESPONSE}}]},
+                              content_type="application/json")
+        events = b"".join(
+            b"data: " + json.dumps({"choices": [{"delta": {"content": line}}]}).encode() + b"\n\n"
+            for line in HCL_RESPONSE.splitlines(keepends=True)
+        ) + b"data: [DONE]\n\n"
+        self._send(200, events, content_type="text/event-stream")
+
+
+def serve(handler, faults, host="127.0.0.1", port=0):
+    """Starts `handler` on a daemon thread; returns the server (see .base_url)."""
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.faults = faults
+    server.lock = threading.Lock()
+    server.requests = server.errors = server.throttled = 0
+    server.runs = {}  # run id -> {phase: monotonic start}, for the log endpoints
+    server.log_bytes = 0  # bytes the log endpoint would have sent without Range
+    server.base_url = "http://%s:%d" % server.server_address[:2]
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,36 @@
+"""
+Shared fixtures. Mongo is mongomock and no background threads run; tests
+that need Terraform Cloud or the LLM replace the calls they make.
+
+    pip install -r requirements-dev.txt && python -m pytest
+"""
+import os
+
+import mongomock
+import pytest
+
+for _flag in ("RUN_TRACKER_ENABLED", "RECONCILE_ENABLED", "HISTORY_COMPACT_ENABLED"):
+    os.environ.setdefault(_flag, "0")
+os.environ.setdefault("TERRAFORM_TOKEN", "test-token")
+os.environ.setdefault("TERRAFORM_ORG_NAME", "test-org")
+
+
+@pytest.fixture
+def mongo():
+    return mongomock.MongoClient()["test"]
+
+
+@pytest.fixture
+def app(monkeypatch):
+    from app import create_app, db
+
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(db, "MongoClient", lambda uri, **kwargs: client)
+    app = create_app()
+    app.config["TESTING"] = True
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
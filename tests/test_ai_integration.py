@@ -0,0 +1,246 @@
+import json
+import threading
+import time
+
+import pytest
+
+from app import ai_integration
+from app.model_router import ModelRouter
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def run_threads(n, target):
+    """Runs target() on n threads; returns their results or exceptions in order."""
+    outcomes = [None] * n
+
+    def run(i):
+        try:
+            outcomes[i] = target()
+        except Exception as e:
+            outcomes[i] = e
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    return threads, outcomes
+
+
+def coalesced():
+    return ai_integration.call_stats()["coalesced"]
+
+
+def test_identical_requests_share_one_upstream_call():
+    release = threading.Event()
+    calls = []
+
+    def generate():
+        calls.append(1)
+        assert release.wait(5)
+        return "resource {}"
+
+    before = coalesced()
+    threads, outcomes = run_threads(5, lambda: ai_integration._single_flight("k", generate))
+    wait_until(lambda: coalesced() - before == 4)  # every follower is waiting on the leader
+    release.set()
+    for t in threads:
+        t.join(5)
+    assert len(calls) == 1
+    assert outcomes == ["resource {}"] * 5
+    assert ai_integration._flights == {}
+
+
+def test_leader_failure_reaches_every_waiter():
+    release = threading.Event()
+
+    def generate():
+        assert release.wait(5)
+        raise RuntimeError("upstream down")
+
+    before = coalesced()
+    threads, outcomes = run_threads(3, lambda: ai_integration._single_flight("k", generate))
+    wait_until(lambda: coalesced() - before == 2)
+    release.set()
+    for t in threads:
+        t.join(5)
+    assert all(isinstance(o, RuntimeError) and str(o) == "upstream down" for o in outcomes)
+    # The failure is not remembered: the next caller tries again.
+    assert ai_integration._single_flight("k", lambda: "ok") == "ok"
+
+
+def test_slots_cap_concurrent_calls(monkeypatch):
+    monkeypatch.setattr(ai_integration, "_slots", threading.BoundedSemaphore(2))
+    lock = threading.Lock()
+    active, peak = [0], [0]
+
+    def call():
+        with ai_integration._llm_slot():
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.05)
+            with lock:
+                active[0] -= 1
+        return True
+
+    threads, outcomes = run_threads(6, call)
+    for t in threads:
+        t.join(5)
+    assert outcomes == [True] * 6
+    assert peak[0] == 2
+
+
+def test_queue_timeout_when_no_slot_frees_up(monkeypatch):
+    monkeypatch.setattr(ai_integration, "_slots", threading.BoundedSemaphore(1))
+    monkeypatch.setattr(ai_integration, "LLM_QUEUE_TIMEOUT", 0.05)
+    timeouts = ai_integration.call_stats()["queue_timeouts"]
+    with ai_integration._llm_slot():
+        with pytest.raises(RuntimeError, match="Too many LLM requests"):
+            with ai_integration._llm_slot():
+                pass
+    assert ai_integration.call_stats()["queue_timeouts"] == timeouts + 1
+    with ai_integration._llm_slot():  # the held slot was given back
+        pass
+
+
+def hcl(model):
+    return f'provider "aws" {{}}\nresource "null_resource" "{model.replace("-", "_")}" {{}}'
+
+
+class FakeStream:
+    """A streamed completion that answers after `seconds`, or ends early when closed."""
+
+    def __init__(self, model, seconds):
+        self.model = model
+        self.seconds = seconds
+        self.closed = threading.Event()
+
+    def raise_for_status(self):
+        pass
+
+    def iter_lines(self, decode_unicode=False):
+        if self.closed.wait(self.seconds):
+            return
+        yield "data: " + json.dumps({"choices": [{"delta": {"content": hcl(self.model)}}]})
+        yield "data: [DONE]"
+
+    def close(self):
+        self.closed.set()
+
+
+@pytest.fixture
+def models(monkeypatch):
+    """Routes between m1 (asked first) and m2, hedging after 0.1 s; set latencies in the returned dict."""
+    monkeypatch.setenv("HF_TOKEN", "token")
+    router = ModelRouter(["m1", "m2"])
+    monkeypatch.setattr(router, "hedge_delay", lambda model: 0.1)
+    monkeypatch.setattr(ai_integration, "router", router)
+    monkeypatch.setattr(ai_integration.llm_cache, "put", lambda key, value: True)
+    fake = {"latency": {"m1": 0.1, "m2": 0.1}, "streams": {}, "router": router}
+
+    def post(url, headers=None, json=None, stream=False):
+        model = json["model"]
+        fake["streams"][model] = FakeStream(model, fake["latency"][model])
+        return fake["streams"][model]
+
+    monkeypatch.setattr(ai_integration.client, "post", post)
+    return fake
+
+
+def slots_free(n):
+    """True once n LLM slots can be taken at the same time (they are given straight back)."""
+    taken = 0
+    while taken < n and ai_integration._slots.acquire(blocking=False):
+        taken += 1
+    for _ in range(taken):
+        ai_integration._slots.release()
+    return taken == n
+
+
+def test_hedge_wins_and_the_slow_stream_is_closed(models, monkeypatch):
+    monkeypatch.setattr(ai_integration, "_slots", threading.BoundedSemaphore(2))
+    models["latency"].update(m1=2.0, m2=0.05)
+    start = time.perf_counter()
+    assert ai_integration._generate("p", "key") == hcl("m2")
+    assert time.perf_counter() - start < 1.0
+    assert models["streams"]["m1"].closed.is_set()
+    wait_until(lambda: slots_free(2), timeout=0.5)  # m1's slot is back well before its 2 s answer
+    stats = models["router"].stats()
+    assert (stats["m1"]["cancelled"], stats["m2"]["hedged"], stats["m2"]["wins"]) == (1, 1, 1)
+    # m1 lost after ~0.15 s on the wire; that is its latency sample.
+    assert 0.1 <= stats["m1"]["p50_seconds"] < 0.5
+
+
+def test_no_hedge_without_a_free_slot(models, monkeypatch):
+    monkeypatch.setattr(ai_integration, "_slots", threading.BoundedSemaphore(1))
+    models["latency"].update(m1=0.3, m2=0.05)
+    assert ai_integration._generate("p", "key") == hcl("m1")
+    stats = models["router"].stats()
+    assert stats["m2"]["requests"] == 0 and "m2" not in models["streams"]
+    assert stats["m1"]["wins"] == 1
+    assert 0.3 <= stats["m1"]["p50_seconds"] < 0.5
+
+
+def test_hedge_timer_and_latency_start_at_send_not_in_the_queue(models, monkeypatch):
+    monkeypatch.setattr(ai_integration, "_slots", threading.BoundedSemaphore(2))
+    models["latency"].update(m1=0.05, m2=0.05)
+    ai_integration._slots.acquire()
+    ai_integration._slots.acquire()
+    threading.Timer(0.3, lambda: (ai_integration._slots.release(), ai_integration._slots.release())).start()
+    # m1 queues 0.3 s for a slot, longer than the hedge delay; no hedge, and the wait is not latency.
+    assert ai_integration._generate("p", "key") == hcl("m1")
+    stats = models["router"].stats()
+    assert stats["m2"]["requests"] == 0
+    assert stats["m1"]["p50_seconds"] < 0.2
+
+
+class GatedPool:
+    """Runs attempts on threads, holding hedges back until `gate` is set."""
+
+    def __init__(self, gate):
+        self.gate = gate
+
+    def submit(self, fn, attempt, *args):
+        def run():
+            if attempt.hedge:
+                assert self.gate.wait(5)
+            fn(attempt, *args)
+        threading.Thread(target=run).start()
+
+
+def test_hedge_cancelled_before_send_records_no_latency(models, monkeypatch):
+    monkeypatch.setattr(ai_integration, "_slots", threading.BoundedSemaphore(2))
+    gate = threading.Event()
+    monkeypatch.setattr(ai_integration, "_attempt_pool", GatedPool(gate))
+    models["latency"].update(m1=0.2, m2=0.05)
+    assert ai_integration._generate("p", "key") == hcl("m1")
+    gate.set()  # m2 only gets going after m1 has won
+    wait_until(lambda: slots_free(2))
+    stats = models["router"].stats()
+    assert "m2" not in models["streams"]
+    assert (stats["m2"]["requests"], stats["m2"]["cancelled"], stats["m2"]["p50_seconds"]) == (1, 1, None)
+
+
+def test_failed_first_choice_falls_back_to_the_next(models, monkeypatch):
+    monkeypatch.setattr(ai_integration, "_slots", threading.BoundedSemaphore(2))
+
+    def raise_for_status():
+        raise RuntimeError("503")
+
+    post = ai_integration.client.post
+
+    def failing_m1(url, headers=None, json=None, stream=False):
+        r = post(url, headers=headers, json=json, stream=stream)
+        if json["model"] == "m1":
+            r.raise_for_status = raise_for_status
+        return r
+
+    monkeypatch.setattr(ai_integration.client, "post", failing_m1)
+    assert ai_integration._generate("p", "key") == hcl("m2")
+    stats = models["router"].stats()
+    assert (stats["m1"]["failures"], stats["m2"]["hedged"], stats["m2"]["wins"]) == (1, 0, 1)
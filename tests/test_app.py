@@ -0,0 +1,41 @@
+def test_login_page_renders(client):
+    r = client.get("/login")
+    assert r.status_code == 200
+    assert b"Login" in r.data
+
+
+def test_register_then_dashboard(client):
+    r = client.post("/register", data={"email": "Dev@Example.com", "password": "pw"})
+    assert r.status_code == 302
+    r = client.get("/dashboard")
+    assert r.status_code == 200
+    assert b"dev@example.com" in r.data
+
+
+def test_login_rejects_wrong_password(client):
+    client.post("/register", data={"email": "a@example.com", "password": "right"})
+    client.get("/logout")
+    r = client.post("/login", data={"email": "a@example.com", "password": "wrong"})
+    assert r.status_code == 401
+
+
+def test_stats_and_metrics(client):
+    client.get("/login")
+    assert client.get("/stats").status_code == 200
+    r = client.get("/metrics")
+    assert r.status_code == 200
+    assert b'endpoint="main.login"' in r.data
+    assert b'app_rate_limit_acquired_total{limiter="terraform"}' in r.data
+    assert b"# TYPE app_rate_limit_max_wait_seconds gauge" in r.data
+
+
+def test_background_threads_start_on_first_request(app):
+    started = []
+    from app import background
+    background.register(app, lambda: started.append(1))
+    assert started == []  # create_app() alone (CLI, pre-fork master) starts nothing
+    client = app.test_client()
+    client.get("/login")
+    client.get("/login")
+    assert started == [1]
+    assert app.extensions["jobs"]._sweeper.is_alive()
@@ -0,0 +1,34 @@
+import threading
+from datetime import timedelta
+
+from app import background
+
+
+def test_lease_is_held_by_one_owner_until_it_expires(mongo):
+    assert background.take_lease(mongo, "job", "a", 60)
+    assert background.take_lease(mongo, "job", "a", 60)  # renewal
+    assert not background.take_lease(mongo, "job", "b", 60)
+    mongo.locks.update_one({"_id": "job"}, {"$set": {"expires_at": background.now() - timedelta(seconds=1)}})
+    assert background.take_lease(mongo, "job", "b", 60)
+    background.release_lease(mongo, "job", "a")  # not a's any more: no effect
+    assert not background.take_lease(mongo, "job", "a", 60)
+    background.release_lease(mongo, "job", "b")
+    assert background.take_lease(mongo, "job", "a", 60)
+
+
+def test_due_run_is_claimed_once_per_interval(mongo):
+    assert background.claim_due_run(mongo, "compact", "a", 3600)
+    assert not background.claim_due_run(mongo, "compact", "b", 3600)
+    mongo.locks.update_one({"_id": "compact"}, {"$set": {"next_run_at": background.now()}})
+    assert background.claim_due_run(mongo, "compact", "b", 3600)
+
+
+def test_ensure_thread_replaces_only_a_dead_thread():
+    release = threading.Event()
+    thread = background.ensure_thread(None, release.wait, "t")
+    assert background.ensure_thread(thread, release.wait, "t") is thread
+    release.set()
+    thread.join()
+    again = background.ensure_thread(thread, release.wait, "t")
+    assert again is not thread
+    again.join()
@@ -0,0 +1,58 @@
+import pytest
+
+from app.env_vars import parse_bulk_input
+
+
+def test_json_values_as_terraform_reads_them():
+    pairs = parse_bulk_input(
+        '{"ENABLED": true, "DEBUG": false, "COUNT": 3, "RATIO": 0.5, '
+        '"TAGS": {"env": "dev"}, "ZONES": ["a", "b"], "EMPTY": null, "NAME": "web"}'
+    )
+    assert pairs == {
+        "ENABLED": "true",
+        "DEBUG": "false",
+        "COUNT": "3",
+        "RATIO": "0.5",
+        "TAGS": '{"env": "dev"}',
+        "ZONES": '["a", "b"]',
+        "EMPTY": "",
+        "NAME": "web",
+    }
+
+
+def test_json_must_be_an_object():
+    with pytest.raises(ValueError):
+        parse_bulk_input('{"A": 1')
+    with pytest.raises(ValueError):
+        parse_bulk_input("{} extra")
+
+
+def test_env_file():
+    text = """
+# a comment
+export REGION=eastus
+PLAIN = value # trailing comment
+HASH=abc#def
+QUOTED="keep # this"   # but not this
+SINGLE='x y'
+EMPTY=
+URL=https://example.com/?a=b
+"""
+    assert parse_bulk_input(text) == {
+        "REGION": "eastus",
+        "PLAIN": "value",
+        "HASH": "abc#def",
+        "QUOTED": "keep # this",
+        "SINGLE": "x y",
+        "EMPTY": "",
+        "URL": "https://example.com/?a=b",
+    }
+
+
+def test_env_file_errors():
+    with pytest.raises(ValueError, match="Line 1"):
+        parse_bulk_input("NO_EQUALS")
+    with pytest.raises(ValueError, match="unterminated"):
+        parse_bulk_input('A="open')
+    with pytest.raises(ValueError, match="Invalid variable name"):
+        parse_bulk_input("1BAD=x")
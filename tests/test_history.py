@@ -0,0 +1,54 @@
+from datetime import timedelta
+
+from app import background, history
+
+
+def hcl(i):
+    return f'resource "null_resource" "r{i}" {{}}\n'
+
+
+def age_blobs(db, seconds):
+    db.hcl_blobs.update_many({}, {"$set": {"last_used_at": background.now() - timedelta(seconds=seconds)}})
+
+
+def test_blobs_round_trip_and_dedupe(mongo):
+    a = history.put_hcl(mongo, hcl(1) + "   \n\n")
+    b = history.put_hcl(mongo, hcl(1))
+    assert a == b and mongo.hcl_blobs.count_documents({}) == 1
+    assert history.get_hcl(mongo, a) == hcl(1)
+    assert history.get_hcl_many(mongo, [a, "missing"]) == {a: hcl(1)}
+
+
+def test_collect_blobs_in_batches(mongo, monkeypatch):
+    monkeypatch.setattr(history, "DELETE_BATCH", 2)
+    history.ensure_indexes(mongo)
+    for i in range(5):
+        history.record(mongo, "dev@example.com", "ws-1", "p", tf_code=hcl(i))
+    orphans = [history.put_hcl(mongo, hcl(i)) for i in range(5, 10)]
+    age_blobs(mongo, history.BLOB_GRACE_SECONDS + 60)
+    recent = history.put_hcl(mongo, hcl(10))  # unreferenced but inside the grace period
+
+    removed, freed = history.collect_blobs(mongo)
+    assert removed == len(orphans) and freed > 0
+    left = {blob["_id"] for blob in mongo.hcl_blobs.find({}, {"_id": 1})}
+    assert left == set(mongo.generations.distinct("hcl_hash")) | {recent}
+    assert history.collect_blobs(mongo) == (0, 0)
+
+
+def test_compact_trims_each_workspace(mongo):
+    for i in range(5):
+        history.record(mongo, "dev@example.com", "ws-1", f"p{i}", tf_code=hcl(i))
+    history.record(mongo, "dev@example.com", "ws-2", "q", tf_code=hcl(0))
+    assert history.trim_workspaces(mongo, keep=2) == 3
+    entries, cursor = history.page(mongo, "ws-1", "dev@example.com")
+    assert [e["prompt"] for e in entries] == ["p4", "p3"] and cursor is None
+
+
+def test_storage_stats_are_cached(mongo, monkeypatch):
+    monkeypatch.setattr(history, "_stats_cache", history.TTLCache(maxsize=1, ttl=60))
+    history.record(mongo, "dev@example.com", "ws-1", "p", tf_code=hcl(1))
+    first = history.cached_storage_stats(mongo)
+    assert first["blobs"] == 1 and first["generations"] == 1
+    history.record(mongo, "dev@example.com", "ws-1", "p", tf_code=hcl(2))
+    assert history.cached_storage_stats(mongo) == first
+    assert history.storage_stats(mongo)["blobs"] == 2
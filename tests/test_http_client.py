@@ -0,0 +1,135 @@
+import pytest
+import requests
+from requests.adapters import BaseAdapter
+from urllib3.exceptions import MaxRetryError, NewConnectionError, ProtocolError
+
+from app import http_client
+from app.http_client import PooledClient
+
+URL = "https://upstream.test/api"
+
+
+def response(status, headers=None):
+    r = requests.Response()
+    r.status_code = status
+    r.headers.update(headers or {})
+    r._content = b"{}"
+    r.url = URL
+    return r
+
+
+def refused():
+    reason = NewConnectionError(None, "Connection refused")
+    return requests.exceptions.ConnectionError(MaxRetryError(None, URL, reason=reason))
+
+
+def reset_after_send():
+    return requests.exceptions.ConnectionError(ProtocolError("Connection aborted.", ConnectionResetError()))
+
+
+class ScriptedAdapter(BaseAdapter):
+    """Plays back responses / exceptions in order and records each request sent."""
+
+    def __init__(self, script):
+        super().__init__()
+        self.script = list(script)
+        self.sent = []
+
+    def send(self, request, **kwargs):
+        self.sent.append(request.method)
+        item = self.script.pop(0)
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    def close(self):
+        pass
+
+
+class FakeLimiter:
+    def __init__(self, pause=None):
+        self.pause = pause
+        self.acquired = 0
+        self.observed = []
+
+    def acquire(self):
+        self.acquired += 1
+        return 0.0
+
+    def observe(self, r):
+        self.observed.append(r.status_code)
+        return self.pause if r.status_code == 429 else None
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    calls = []
+    monkeypatch.setattr(http_client.time, "sleep", calls.append)
+    return calls
+
+
+def client_with(script, **kwargs):
+    client = PooledClient(max_retries=kwargs.pop("max_retries", 3), backoff_base=0.01, **kwargs)
+    adapter = ScriptedAdapter(script)
+    client._get_session().mount("https://", adapter)
+    return client, adapter
+
+
+def test_idempotent_request_retried_on_server_error(sleeps):
+    client, adapter = client_with([response(503), response(502), response(200)])
+    assert client.get(URL).status_code == 200
+    assert adapter.sent == ["GET"] * 3
+    assert client.stats()["retries"] == 2 and len(sleeps) == 2
+
+
+def test_post_not_retried_on_server_error(sleeps):
+    client, adapter = client_with([response(503), response(200)])
+    assert client.post(URL).status_code == 503
+    assert adapter.sent == ["POST"] and sleeps == []
+
+
+def test_post_retried_on_429_honouring_retry_after(sleeps):
+    client, adapter = client_with([response(429, {"Retry-After": "2"}), response(201)])
+    assert client.post(URL).status_code == 201
+    assert adapter.sent == ["POST", "POST"] and sleeps == [2.0]
+
+
+def test_post_retried_when_the_connection_was_never_opened(sleeps):
+    client, adapter = client_with([refused(), requests.exceptions.ConnectTimeout(), response(201)])
+    assert client.post(URL).status_code == 201
+    assert len(adapter.sent) == 3
+
+
+def test_post_not_retried_once_it_may_have_been_sent(sleeps):
+    client, adapter = client_with([reset_after_send(), response(201)])
+    with pytest.raises(requests.exceptions.ConnectionError):
+        client.post(URL)
+    assert len(adapter.sent) == 1
+
+
+def test_read_timeout_retried_only_when_idempotent(sleeps):
+    client, adapter = client_with([requests.exceptions.ReadTimeout(), response(200)])
+    assert client.get(URL).status_code == 200
+    client, adapter = client_with([requests.exceptions.ReadTimeout(), response(200)])
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        client.post(URL)
+    client, adapter = client_with([requests.exceptions.ReadTimeout(), response(200)])
+    assert client.post(URL, idempotent=True).status_code == 200
+
+
+def test_gives_up_after_max_retries(sleeps):
+    client, adapter = client_with([response(500)] * 3, max_retries=2)
+    assert client.get(URL).status_code == 500
+    client, adapter = client_with([refused()] * 3, max_retries=2)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        client.get(URL)
+    assert len(adapter.sent) == 3
+
+
+def test_every_attempt_goes_through_the_limiter(sleeps):
+    limiter = FakeLimiter(pause=5.0)
+    client, adapter = client_with([response(429), response(200)], rate_limiter=limiter)
+    assert client.post(URL).status_code == 200
+    assert limiter.acquired == 2 and limiter.observed == [429, 200]
+    # The limiter already holds the retry back, so the client adds no backoff of its own.
+    assert sleeps == [0]
@@ -0,0 +1,188 @@
+import itertools
+import threading
+import time
+from datetime import timedelta
+
+import pytest
+
+from app import background, jobs
+
+GOOD_HCL = '''provider "aws" {
+  region = "us-east-1"
+}
+
+resource "aws_s3_bucket" "b" {
+  bucket_prefix = "demo-"
+}
+'''
+
+
+class FakeTfc:
+    """Stands in for Terraform Cloud and the LLM, recording every call."""
+
+    def __init__(self, monkeypatch):
+        self.calls = []
+        self.hcl = GOOD_HCL
+        self.fail_upload = False
+        self.generating = threading.Event()
+        self.during_generate = None  # called while the generate stage runs
+        self._ids = itertools.count(1)
+        monkeypatch.setattr(jobs.retrieval, "add", lambda prompt, hcl: None)
+        monkeypatch.setattr(jobs, "generate_tf_code", self.generate)
+        monkeypatch.setattr(jobs, "create_configuration_version", self.create_config)
+        monkeypatch.setattr(jobs, "upload_tf_to_url", self.upload)
+        monkeypatch.setattr(jobs, "trigger_plan_run", self.trigger)
+        monkeypatch.setattr(jobs, "check_user_permissions", lambda ws: True)
+
+    def generate(self, prompt, bypass_cache=False):
+        self.calls.append("generate")
+        # Hold generation until the configuration version exists: the two overlap.
+        assert self.generating.wait(5)
+        if self.during_generate:
+            self.during_generate()
+        return self.hcl
+
+    def create_config(self, workspace_id, auto_queue_runs=True):
+        cv = f"cv-{next(self._ids)}"
+        self.calls.append(("create", cv))
+        self.generating.set()
+        return {"id": cv, "attributes": {"upload-url": f"https://upload/{cv}"}}
+
+    def upload(self, url, tf_code):
+        self.calls.append(("upload", url))
+        if self.fail_upload:
+            raise RuntimeError("upload failed")
+
+    def trigger(self, workspace_id, config_id):
+        self.calls.append(("trigger", config_id))
+        return f"run-{config_id}"
+
+
+@pytest.fixture
+def tfc(monkeypatch):
+    return FakeTfc(monkeypatch)
+
+
+def run_job(app, **kwargs):
+    runner = app.extensions["jobs"]
+    job_id = runner.submit(owner="dev@example.com", workspace_id="ws-1", workspace_name="demo",
+                           prompt="an s3 bucket", **kwargs)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        job = runner.get(job_id)
+        if job["status"] in jobs.FINAL_STATUSES:
+            return job
+        time.sleep(0.01)
+    raise AssertionError("job did not finish")
+
+
+def spares(app):
+    return list(app.mongo.spare_config_versions.find({}, {"_id": 1, "created_at": 1}))
+
+
+def test_stages_run_as_a_graph(app, tfc):
+    job = run_job(app)
+    assert job["status"] == "succeeded", job["error"]
+    assert {name for name, info in job["stages"].items() if info["status"] == "done"} == {
+        "generate", "create_config_version", "validate", "upload", "trigger_run", "check_permissions",
+    }
+    assert tfc.calls == ["generate", ("create", "cv-1"), ("upload", "https://upload/cv-1"), ("trigger", "cv-1")]
+    assert job["result"]["run_id"] == "run-cv-1" and job["result"]["can_apply"]
+    with app.app_context():
+        assert app.mongo.workspace_configs.find_one({"_id": "ws-1"})["config_version_id"] == "cv-1"
+        assert app.mongo.runs.find_one({"_id": "run-cv-1"}) is not None
+
+
+def test_failed_validation_keeps_config_version_as_spare(app, tfc):
+    tfc.hcl = "not hcl at all, just some words"
+    job = run_job(app)
+    assert job["status"] == "failed" and "Validation failed" in job["error"]
+    assert job["stages"]["upload"]["status"] == "pending"
+    with app.app_context():
+        assert [s["_id"] for s in spares(app)] == ["cv-1"]
+
+    # The next job takes the spare instead of creating a configuration version.
+    tfc.hcl = GOOD_HCL
+    job = run_job(app)
+    assert job["status"] == "succeeded", job["error"]
+    assert [c for c in tfc.calls if c[0] == "create"] == [("create", "cv-1")]
+    with app.app_context():
+        assert spares(app) == []
+
+
+def test_failed_upload_is_not_kept_as_spare(app, tfc):
+    tfc.fail_upload = True
+    job = run_job(app)
+    assert job["status"] == "failed" and "upload failed" in job["error"]
+    with app.app_context():
+        assert spares(app) == []
+
+
+def test_interrupted_upload_is_not_recycled(app, tfc):
+    with app.app_context():
+        job = {
+            "_id": "job-1", "kind": "single", "workspace_id": "ws-1", "prompt": "p",
+            "stages": {"upload": {"status": "running"}},
+        }
+        jobs._recycle_unused_config(job, {"config_id": "cv-9", "upload_url": "u"}, launched=set())
+        assert spares(app) == []
+
+
+def test_spare_keeps_its_creation_time(app, tfc):
+    with app.app_context():
+        created = background.now() - timedelta(seconds=100)
+        app.mongo.spare_config_versions.insert_one(
+            {"_id": "cv-old", "workspace_id": "ws-1", "upload_url": "https://upload/cv-old", "created_at": created}
+        )
+        # The workspace already has this exact HCL, so the taken spare goes back unused.
+        app.mongo.workspace_configs.insert_one(
+            {"_id": "ws-1", "hash": jobs.content_hash(GOOD_HCL), "config_version_id": "cv-live"}
+        )
+    tfc.generating.set()
+    job = run_job(app)
+    assert job["status"] == "succeeded", job["error"]
+    assert job["result"]["reused"] and job["result"]["run_id"] == "run-cv-live"
+    assert not any(c[0] in ("create", "upload") for c in tfc.calls if isinstance(c, tuple))
+    with app.app_context():
+        (spare,) = spares(app)
+        assert spare["_id"] == "cv-old"
+        assert abs(spare["created_at"] - created) < timedelta(milliseconds=1)
+
+
+def execute_now(app, monkeypatch):
+    """Runs a job's stages on this thread, returning the runner and job id."""
+    runner = app.extensions["jobs"]
+    monkeypatch.setattr(runner._pool, "submit", lambda *args: None)
+    job_id = runner.submit(owner="dev@example.com", workspace_id="ws-1", workspace_name="demo", prompt="p")
+    job = runner.get(job_id)
+    with app.app_context():
+        runner._execute(job)
+    return runner, job_id
+
+
+def test_long_stage_keeps_renewing_the_lease(app, tfc, monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_HEARTBEAT_SECONDS", 0.02)
+    leases = []
+
+    def slow_generate():
+        for _ in range(5):
+            time.sleep(0.05)
+            leases.append(app.mongo.jobs.find_one({})["lease_until"])
+
+    tfc.during_generate = slow_generate
+    runner, job_id = execute_now(app, monkeypatch)
+    assert runner.get(job_id)["status"] == "succeeded"
+    assert len(set(leases)) > 1  # renewed while generate was still running
+
+
+def test_job_taken_over_by_another_worker_stops_here(app, tfc, monkeypatch):
+    def stall_past_lease():
+        # This worker stalled; the sweeper of another one claimed the job.
+        app.mongo.jobs.update_one({}, {"$set": {"worker": "other-worker"}})
+
+    tfc.during_generate = stall_past_lease
+    runner, job_id = execute_now(app, monkeypatch)
+    job = runner.get(job_id)
+    assert job["worker"] == "other-worker" and job["status"] == "running"
+    assert job["stages"]["upload"]["status"] == "pending"
+    assert not any(isinstance(c, tuple) and c[0] in ("upload", "trigger") for c in tfc.calls)
@@ -0,0 +1,104 @@
+from bson.objectid import ObjectId
+
+from app import migrations
+
+
+def duplicated(db):
+    """ws-1 recorded three times (oldest first), ws-2 once."""
+    ids = [ObjectId() for _ in range(3)]
+    db.workspaces.insert_many([
+        {"_id": ids[0], "workspace_id": "ws-1", "owner": "alice@example.com", "name": "alice-app"},
+        {"_id": ids[1], "workspace_id": "ws-1", "owner": "bob@example.com", "name": "alice-app"},
+        {"_id": ids[2], "workspace_id": "ws-1", "owner": "bob@example.com", "name": "alice-app"},
+        {"_id": ObjectId(), "workspace_id": "ws-2", "owner": "bob@example.com", "name": "bob-api"},
+    ])
+    return ids
+
+
+def test_unique_index_replaces_the_old_one(mongo):
+    mongo.workspaces.create_index("workspace_id")
+    mongo.workspaces.insert_one({"workspace_id": "ws-1"})
+    assert migrations.ensure_indexes(mongo) == []
+    assert mongo.workspaces.index_information()["workspace_id_1"].get("unique")
+    assert migrations.ensure_indexes(mongo) == []  # already unique: nothing to do
+
+
+def test_duplicates_keep_the_index_non_unique_and_are_never_deleted(mongo):
+    ids = duplicated(mongo)
+    duplicates = migrations.ensure_indexes(mongo)
+    assert [(d["workspace_id"], [r["_id"] for r in d["records"]]) for d in duplicates] == [("ws-1", ids)]
+    index = mongo.workspaces.index_information()["workspace_id_1"]
+    assert not index.get("unique")
+    assert mongo.workspaces.count_documents({}) == 4
+
+
+def test_dedupe_lists_owners_and_deletes_only_when_confirmed(app):
+    with app.app_context():
+        ids = duplicated(app.mongo)
+    runner = app.test_cli_runner()
+
+    result = runner.invoke(args=["dedupe-workspaces"], input="n\n")
+    assert result.exit_code != 0
+    assert "ws-1:" in result.output and "bob@example.com" in result.output
+    assert f"keep   {ids[0]}  alice@example.com" in result.output
+    assert "Delete 2 duplicate records?" in result.output
+    with app.app_context():
+        assert app.mongo.workspaces.count_documents({}) == 4
+
+    result = runner.invoke(args=["dedupe-workspaces"], input="y\n")
+    assert result.exit_code == 0, result.output
+    assert "Deleted 2 duplicate records." in result.output
+    with app.app_context():
+        assert [ws["_id"] for ws in app.mongo.workspaces.find({"workspace_id": "ws-1"})] == [ids[0]]
+        assert app.mongo.workspaces.index_information()["workspace_id_1"].get("unique")
+
+    result = runner.invoke(args=["dedupe-workspaces"])
+    assert "No duplicate workspace records." in result.output
+
+
+def test_requests_do_not_touch_duplicates(app, client, monkeypatch):
+    from app import main
+    monkeypatch.setattr(main, "_indexes_ready", False)
+    with app.app_context():
+        duplicated(app.mongo)
+    assert client.get("/login").status_code == 200
+    assert main._indexes_ready
+    with app.app_context():
+        assert app.mongo.workspaces.count_documents({}) == 4
+
+
+def test_migration_refuses_to_run_over_duplicates(app):
+    with app.app_context():
+        duplicated(app.mongo)
+    result = app.test_cli_runner().invoke(args=["migrate-workspaces"])
+    assert result.exit_code != 0 and "dedupe-workspaces" in result.output
+
+
+def test_migration_reports_a_workspace_embedded_by_two_users(app):
+    with app.app_context():
+        migrations.ensure_indexes(app.mongo)
+        app.mongo.users.insert_many([
+            {"email": "alice@example.com", "workspaces": [
+                {"_id": ObjectId(), "workspace_id": "ws-shared", "name": "shared"},
+                {"_id": ObjectId(), "workspace_id": "ws-a", "name": "alice-app"},
+            ]},
+            {"email": "bob@example.com", "workspaces": [
+                {"_id": ObjectId(), "workspace_id": "ws-shared", "name": "shared"},
+            ]},
+            {"email": "carol@example.com", "workspaces": [
+                {"_id": ObjectId(), "workspace_id": "ws-c", "name": "carol-db"},
+            ]},
+        ])
+        users, written, conflicts = migrations.migrate_embedded_workspaces(app.mongo)
+        assert (users, written) == (2, 3)
+        assert conflicts == [("bob@example.com", "ws-shared")]
+        assert sorted(u["email"] for u in app.mongo.users.find({"workspaces": {"$exists": True}})) == ["bob@example.com"]
+        assert app.mongo.workspaces.find_one({"workspace_id": "ws-shared"})["owner"] == "alice@example.com"
+        assert app.mongo.workspaces.count_documents({}) == 3
+
+        # Bob's record elsewhere stays put on a re-run, and is still reported.
+        assert migrations.migrate_embedded_workspaces(app.mongo) == (0, 0, [("bob@example.com", "ws-shared")])
+
+    result = app.test_cli_runner().invoke(args=["migrate-workspaces"])
+    assert result.exit_code == 0, result.output
+    assert "Not migrated: bob@example.com embeds ws-shared" in result.output
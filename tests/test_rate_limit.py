@@ -0,0 +1,75 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app import metrics, rate_limit
+from app.rate_limit import RateLimiter
+
+
+class FakeClock:
+    """Stands in for the time module: sleep() advances time() instantly."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limit, "time", clock)
+    return clock
+
+
+def response(status=200, **headers):
+    return SimpleNamespace(status_code=status, headers={k.replace("_", "-"): v for k, v in headers.items()})
+
+
+def test_burst_goes_straight_through_then_requests_are_spaced(clock):
+    limiter = RateLimiter("t", rate=10, burst=3)
+    waits = [limiter.acquire() for _ in range(5)]
+    assert waits[:3] == [0, 0, 0]
+    assert clock.sleeps == pytest.approx([0.1, 0.1])
+    stats = limiter.stats()
+    assert (stats["acquired"], stats["delayed"], stats["max_wait_seconds"]) == (5, 2, 0.1)
+
+
+def test_retry_after_blocks_every_caller_sharing_the_store(clock):
+    store = rate_limit.MemoryStore()
+    first, second = RateLimiter("t", rate=100, store=store), RateLimiter("t", rate=100, store=store)
+    assert first.observe(response(429, Retry_After="2")) == 2.0
+    assert second.acquire() == pytest.approx(2.0)
+    assert first.stats()["throttle_events"] == 1
+
+
+def test_429_without_retry_after_pauses_one_second(clock):
+    limiter = RateLimiter("t", rate=100)
+    assert limiter.observe(response(429)) == 1.0
+
+
+def test_exhausted_remaining_pauses_until_reset(clock):
+    limiter = RateLimiter("t", rate=100)
+    assert limiter.observe(response(X_RateLimit_Remaining="5", X_RateLimit_Reset="3")) is None
+    assert limiter.acquire() == 0
+    assert limiter.observe(response(X_RateLimit_Remaining="0", X_RateLimit_Reset="3")) == 3.0
+    assert limiter.acquire() == pytest.approx(3.0)
+
+
+def test_limiter_stats_are_exported_for_prometheus(clock):
+    limiter = RateLimiter("tfc", rate=10, burst=1)
+    limiter.acquire()
+    limiter.acquire()
+    limiter.observe(response(429, Retry_After="1"))
+    text = metrics.render_prometheus([limiter])
+    assert "# TYPE app_rate_limit_acquired_total counter" in text
+    assert 'app_rate_limit_acquired_total{limiter="tfc"} 2' in text
+    assert 'app_rate_limit_delayed_total{limiter="tfc"} 1' in text
+    assert 'app_rate_limit_throttle_events_total{limiter="tfc"} 1' in text
+    assert 'app_rate_limit_max_wait_seconds{limiter="tfc"} 0.1' in text
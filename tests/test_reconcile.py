@@ -0,0 +1,117 @@
+from datetime import timedelta
+
+import pytest
+from bson.objectid import ObjectId
+
+from app import background, migrations, reconcile
+
+
+@pytest.fixture
+def db(mongo, monkeypatch):
+    migrations.ensure_indexes(mongo)
+    reconcile.ensure_indexes(mongo)
+    monkeypatch.setattr(reconcile, "invalidate_workspace_list", lambda org: None)
+    mongo.users.insert_many([{"email": "alice@example.com"}, {"email": "bob@example.com"}])
+    return mongo
+
+
+def old_id(n=0):
+    """A distinct _id from an hour ago, i.e. a record older than any sweep here."""
+    return ObjectId.from_datetime(background.now() - timedelta(hours=1, seconds=n))
+
+
+def listing(monkeypatch, names, exists=()):
+    """Serves `names` ({workspace_id: name}) as a one-page org listing."""
+    data = [{"id": wid, "attributes": {"name": name}} for wid, name in names.items()]
+    monkeypatch.setattr(reconcile, "fetch_workspace_page", lambda org, page: {
+        "data": data, "meta": {"pagination": {"total-pages": 1}},
+    })
+    monkeypatch.setattr(reconcile, "workspace_exists", lambda wid: wid in exists)
+
+
+def test_sweep_adds_app_created_and_removes_missing(db, monkeypatch):
+    db.workspaces.insert_many([
+        {"_id": old_id(), "workspace_id": "ws-kept", "name": "alice-app", "owner": "alice@example.com"},
+        {"_id": old_id(1), "workspace_id": "ws-gone", "name": "alice-old", "owner": "alice@example.com"},
+        # Not in the listing, but it still exists (the listing shifted while paging).
+        {"_id": old_id(2), "workspace_id": "ws-moved", "name": "bob-x", "owner": "bob@example.com"},
+        # Created after the sweep started, so not listed yet.
+        {"_id": ObjectId(), "workspace_id": "ws-new", "name": "bob-y", "owner": "bob@example.com"},
+    ])
+    # Bob's job is still running against a workspace whose record never got written.
+    db.jobs.insert_one({"workspace_id": "ws-bob", "owner": "bob@example.com", "status": "running"})
+    db.pending_deletions.insert_one({"_id": "ws-deleting", "next_attempt_at": background.now() + timedelta(hours=1)})
+    listing(monkeypatch, {
+        "ws-kept": "alice-app",
+        "ws-bob": "bob-api",
+        "ws-nobody": "alice-db",  # named like Alice's, but nothing ties it to her
+        "ws-deleting": "alice-tmp",
+    }, exists={"ws-moved"})
+    state_started = background.now() - timedelta(minutes=1)
+    db.reconcile_state.insert_one({"_id": "org", "sweep": "s1", "started_at": state_started, "next_page": 1})
+
+    summary = reconcile.sweep_step(db, "org")
+    assert summary == {"pages": 1, "removed": 1, "added": 1, "unrecorded": 1}
+    by_id = {ws["workspace_id"]: ws for ws in db.workspaces.find()}
+    assert set(by_id) == {"ws-kept", "ws-moved", "ws-new", "ws-bob"}
+    assert by_id["ws-bob"]["owner"] == "bob@example.com" and by_id["ws-bob"]["vars"] == []
+    assert db.reconcile_state.find_one({"_id": "org"})["unrecorded"] == [{"workspace_id": "ws-nobody", "name": "alice-db"}]
+    assert db.reconcile_seen.count_documents({}) == 0
+
+
+def test_only_workspaces_the_app_is_working_on_are_adopted(db):
+    db.reconcile_seen.insert_many([
+        {"_id": wid, "sweep": "s1", "name": wid}
+        for wid in ("ws-spare", "ws-done", "ws-shared", "ws-queued")
+    ])
+    db.spare_config_versions.insert_many([
+        {"_id": "cv-1", "workspace_id": "ws-spare", "created_at": background.now()},
+        {"_id": "cv-2", "workspace_id": "ws-shared", "created_at": background.now()},
+    ])
+    db.jobs.insert_many([
+        {"workspace_id": "ws-spare", "owner": "alice@example.com", "status": "succeeded"},
+        {"workspace_id": "ws-done", "owner": "alice@example.com", "status": "succeeded"},
+        {"workspace_id": "ws-shared", "owner": "alice@example.com", "status": "succeeded"},
+        {"workspace_id": "ws-shared", "owner": "bob@example.com", "status": "failed"},
+        {"workspace_id": "ws-queued", "owner": "bob@example.com", "status": "queued"},
+    ])
+    ops, unrecorded = reconcile.plan_fixes(db, "s1", background.now())
+    db.workspaces.bulk_write(ops, ordered=False)
+    assert {ws["workspace_id"]: ws["owner"] for ws in db.workspaces.find()} == {
+        "ws-spare": "alice@example.com", "ws-queued": "bob@example.com",
+    }
+    assert [ws["workspace_id"] for ws in unrecorded] == ["ws-done", "ws-shared"]
+
+
+def test_planned_adds_are_upserts(db, monkeypatch):
+    listing(monkeypatch, {"ws-bob": "bob-api"})
+    db.reconcile_seen.insert_one({"_id": "ws-bob", "sweep": "s1", "name": "bob-api"})
+    db.jobs.insert_one({"workspace_id": "ws-bob", "owner": "bob@example.com", "status": "queued"})
+    ops, _ = reconcile.plan_fixes(db, "s1", background.now())
+    assert ops
+    # A concurrent import recorded it between planning and writing.
+    db.workspaces.insert_one({"workspace_id": "ws-bob", "name": "bob-api", "owner": "bob@example.com", "vars": ["x"]})
+    result = db.workspaces.bulk_write(ops, ordered=False)
+    assert result.upserted_count == 0
+    assert [ws["vars"] for ws in db.workspaces.find({"workspace_id": "ws-bob"})] == [["x"]]
+
+
+def test_cli_takes_the_lease_and_starts_no_threads(app, monkeypatch):
+    listing(monkeypatch, {})
+    monkeypatch.setattr(reconcile, "invalidate_workspace_list", lambda org: None)
+    runner = app.test_cli_runner()
+
+    with app.app_context():
+        app.mongo.locks.insert_one({"_id": "reconciler", "owner": "other", "expires_at": background.now() + timedelta(minutes=1)})
+    result = runner.invoke(args=["reconcile-workspaces"])
+    assert result.exit_code != 0 and "Another process is reconciling" in result.output
+
+    with app.app_context():
+        app.mongo.locks.delete_many({})
+    result = runner.invoke(args=["reconcile-workspaces"])
+    assert result.exit_code == 0, result.output
+    assert "Listed 1 pages: removed 0, added 0." in result.output
+    with app.app_context():
+        assert app.mongo.locks.count_documents({}) == 0  # released for the background reconciler
+    assert app.extensions["reconciler"]._thread is None
+    assert app.extensions["jobs"]._sweeper is None
@@ -0,0 +1,112 @@
+import pytest
+
+from app import retrieval
+from app.retrieval import TfidfIndex, specifics
+
+RG = "create an azure resource group"
+
+
+def test_specifics():
+    assert specifics("Create an Azure resource group") == frozenset()
+    assert specifics("resource group in East US 2") == {"east", "us", "2"}
+    assert specifics("an ec2 instance, t3.large") == {"ec2", "t3", "large"}
+    assert specifics('s3 bucket named logs and a queue called "jobs q"') == {"s3", "name:logs", "name:jobs q"}
+
+
+@pytest.mark.parametrize("prompt", [
+    "create an azure resource group in east us 2",
+    "azure resource group in west europe",
+    "create an s3 bucket in eu-west-1",
+    "create an s3 bucket in eu-central-1 with versioning",
+    "azure storage account in north europe",
+    "create an aws vpc with a public subnet 10.20.0.0/16",
+    "create an s3 bucket named audit-logs",
+])
+def test_near_misses_fall_through_to_the_model(prompt):
+    # However low the threshold: the stored phrasings lack the prompt's specifics.
+    assert retrieval.lookup(prompt, threshold=0.1) is None
+
+
+@pytest.mark.parametrize("prompt, stored", [
+    ("Create an Azure resource group", RG),
+    ("make me an azure rg", RG),
+    ("azure resource group in east us", "azure resource group in east us"),
+    ("versioned s3 bucket please", "versioned s3 bucket"),
+])
+def test_rephrasings_match(prompt, stored):
+    match = retrieval.lookup(prompt)
+    assert match is not None and match["prompt"] == stored and match["score"] >= retrieval.THRESHOLD
+    assert match["hcl_hash"] == retrieval.history.hcl_hash(match["hcl"])
+
+
+def test_sizes_must_match():
+    index = TfidfIndex()
+    index.add("create an aws ec2 instance t3.micro", "micro hcl", "history")
+    index.add("create an aws ec2 instance", "generic hcl", "history")
+    score, doc = index.search("create an aws ec2 instance t3.micro")
+    assert doc.hcl == "micro hcl" and score == pytest.approx(1.0)
+    # Closest by wording is the t3.micro one, but it lacks "large".
+    score, doc = index.search("create an aws ec2 instance t3.large")
+    assert doc is None
+    # The generic phrasing may answer an unspecific prompt.
+    assert index.search("new ec2 instance on aws")[1].hcl == "generic hcl"
+
+
+@pytest.fixture
+def logged_in(client):
+    client.post("/register", data={"email": "dev@example.com", "password": "pw"})
+    with client.session_transaction() as sess:
+        sess["selected_workspace_id"] = "ws-1"
+        sess["selected_workspace_name"] = "demo"
+    return client
+
+
+@pytest.fixture
+def submitted(app, monkeypatch):
+    calls = []
+
+    def submit(**kwargs):
+        calls.append(kwargs)
+        return "0" * 24
+
+    monkeypatch.setattr(app.extensions["jobs"], "submit", submit)
+    return calls
+
+
+def test_generate_offers_match_and_deploys_only_on_confirm(logged_in, submitted):
+    r = logged_in.post("/generate", data={"prompt": RG})
+    assert r.status_code == 200 and b"Use this HCL and plan" in r.data
+    assert b'azurerm_resource_group' in r.data
+    assert submitted == []
+
+    offer = retrieval.lookup(RG)
+    r = logged_in.post("/generate", data={"prompt": RG, "use_known": offer["hcl_hash"]})
+    assert r.status_code == 302
+    (job,) = submitted
+    assert job["tf_code"] == offer["hcl"] and job["retrieved"]["prompt"] == RG
+
+
+def test_generate_stale_confirmation_offers_again(logged_in, submitted):
+    r = logged_in.post("/generate", data={"prompt": RG, "use_known": "not-the-offered-hash"})
+    assert r.status_code == 200 and b"Use this HCL and plan" in r.data
+    assert submitted == []
+
+
+def test_generate_can_skip_the_offer(logged_in, submitted):
+    r = logged_in.post("/generate", data={"prompt": RG, "skip_known": "1"})
+    assert r.status_code == 302
+    (job,) = submitted
+    assert job["tf_code"] is None and job["retrieved"] is None
+
+
+def test_specific_prompt_goes_to_the_model(logged_in, submitted):
+    r = logged_in.post("/generate", data={"prompt": RG + " in east us 2"})
+    assert r.status_code == 302
+    assert submitted[0]["tf_code"] is None
+
+
+def test_stream_shows_match_without_deploying(logged_in, submitted):
+    r = logged_in.post("/generate/stream", data={"prompt": RG})
+    body = r.get_data(as_text=True)
+    assert "not deployed" in body and "azurerm_resource_group" in body
+    assert submitted == []
